@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from contextlib import nullcontext
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
@@ -11,21 +12,29 @@ from app.schemas.schemas import (
     GenerateRequest, GenerateResponse, GenerationHistory,
     BrandVoiceUpdate, BrandVoiceResponse, SaveGenerationRequest,
     MessageResponse, ChannelResult, ImproveRequest, ImproveResponse,
+    ImproveBatchRequest, ImproveBatchResponse, ImproveBatchResult,
     BrandVoiceExampleCreate, BrandVoiceExampleResponse, BrandVoiceAnalyzeRequest, BrandVoiceAnalyzeResponse,
-    HashtagsRequest, HashtagsResponse, SeriesRequest, SeriesResponse,
+    HashtagsRequest, HashtagsResponse, HashtagAutocompleteResponse, SeriesRequest, SeriesResponse,
     ContentPlanRequest, ContentPlanResponse, AudienceAnalysisRequest, AudienceAnalysisResponse,
     ImageGenerateRequest, ImageGenerateResponse,
-    ImageSettingsUpdate, ImageSettingsResponse
+    ImageSettingsUpdate, ImageSettingsResponse, RegenerateRequest, RegenerateResponse,
+    LLMRouteUpdate, LLMRouteStatus, LLMProviderHealth, AdmissionUserStatus
 )
 from app.services.auth import (
     create_user, authenticate_user, create_access_token,
     get_user_by_id, get_user_by_email, decode_token
 )
-from app.services.generator import generate_content
+from app.services.generator import generate_content, generate_channel_variants, patch_generation_variants, failed_channels
+from app.services.semantic_cache import semantic_cache, lookup_generation, remember_generation, cacheable, cache_brief
+from app.services.hashtag_engine import hashtag_engine, record_served_hashtags
+from app.services.hashtag_index import hashtag_index
+from app.services.admission import slot, SYNC, BACKGROUND
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/login")
 
+REGENERATE_FIELDS = {"goal", "tone", "audience", "offer", "format"}
+
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
@@ -122,24 +131,52 @@ async def generate(
                 detail=f"Invalid channel: {ch}"
             )
     
-    results = await generate_content(request, db)
+    cache_hit = lookup_generation(request, current_user.id)
+    if cache_hit:
+        cached_id, similarity = cache_hit
+        result = await db.execute(
+            select(Generation)
+            .where(Generation.id == cached_id, Generation.user_id == current_user.id)
+        )
+        cached = result.scalar_one_or_none()
+        if cached:
+            return GenerateResponse(
+                results=cached.variants,
+                generation_id=cached.id,
+                cached=True,
+                cache_similarity=round(similarity, 4)
+            )
+        semantic_cache.discard(cached_id)
+    
+    async with slot(SYNC, current_user):
+        results = await generate_content(request, db)
     
     results_dict: Dict[str, List[Dict[str, Any]]] = {}
     for channel, variants in results.items():
         results_dict[channel] = [v.model_dump() for v in variants]
     
+    remember = cacheable(request, results_dict)
     generation = Generation(
         user_id=current_user.id,
         description=request.description,
         channels=request.channels,
         variants=results_dict,
-        num_variants=request.num_variants
+        num_variants=request.num_variants,
+        brief=cache_brief(request),
+        cacheable=remember
     )
     db.add(generation)
     await db.commit()
     await db.refresh(generation)
-    
-    return GenerateResponse(results=results_dict, generation_id=generation.id)
+    if remember:
+        remember_generation(request, current_user.id, generation.id)
+    hashtag_engine.add_generation(request.description, results_dict)
+    
+    return GenerateResponse(
+        results=results_dict,
+        generation_id=generation.id,
+        failed_channels=failed_channels(results)
+    )
 
 
 @router.get("/history", response_model=List[GenerationHistory])
@@ -189,6 +226,64 @@ async def save_generation(
     return MessageResponse(message="Generation saved successfully")
 
 
+@router.post("/history/{generation_id}/regenerate", response_model=RegenerateResponse)
+async def regenerate_generation(
+    generation_id: int,
+    data: RegenerateRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(
+        select(Generation)
+        .where(Generation.id == generation_id, Generation.user_id == current_user.id)
+    )
+    generation = result.scalar_one_or_none()
+    if not generation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Generation not found"
+        )
+    
+    existing = (generation.variants or {}).get(data.channel)
+    if existing is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Channel not in generation: {data.channel}"
+        )
+    if data.variant_index is not None and data.variant_index >= len(existing):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid variant index: {data.variant_index}"
+        )
+    
+    brief = {field: value for field, value in (generation.brief or {}).items() if field in REGENERATE_FIELDS}
+    request = GenerateRequest(
+        description=generation.description,
+        channels=[data.channel],
+        num_variants=1 if data.variant_index is not None else len(existing),
+        **{**brief, **data.model_dump(include=REGENERATE_FIELDS, exclude_none=True)}
+    )
+    async with slot(SYNC, current_user):
+        variants = await generate_channel_variants(request, data.channel, request.num_variants, db)
+    
+    if data.variant_index is not None:
+        await patch_generation_variants(
+            db, generation.id, [data.channel, str(data.variant_index)], variants[0].model_dump()
+        )
+    else:
+        await patch_generation_variants(
+            db, generation.id, [data.channel], [v.model_dump() for v in variants]
+        )
+    await db.commit()
+    
+    return RegenerateResponse(
+        generation_id=generation.id,
+        channel=data.channel,
+        variant_index=data.variant_index,
+        variants=variants
+    )
+
+
 @router.delete("/history/{generation_id}", response_model=MessageResponse)
 async def delete_generation(
     generation_id: int,
@@ -207,6 +302,7 @@ async def delete_generation(
         )
     await db.delete(generation)
     await db.commit()
+    semantic_cache.discard(generation_id)
     return MessageResponse(message="Generation deleted successfully")
 
 
@@ -253,7 +349,7 @@ async def improve_text(
     data: ImproveRequest,
     current_user: User = Depends(get_current_user)
 ):
-    from app.services.improver import improve_text as do_improve, ImproveAction
+    from app.services.improver import improve_text as do_improve, ImproveAction, use_local
     
     try:
         improve_action = ImproveAction(action)
@@ -263,12 +359,15 @@ async def improve_text(
             detail=f"Invalid action. Valid values: shorten, emoji, tone, cta"
         )
     
-    improved = await do_improve(
-        text=data.text,
-        action=improve_action,
-        channel=data.channel,
-        target_tone=data.target_tone
-    )
+    async with nullcontext() if use_local(improve_action, data.quality) else slot(SYNC, current_user):
+        improved = await do_improve(
+            text=data.text,
+            action=improve_action,
+            channel=data.channel,
+            target_tone=data.target_tone,
+            goal=data.goal,
+            quality=data.quality
+        )
     
     return ImproveResponse(
         original_text=data.text,
@@ -277,6 +376,76 @@ async def improve_text(
     )
 
 
+@router.post("/improve/{action}/batch", response_model=ImproveBatchResponse)
+async def improve_batch(
+    action: str,
+    data: ImproveBatchRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    from app.services.improver import improve_batch as do_improve_batch, use_local, ImproveAction
+    
+    try:
+        improve_action = ImproveAction(action)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid action. Valid values: shorten, emoji, tone, cta"
+        )
+    
+    generation = None
+    if data.generation_id is not None:
+        result = await db.execute(
+            select(Generation)
+            .where(Generation.id == data.generation_id, Generation.user_id == current_user.id)
+        )
+        generation = result.scalar_one_or_none()
+        if not generation:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Generation not found"
+            )
+        targets = [
+            (channel, index, variant.get("body") or "")
+            for channel, variants in (generation.variants or {}).items()
+            for index, variant in enumerate(variants or [])
+            if isinstance(variant, dict) and (variant.get("body") or "").strip()
+        ]
+    elif data.items:
+        targets = [(item.channel, None, item.text) for item in data.items]
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either generation_id or items is required"
+        )
+    
+    async with nullcontext() if use_local(improve_action, data.quality) else slot(BACKGROUND, current_user):
+        improved = await do_improve_batch(
+            [(text, channel) for channel, _, text in targets],
+            improve_action,
+            target_tone=data.target_tone,
+            goal=data.goal,
+            quality=data.quality
+        )
+    
+    if generation is not None:
+        variants = {channel: list(items) for channel, items in generation.variants.items()}
+        for (channel, index, _), text in zip(targets, improved):
+            variants[channel][index] = {**variants[channel][index], "body": text}
+        for channel in dict.fromkeys(channel for channel, _, _ in targets):
+            await patch_generation_variants(db, generation.id, [channel], variants[channel])
+        await db.commit()
+    
+    return ImproveBatchResponse(
+        action=action,
+        generation_id=data.generation_id,
+        results=[
+            ImproveBatchResult(channel=channel, variant_index=index, original_text=text, improved_text=new_text)
+            for (channel, index, text), new_text in zip(targets, improved)
+        ]
+    )
+
+
 @router.get("/brand-voice/examples", response_model=List[BrandVoiceExampleResponse])
 async def get_brand_voice_examples(
     channel: str = None,
@@ -345,12 +514,13 @@ async def analyze_brand_voice(
 ):
     from app.services.brand_analyzer import analyze_brand_voice as do_analyze
     
-    result = await do_analyze(
-        db=db,
-        user_id=current_user.id,
-        channel=data.channel,
-        example_ids=data.example_ids
-    )
+    async with slot(BACKGROUND, current_user):
+        result = await do_analyze(
+            db=db,
+            user_id=current_user.id,
+            channel=data.channel,
+            example_ids=data.example_ids
+        )
     
     return result
 
@@ -358,19 +528,35 @@ async def analyze_brand_voice(
 @router.post("/hashtags/generate", response_model=HashtagsResponse)
 async def generate_hashtags(
     data: HashtagsRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     from app.services.hashtags import generate_hashtags as do_generate
     
-    result = await do_generate(
-        text=data.text,
-        channel=data.channel,
-        count=data.count
-    )
+    async with nullcontext() if not data.creative or settings.MOCK_MODE else slot(SYNC, current_user):
+        result = await do_generate(
+            text=data.text,
+            channel=data.channel,
+            count=data.count,
+            creative=data.creative
+        )
+    try:
+        await record_served_hashtags(db, result["hashtags"] + result["selling_hashtags"])
+    except Exception as e:
+        print(f"Failed to record served hashtags: {e}")
     
     return HashtagsResponse(**result)
 
 
+@router.get("/hashtags/autocomplete", response_model=HashtagAutocompleteResponse)
+async def autocomplete_hashtags(
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=10),
+    current_user: User = Depends(get_current_user)
+):
+    return HashtagAutocompleteResponse(suggestions=hashtag_index.complete(q, limit))
+
+
 @router.post("/series/generate", response_model=SeriesResponse)
 async def generate_series(
     data: SeriesRequest,
@@ -378,13 +564,14 @@ async def generate_series(
 ):
     from app.services.series import generate_series as do_generate
     
-    posts = await do_generate(
-        topic=data.topic,
-        channel=data.channel,
-        count=data.count,
-        goal=data.goal,
-        tone=data.tone
-    )
+    async with slot(BACKGROUND, current_user):
+        posts = await do_generate(
+            topic=data.topic,
+            channel=data.channel,
+            count=data.count,
+            goal=data.goal,
+            tone=data.tone
+        )
     
     return SeriesResponse(topic=data.topic, posts=posts)
 
@@ -396,12 +583,13 @@ async def generate_content_plan(
 ):
     from app.services.content_plan import generate_content_plan as do_generate
     
-    plan = await do_generate(
-        product=data.product,
-        days=data.duration_days,
-        channels=data.channels,
-        goal=data.goal
-    )
+    async with slot(BACKGROUND, current_user):
+        plan = await do_generate(
+            product=data.product,
+            days=data.duration_days,
+            channels=data.channels,
+            goal=data.goal
+        )
     
     return ContentPlanResponse(plan=plan)
 
@@ -413,10 +601,11 @@ async def analyze_audience(
 ):
     from app.services.audience import analyze_audience as do_analyze
     
-    result = await do_analyze(
-        product=data.product,
-        description=data.description
-    )
+    async with slot(SYNC, current_user):
+        result = await do_analyze(
+            product=data.product,
+            description=data.description
+        )
     
     return result
 
@@ -429,11 +618,12 @@ async def generate_image(
 ):
     from app.services.media import generate_image as do_generate
     
-    result = await do_generate(
-        prompt=data.prompt,
-        channel=data.channel,
-        db=db
-    )
+    async with slot(SYNC, current_user):
+        result = await do_generate(
+            prompt=data.prompt,
+            channel=data.channel,
+            db=db
+        )
     
     return result
 
@@ -477,3 +667,65 @@ async def update_image_settings(
     }
     
     return ImageSettingsResponse(**response_data)
+
+
+@router.get("/metrics")
+async def get_metrics(
+    current_user: User = Depends(get_current_admin_user)
+):
+    from app.core.metrics import metrics
+    from app.services.llm import parse_failure_rates
+    
+    snapshot = metrics.snapshot()
+    snapshot["parse_failure_rates"] = parse_failure_rates()
+    return snapshot
+
+
+@router.get("/llm/routes", response_model=List[LLMRouteStatus])
+async def get_llm_routes(
+    current_user: User = Depends(get_current_admin_user)
+):
+    from app.services.routing import routes
+    
+    return routes.status()
+
+
+@router.get("/llm/providers", response_model=List[LLMProviderHealth])
+async def get_llm_providers(
+    current_user: User = Depends(get_current_admin_user)
+):
+    from app.services.routing import provider_health
+    
+    return provider_health.snapshot()
+
+
+@router.get("/admission/users", response_model=List[AdmissionUserStatus])
+async def get_admission_users(
+    current_user: User = Depends(get_current_admin_user)
+):
+    from app.services.admission import admission
+    
+    return admission.status()
+
+
+@router.put("/llm/routes/{task}", response_model=LLMRouteStatus)
+async def update_llm_route(
+    task: str,
+    data: LLMRouteUpdate,
+    current_user: User = Depends(get_current_admin_user)
+):
+    from app.services.routing import routes, PROVIDERS
+    
+    if not routes.known(task):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown task: {task}"
+        )
+    if data.provider is not None and data.provider not in PROVIDERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown provider. Available: {', '.join(sorted(PROVIDERS))}"
+        )
+    
+    routes.update(task, data)
+    return next(route for route in routes.status() if route.task == task)
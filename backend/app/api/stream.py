@@ -1,278 +1,366 @@
 import json
 import asyncio
-from typing import Dict, List
-from fastapi import APIRouter, Depends
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import delete, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.database import get_db
+from app.core.database import get_db, detached_context, AsyncSessionLocal
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.deadline import expired as deadline_expired, remaining as remaining_time
 from app.models.models import User, Generation
 from app.api.endpoints import get_current_user
-from app.schemas.schemas import GenerateRequest, ChannelResult
+from app.schemas.schemas import GenerateRequest, ChannelResult, ImproveRequest
 from app.services.generator import (
-    generate_with_openai, generate_with_yandex, generate_mock_response,
-    build_prompt, parse_llm_response, get_brand_voice
+    generate_mock_response, build_channel_prompt, get_brand_voice, is_short_format, parse_llm_response,
+    failed_variants, mark_unrecovered, retry_failed_channels, regenerate_duplicates, failed_channels, IMAGE_MIN_SECONDS
+)
+from app.services.validator import enforce_constraints
+from app.services.semantic_cache import semantic_cache, lookup_generation, remember_generation, cacheable, cache_brief
+from app.services.hashtag_engine import hashtag_engine
+from app.services.budget import generation_max_tokens
+from app.services.llm import channels_schema, complete, llm_available
+from app.services.event_bus import event_bus, format_event
+from app.services.admission import admission, Ticket, INTERACTIVE
+from app.services.generation_tasks import (
+    GenerationTask, parse_last_event_id, task_key, shared_key, stream_name, subscribe, find_task, get_task, start_task
 )
 
 router = APIRouter()
 
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+
+async def pump(events: AsyncIterator[str], queue: asyncio.Queue) -> None:
+    try:
+        async for event in events:
+            queue.put_nowait(event)
+    finally:
+        queue.put_nowait(None)
+
+
+async def disconnect_aware(endpoint: str, events: AsyncIterator[str]) -> AsyncIterator[str]:
+    queue: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.create_task(pump(events, queue), context=detached_context())
+    finished = False
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+        finished = True
+        await producer
+    finally:
+        if not finished:
+            metrics.inc("stream_disconnects_total", endpoint=endpoint, policy="cancel")
+            producer.cancel()
+
+
+def event_response(
+    events: AsyncIterator[str],
+    generation_id: Optional[int] = None,
+    ticket: Optional[Ticket] = None
+) -> StreamingResponse:
+    headers = dict(SSE_HEADERS)
+    if generation_id is not None:
+        headers["X-Generation-Id"] = str(generation_id)
+    background = BackgroundTask(ticket.release) if ticket else None
+    return StreamingResponse(events, media_type="text/event-stream", headers=headers, background=background)
+
 
 async def add_images_to_variants(variants: List[ChannelResult], channel: str) -> List[ChannelResult]:
     from app.services.media import generate_image
     
     for i, variant in enumerate(variants):
         if variant.image_prompt:
+            left = remaining_time()
+            if left is not None and left < IMAGE_MIN_SECONDS:
+                metrics.inc("generate_images_skipped_total", channel=channel, reason="deadline")
+                continue
             try:
                 image_response = await generate_image(variant.image_prompt, channel)
-                variants[i] = ChannelResult(
-                    headline=variant.headline,
-                    body=variant.body,
-                    cta=variant.cta,
-                    hashtags=variant.hashtags,
-                    image_prompt=variant.image_prompt,
-                    image_url=image_response.image_url,
-                    score=variant.score,
-                    improvements=variant.improvements
-                )
+                variants[i] = variant.model_copy(update={"image_url": image_response.image_url})
             except Exception as e:
                 print(f"Image generation failed for {channel}: {e}")
     return variants
 
 
-async def stream_generate_with_openai(prompt: str, channels: List[str], num_variants: int):
-    from openai import AsyncOpenAI
+async def generate_stream_channel(request: GenerateRequest, brand_voice: str, channel: str) -> List[ChannelResult]:
+    num_variants = request.num_variants
+    failed: Dict[str, List[int]] = {}
     
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
+    if deadline_expired():
+        metrics.inc("request_deadline_exceeded_total", operation="generate_stream")
+        results = {channel: failed_variants(channel, num_variants, "превышено время генерации")}
+        mark_unrecovered(results, {channel: list(range(num_variants))})
+        return results[channel]
     
-    for channel in channels:
-        channel_prompt = f"{prompt}\n\nСгенерируй текст ТОЛЬКО для канала: {channel}"
-        
-        response = await client.chat.completions.create(
-            model=settings.LLM_MODEL,
-            messages=[
-                {"role": "system", "content": "Ты — профессиональный SMM-специалист. Создаёшь продающие тексты."},
-                {"role": "user", "content": channel_prompt}
-            ],
-            temperature=0.8,
-            max_tokens=2000
+    try:
+        content = await complete(
+            "generate",
+            build_channel_prompt(request, channel, num_variants, brand_voice),
+            channels_schema([channel], num_variants),
+            generation_max_tokens([channel], num_variants, is_short_format(request))
         )
-        
-        content = response.choices[0].message.content or ""
-        
-        try:
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-            
-            raw_result = json.loads(content.strip())
-            
-            if isinstance(raw_result, dict):
-                for key in raw_result:
-                    if channel.lower() in key.lower():
-                        raw_result = raw_result[key]
-                        break
-            
-            if not isinstance(raw_result, list):
-                raw_result = [raw_result]
-            
-            variants = []
-            for v in raw_result[:num_variants]:
-                if isinstance(v, str):
-                    variants.append(ChannelResult(body=v, score=7.0))
-                elif isinstance(v, dict):
-                    variants.append(ChannelResult(
-                        headline=v.get("headline"),
-                        body=v.get("body", v.get("text", "")),
-                        cta=v.get("cta"),
-                        hashtags=v.get("hashtags"),
-                        image_prompt=v.get("image_prompt"),
-                        score=float(v.get("score", 7.0)),
-                        improvements=v.get("improvements")
-                    ))
-            
-            while len(variants) < num_variants:
-                variants.append(ChannelResult(body="Дополнительный вариант", score=5.0))
-            
-            variants = await add_images_to_variants(variants, channel)
-            
-            yield f"event: channel_complete\ndata: {json.dumps({'channel': channel, 'variants': [v.model_dump() for v in variants]}, ensure_ascii=False)}\n\n"
-            
-        except (json.JSONDecodeError, Exception) as e:
-            yield f"event: channel_complete\ndata: {json.dumps({'channel': channel, 'variants': [{'body': f'Ошибка: {str(e)[:50]}', 'score': 0}]}, ensure_ascii=False)}\n\n"
-        
-        await asyncio.sleep(0.1)
+        results = parse_llm_response(content or "", [channel], num_variants, failed)
+    except Exception as e:
+        print(f"Error generating {channel}: {e}")
+        results = {channel: failed_variants(channel, num_variants, str(e))}
+        failed[channel] = list(range(num_variants))
+    
+    if failed:
+        mark_unrecovered(results, await retry_failed_channels(request, brand_voice, results, failed))
+    return results[channel]
 
 
-async def stream_generate_with_yandex(prompt: str, channels: List[str], num_variants: int):
-    import httpx
+async def stream_generate_channels(request: GenerateRequest, brand_voice: str) -> AsyncIterator[Tuple[str, List[dict]]]:
+    strict = is_short_format(request)
     
-    for channel in channels:
-        channel_prompt = f"{prompt}\n\nСгенерируй текст ТОЛЬКО для канала: {channel}"
+    for channel in request.channels:
+        results = {channel: await generate_stream_channel(request, brand_voice, channel)}
+        if request.num_variants > 1:
+            results = await regenerate_duplicates(request, brand_voice, results)
+        variants = (await enforce_constraints(results, strict=strict))[channel]
+        variants = await add_images_to_variants(variants, channel)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-                headers={
-                    "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                    "completionOptions": {
-                        "stream": False,
-                        "temperature": 0.8,
-                        "maxTokens": 2000
-                    },
-                    "messages": [
-                        {"role": "system", "text": "Ты — профессиональный SMM-специалист. Создаёшь продающие тексты."},
-                        {"role": "user", "text": channel_prompt}
-                    ]
-                },
-                timeout=60.0
-            )
-            
-            content = response.json()["result"]["alternatives"][0]["message"]["text"]
-            
-            try:
-                if content.startswith("```json"):
-                    content = content[7:]
-                if content.startswith("```"):
-                    content = content[3:]
-                if content.endswith("```"):
-                    content = content[:-3]
-                
-                raw_result = json.loads(content.strip())
-                
-                if isinstance(raw_result, dict):
-                    for key in raw_result:
-                        if channel.lower() in key.lower():
-                            raw_result = raw_result[key]
-                            break
-                
-                if not isinstance(raw_result, list):
-                    raw_result = [raw_result]
-                
-                variants = []
-                for v in raw_result[:num_variants]:
-                    if isinstance(v, str):
-                        variants.append(ChannelResult(body=v, score=7.0))
-                    elif isinstance(v, dict):
-                        variants.append(ChannelResult(
-                            headline=v.get("headline"),
-                            body=v.get("body", v.get("text", "")),
-                            cta=v.get("cta"),
-                            hashtags=v.get("hashtags"),
-                            image_prompt=v.get("image_prompt"),
-                            score=float(v.get("score", 7.0)),
-                            improvements=v.get("improvements")
-                        ))
-                
-                while len(variants) < num_variants:
-                    variants.append(ChannelResult(body="Дополнительный вариант", score=5.0))
-                
-                variants = await add_images_to_variants(variants, channel)
-                
-                yield f"event: channel_complete\ndata: {json.dumps({'channel': channel, 'variants': [v.model_dump() for v in variants]}, ensure_ascii=False)}\n\n"
-                
-            except (json.JSONDecodeError, Exception) as e:
-                yield f"event: channel_complete\ndata: {json.dumps({'channel': channel, 'variants': [{'body': f'Ошибка: {str(e)[:50]}', 'score': 0}]}, ensure_ascii=False)}\n\n"
-            
-            await asyncio.sleep(0.1)
-
-
-async def stream_mock_generate(request: GenerateRequest):
+        yield channel, [v.model_dump() for v in variants]
+        await asyncio.sleep(0.1)
+
+
+async def stream_mock_generate(request: GenerateRequest) -> AsyncIterator[Tuple[str, List[dict]]]:
     results = generate_mock_response(request)
     
     for channel, variants in results.items():
         variants = await add_images_to_variants(list(variants), channel)
-        yield f"event: channel_complete\ndata: {json.dumps({'channel': channel, 'variants': [v.model_dump() for v in variants]}, ensure_ascii=False)}\n\n"
+        yield channel, [v.model_dump() for v in variants]
         await asyncio.sleep(0.5)
 
 
+async def create_generation(db: AsyncSession, request: GenerateRequest, user_id: int) -> int:
+    generation = Generation(
+        user_id=user_id,
+        description=request.description,
+        channels=request.channels,
+        variants={},
+        num_variants=request.num_variants,
+        brief=cache_brief(request)
+    )
+    db.add(generation)
+    await db.commit()
+    return generation.id
+
+
+async def save_variants(generation_id: int, results: Dict[str, List[dict]], remember: bool = False) -> None:
+    values = {"variants": dict(results)}
+    if remember:
+        values["cacheable"] = True
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(Generation).where(Generation.id == generation_id).values(**values))
+        await session.commit()
+
+
+async def channel_results(request: GenerateRequest) -> AsyncIterator[Tuple[str, List[dict]]]:
+    if settings.MOCK_MODE or not llm_available():
+        return stream_mock_generate(request)
+    async with AsyncSessionLocal() as session:
+        brand_voice = await get_brand_voice(session)
+    return stream_generate_channels(request, brand_voice)
+
+
+async def discard_generation(generation_id: int) -> None:
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(Generation).where(Generation.id == generation_id))
+            await session.commit()
+        metrics.inc("generate_stream_discarded_total")
+    except Exception as e:
+        print(f"Failed to discard empty generation {generation_id}: {e!r}")
+
+
+async def publish_cached_draft(task: GenerationTask, request: GenerateRequest) -> None:
+    cache_hit = lookup_generation(request, task.user_id)
+    if not cache_hit:
+        return
+    cached_id, similarity = cache_hit
+    async with AsyncSessionLocal() as session:
+        cached = await session.get(Generation, cached_id)
+    if cached and cached.user_id == task.user_id:
+        await task.publish("cached_draft", {
+            "generation_id": cached.id,
+            "similarity": round(similarity, 4),
+            "results": cached.variants
+        })
+    else:
+        semantic_cache.discard(cached_id)
+
+
+async def run_generation(task: GenerationTask, request: GenerateRequest) -> None:
+    results: Dict[str, List[dict]] = {}
+    try:
+        await task.publish("generation", {"generation_id": task.generation_id})
+        await publish_cached_draft(task, request)
+        async for channel, variants in await channel_results(request):
+            results[channel] = variants
+            await save_variants(task.generation_id, results)
+            await task.publish("channel_complete", {"channel": channel, "variants": variants})
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            metrics.inc(
+                "stream_cancelled_channels_total",
+                len(request.channels) - len(results),
+                endpoint="generate"
+            )
+        if not results:
+            await discard_generation(task.generation_id)
+        raise
+    
+    if cacheable(request, results):
+        await save_variants(task.generation_id, results, remember=True)
+        remember_generation(request, task.user_id, task.generation_id)
+    hashtag_engine.add_generation(request.description, results)
+    await task.publish("done", {"generation_id": task.generation_id, "failed_channels": failed_channels(results)})
+
+
+async def replay_generation(generation: Generation) -> AsyncIterator[str]:
+    variants = generation.variants or {}
+    yield format_event("generation", {"generation_id": generation.id})
+    for channel in generation.channels:
+        if channel in variants:
+            yield format_event("channel_complete", {"channel": channel, "variants": variants[channel]})
+    missing = [channel for channel in generation.channels if channel not in variants]
+    yield format_event("done", {"generation_id": generation.id, "missing_channels": missing})
+
+
+async def follow_generation(db: AsyncSession, generation_id: int, last_event_id: int) -> Optional[StreamingResponse]:
+    generation = await db.get(Generation, generation_id)
+    if not generation:
+        return None
+    if generation.variants and not await event_bus.known(stream_name(generation_id)):
+        return event_response(replay_generation(generation), generation_id)
+    return event_response(subscribe(generation_id, last_event_id), generation_id)
+
+
 @router.post("/generate/stream")
 async def generate_stream(
     request: GenerateRequest,
     current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
     valid_channels = {"Директ", "Telegram", "Email", "VK", "Дзен"}
     for ch in request.channels:
         if ch not in valid_channels:
-            from fastapi import HTTPException, status
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Invalid channel: {ch}"
             )
     
-    async def event_generator():
-        results_dict: Dict[str, List[dict]] = {}
-        
-        if settings.MOCK_MODE:
-            async for event in stream_mock_generate(request):
-                yield event
-                try:
-                    data_str = event.split("data: ")[1].strip()
-                    data = json.loads(data_str)
-                    results_dict[data["channel"]] = data["variants"]
-                except:
-                    pass
-        else:
-            brand_voice = await get_brand_voice(db)
-            prompt = build_prompt(request, brand_voice)
-            
-            if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-                async for event in stream_generate_with_yandex(prompt, request.channels, request.num_variants):
-                    yield event
-                    try:
-                        data_str = event.split("data: ")[1].strip()
-                        data = json.loads(data_str)
-                        results_dict[data["channel"]] = data["variants"]
-                    except:
-                        pass
-            elif settings.OPENAI_API_KEY:
-                async for event in stream_generate_with_openai(prompt, request.channels, request.num_variants):
-                    yield event
-                    try:
-                        data_str = event.split("data: ")[1].strip()
-                        data = json.loads(data_str)
-                        results_dict[data["channel"]] = data["variants"]
-                    except:
-                        pass
-            else:
-                async for event in stream_mock_generate(request):
-                    yield event
-                    try:
-                        data_str = event.split("data: ")[1].strip()
-                        data = json.loads(data_str)
-                        results_dict[data["channel"]] = data["variants"]
-                    except:
-                        pass
-        
-        generation = Generation(
-            user_id=current_user.id,
-            description=request.description,
-            channels=request.channels,
-            variants=results_dict,
-            num_variants=request.num_variants
-        )
-        db.add(generation)
+    key = task_key(current_user.id, request.model_dump_json(), idempotency_key)
+    after = parse_last_event_id(last_event_id)
+    task = find_task(key)
+    if task:
+        metrics.inc("generate_stream_deduplicated_total", source="task")
+        return event_response(subscribe(task.generation_id, after), task.generation_id)
+    if shared_key(key):
+        owner = await event_bus.lookup(key)
+        response = await follow_generation(db, owner, after) if owner else None
+        if response:
+            metrics.inc("generate_stream_deduplicated_total", source="bus")
+            return response
+    
+    ticket = await admission.acquire(INTERACTIVE, current_user)
+    try:
+        generation_id = await create_generation(db, request, current_user.id)
+        owner = await event_bus.claim(key, generation_id) if shared_key(key) else generation_id
+    except BaseException:
+        ticket.release()
+        raise
+    if owner != generation_id:
+        ticket.release()
+        await db.delete(await db.get(Generation, generation_id))
         await db.commit()
-        await db.refresh(generation)
+        response = await follow_generation(db, owner, after)
+        if response:
+            metrics.inc("generate_stream_deduplicated_total", source="race")
+            return response
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Generation for this Idempotency-Key is no longer available"
+        )
+    task = start_task(generation_id, current_user.id, key, lambda t: run_generation(t, request))
+    task.task.add_done_callback(lambda _: ticket.release())
+    
+    return event_response(subscribe(generation_id, after), generation_id)
+
+
+@router.get("/generate/stream/{generation_id}")
+async def resume_generate_stream(
+    generation_id: int,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    task = get_task(generation_id)
+    if task and task.user_id == current_user.id:
+        metrics.inc("generate_stream_resumed_total", source="task")
+        return event_response(subscribe(generation_id, parse_last_event_id(last_event_id)), generation_id)
+    
+    generation = await db.get(Generation, generation_id)
+    if not generation or generation.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Generation not found"
+        )
+    if await event_bus.known(stream_name(generation_id)):
+        metrics.inc("generate_stream_resumed_total", source="bus")
+        return event_response(subscribe(generation_id, parse_last_event_id(last_event_id)), generation_id)
+    metrics.inc("generate_stream_resumed_total", source="history")
+    return event_response(replay_generation(generation), generation_id)
+
+
+@router.post("/improve/{action}/stream")
+async def improve_stream(
+    action: str,
+    data: ImproveRequest,
+    current_user: User = Depends(get_current_user)
+):
+    from app.services.improver import stream_improve, local_improve, use_local, LOCAL_ACTIONS, ImproveAction
+    
+    try:
+        improve_action = ImproveAction(action)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid action. Valid values: shorten, emoji, tone, cta"
+        )
+    
+    async def event_generator():
+        chunks: List[str] = []
+        fallback = False
+        try:
+            async for delta in stream_improve(
+                data.text, improve_action, data.channel, data.target_tone, data.goal, data.quality
+            ):
+                chunks.append(delta)
+                yield f"event: token\ndata: {json.dumps({'text': delta}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"Error streaming improve: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)[:200]}, ensure_ascii=False)}\n\n"
+            if improve_action not in LOCAL_ACTIONS:
+                return
+            fallback = True
+            chunks = [local_improve(data.text, improve_action, data.channel, data.goal)]
         
-        yield f"event: done\ndata: {json.dumps({'generation_id': generation.id}, ensure_ascii=False)}\n\n"
+        improved = "".join(chunks).strip() or data.text
+        yield f"event: done\ndata: {json.dumps({'original_text': data.text, 'improved_text': improved, 'action': action, 'fallback': fallback}, ensure_ascii=False)}\n\n"
     
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-    )
+    ticket = None if use_local(improve_action, data.quality) else await admission.acquire(INTERACTIVE, current_user)
+    return event_response(disconnect_aware("improve", event_generator()), ticket=ticket)
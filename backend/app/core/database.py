@@ -1,11 +1,20 @@
+import time
+from contextvars import Context, ContextVar, copy_context
+from typing import Optional
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, Session
 from app.core.config import settings
+from app.core.deadline import remaining
+from app.core.metrics import metrics
 
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=False,
-    future=True
+    future=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT
 )
 
 AsyncSessionLocal = async_sessionmaker(
@@ -18,9 +27,87 @@ AsyncSessionLocal = async_sessionmaker(
 
 Base = declarative_base()
 
+MIN_STATEMENT_TIMEOUT_MS = 100
+
+_request_session: ContextVar[Optional[AsyncSession]] = ContextVar("request_session", default=None)
+
+
+def publish_pool_usage() -> None:
+    pool = engine.sync_engine.pool
+    metrics.set_gauge("db_pool_checked_out", pool.checkedout())
+    metrics.set_gauge("db_pool_overflow", max(0, pool.overflow()))
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    publish_pool_usage()
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def on_checkin(dbapi_connection, connection_record):
+    publish_pool_usage()
+
+
+@event.listens_for(Session, "after_transaction_create")
+def start_pool_wait(session, transaction):
+    if transaction.parent is None:
+        session.info["transaction_started"] = time.monotonic()
+
+
+@event.listens_for(Session, "after_begin")
+def apply_request_deadline(session, transaction, connection):
+    started = session.info.pop("transaction_started", None)
+    if started is not None:
+        metrics.observe("db_pool_wait_seconds", time.monotonic() - started)
+    
+    left = remaining()
+    if left is None or connection.dialect.name != "postgresql":
+        return
+    timeout_ms = max(MIN_STATEMENT_TIMEOUT_MS, int(left * 1000))
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+
+@event.listens_for(Session, "after_flush")
+def mark_flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def mark_statement(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def clear_written(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("wrote", None)
+
+
+def detached_context() -> Context:
+    context = copy_context()
+    context.run(_request_session.set, None)
+    return context
+
+
+async def release_connection() -> None:
+    session = _request_session.get()
+    if session is None or session.info.get("releasing") or not session.in_transaction():
+        return
+    if session.info.get("wrote") or session.new or session.dirty or session.deleted:
+        metrics.inc("db_connections_release_skipped_total")
+        return
+    session.info["releasing"] = True
+    try:
+        await session.commit()
+    finally:
+        session.info["releasing"] = False
+    metrics.inc("db_connections_released_total")
+
 
 async def get_db():
     async with AsyncSessionLocal() as session:
+        _request_session.set(session)
         try:
             yield session
         finally:
@@ -31,3 +118,6 @@ async def init_db():
     async with engine.begin() as conn:
         from app.models.models import Base
         await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("ALTER TABLE generations ADD COLUMN IF NOT EXISTS brief JSON"))
+            await conn.execute(text("ALTER TABLE generations ADD COLUMN IF NOT EXISTS cacheable BOOLEAN DEFAULT FALSE"))
@@ -0,0 +1,100 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+DEADLINE_HEADER = b"x-request-timeout"
+
+ROUTE_DEADLINES = [
+    ("/generate/stream", 180.0),
+    ("/improve/", 45.0),
+    ("/history/", 90.0),
+    ("/generate", 90.0),
+    ("/hashtags/", 20.0),
+    ("/series/", 120.0),
+    ("/content-plan/", 120.0),
+    ("/audience/", 45.0),
+    ("/brand-voice/analyze", 90.0),
+    ("/media/", 120.0)
+]
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+def now() -> float:
+    return time.monotonic()
+
+
+def current() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - now()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def clamp(deadline: float) -> float:
+    request_deadline = _deadline.get()
+    return deadline if request_deadline is None else min(deadline, request_deadline)
+
+
+def clamp_timeout(timeout: float) -> float:
+    left = remaining()
+    return timeout if left is None else max(0.0, min(timeout, left))
+
+
+def check(operation: str) -> None:
+    if expired():
+        metrics.inc("request_deadline_exceeded_total", operation=operation)
+        raise DeadlineExceededError(f"{operation}: request deadline exceeded")
+
+
+def set_deadline(timeout: Optional[float]):
+    return _deadline.set(now() + timeout if timeout else None)
+
+
+def route_timeout(path: str) -> float:
+    path = path[len(settings.API_PREFIX):] if path.startswith(settings.API_PREFIX) else path
+    for prefix, timeout in ROUTE_DEADLINES:
+        if path.startswith(prefix):
+            return timeout
+    return settings.REQUEST_DEADLINE_DEFAULT
+
+
+def request_timeout(scope) -> float:
+    timeout = route_timeout(scope.get("path", ""))
+    for name, value in scope.get("headers", []):
+        if name == DEADLINE_HEADER:
+            try:
+                timeout = float(value)
+            except ValueError:
+                pass
+            break
+    return max(1.0, min(timeout, settings.REQUEST_DEADLINE_MAX))
+
+
+class DeadlineMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = set_deadline(request_timeout(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
@@ -0,0 +1,74 @@
+from collections import defaultdict, deque
+from typing import Deque, Dict, Tuple
+
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_key(key: LabelKey) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Metrics:
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.counters: Dict[LabelKey, float] = defaultdict(float)
+        self.gauges: Dict[LabelKey, float] = {}
+        self.samples: Dict[LabelKey, Deque[float]] = {}
+    
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        self.counters[_key(name, labels)] += value
+    
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        self.gauges[_key(name, labels)] = value
+    
+    def discard_gauge(self, name: str, **labels) -> None:
+        self.gauges.pop(_key(name, labels), None)
+    
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        if key not in self.samples:
+            self.samples[key] = deque(maxlen=self.window)
+        self.samples[key].append(value)
+    
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(_key(name, labels), 0.0)
+    
+    def count(self, name: str, **labels) -> int:
+        return len(self.samples.get(_key(name, labels), ()))
+    
+    def percentile(self, name: str, q: float, **labels) -> float:
+        return _percentile(self.samples.get(_key(name, labels), ()), q)
+    
+    def snapshot(self) -> dict:
+        summaries = {}
+        for key, values in self.samples.items():
+            summaries[_format_key(key)] = {
+                "count": len(values),
+                "avg": round(sum(values) / len(values), 4) if values else 0.0,
+                "p50": round(_percentile(values, 0.5), 4),
+                "p95": round(_percentile(values, 0.95), 4),
+            }
+        return {
+            "counters": {_format_key(k): v for k, v in self.counters.items()},
+            "gauges": {_format_key(k): v for k, v in self.gauges.items()},
+            "summaries": summaries,
+        }
+
+
+metrics = Metrics()
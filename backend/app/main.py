@@ -5,10 +5,17 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import init_db, AsyncSessionLocal
 from app.api.endpoints import router
 from app.api.stream import router as stream_router
 from app.api.calendar import router as calendar_router
+from app.services.hashtag_engine import load_hashtag_history
+from app.services.semantic_cache import load_semantic_cache
+from app.services.llm import LLMProviderError
+from app.services.generator import GenerationFailedError
+from app.services.event_bus import event_bus
+from app.services.admission import AdmissionRejectedError
+from app.core.deadline import DeadlineMiddleware, DeadlineExceededError
 
 limiter = Limiter(key_func=get_remote_address)
 
@@ -22,6 +29,39 @@ app = FastAPI(
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+
+@app.exception_handler(LLMProviderError)
+async def llm_provider_error_handler(request: Request, exc: LLMProviderError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "LLM-провайдеры недоступны, попробуйте позже", "error": str(exc)[:500]}
+    )
+
+
+@app.exception_handler(AdmissionRejectedError)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejectedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Сервис перегружен, повторите запрос позже", "error": str(exc)[:500]},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(GenerationFailedError)
+async def generation_failed_handler(request: Request, exc: GenerationFailedError):
+    return JSONResponse(
+        status_code=502,
+        content={"detail": "Не удалось сгенерировать варианты, попробуйте ещё раз", "error": str(exc)[:500]}
+    )
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceededError):
+    return JSONResponse(
+        status_code=504,
+        content={"detail": "Превышено время обработки запроса", "error": str(exc)[:500]}
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,11 +69,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DeadlineMiddleware)
 
 
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    try:
+        async with AsyncSessionLocal() as db:
+            await load_hashtag_history(db)
+    except Exception as e:
+        print(f"Error loading hashtag history: {e}")
+    try:
+        async with AsyncSessionLocal() as db:
+            await load_semantic_cache(db)
+    except Exception as e:
+        print(f"Error loading semantic cache: {e}")
+    await event_bus.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await event_bus.stop()
 
 
 @app.get("/")
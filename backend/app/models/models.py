@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Enum as SQLEnum, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Enum as SQLEnum, ForeignKey, Boolean, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 import enum
@@ -34,6 +34,8 @@ class Generation(Base):
     variants = Column(JSON, nullable=False)
     num_variants = Column(Integer, default=1)
     is_saved = Column(Integer, default=0)
+    brief = Column(JSON(none_as_null=True), nullable=True)
+    cacheable = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="generations")
@@ -93,3 +95,35 @@ class ImageSettings(Base):
     model = Column(String(100), default="google/gemini-3-pro-image-preview")
     enabled = Column(Boolean, default=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class HashtagUsage(Base):
+    __tablename__ = "hashtag_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tag = Column(String(100), unique=True, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StreamEvent(Base):
+    __tablename__ = "stream_events"
+    __table_args__ = (UniqueConstraint("stream", "seq"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    stream = Column(String(100), index=True, nullable=False)
+    seq = Column(Integer, nullable=False)
+    event = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class StreamKey(Base):
+    __tablename__ = "stream_keys"
+    __table_args__ = (UniqueConstraint("user_id", "key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(100), nullable=False)
+    generation_id = Column(Integer, ForeignKey("generations.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
@@ -65,6 +65,7 @@ class GenerateRequest(BaseModel):
     audience: Optional[str] = Field(None, max_length=500)
     offer: Optional[str] = Field(None, max_length=200)
     format: Optional[PostFormatEnum] = PostFormatEnum.SHORT
+    use_cache: bool = True
 
 
 class ChannelResult(BaseModel):
@@ -76,11 +77,34 @@ class ChannelResult(BaseModel):
     image_url: Optional[str] = None
     score: float = Field(..., ge=0, le=10)
     improvements: Optional[List[str]] = None
+    retried: Optional[bool] = None
+    issues: Optional[List[str]] = None
+    similarity: Optional[float] = None
 
 
 class GenerateResponse(BaseModel):
     results: Dict[str, List[ChannelResult]]
     generation_id: Optional[int] = None
+    cached: bool = False
+    cache_similarity: Optional[float] = None
+    failed_channels: Dict[str, List[int]] = {}
+
+
+class RegenerateRequest(BaseModel):
+    channel: str
+    variant_index: Optional[int] = Field(None, ge=0)
+    goal: Optional[GoalEnum] = None
+    tone: Optional[ToneEnum] = None
+    audience: Optional[str] = Field(None, max_length=500)
+    offer: Optional[str] = Field(None, max_length=200)
+    format: Optional[PostFormatEnum] = None
+
+
+class RegenerateResponse(BaseModel):
+    generation_id: int
+    channel: str
+    variant_index: Optional[int] = None
+    variants: List[ChannelResult]
 
 
 class GenerationHistory(BaseModel):
@@ -128,11 +152,18 @@ class ImproveAction(str, Enum):
     CTA = "cta"
 
 
+class ImproveQuality(str, Enum):
+    FAST = "fast"
+    LLM = "llm"
+
+
 class ImproveRequest(BaseModel):
     text: str = Field(..., min_length=10)
     channel: str
     action: ImproveAction
     target_tone: Optional[str] = None
+    goal: Optional[GoalEnum] = None
+    quality: ImproveQuality = ImproveQuality.FAST
 
 
 class ImproveResponse(BaseModel):
@@ -141,6 +172,32 @@ class ImproveResponse(BaseModel):
     action: str
 
 
+class ImproveBatchItem(BaseModel):
+    text: str = Field(..., min_length=1)
+    channel: str
+
+
+class ImproveBatchRequest(BaseModel):
+    generation_id: Optional[int] = None
+    items: Optional[List[ImproveBatchItem]] = Field(None, max_length=100)
+    target_tone: Optional[str] = None
+    goal: Optional[GoalEnum] = None
+    quality: ImproveQuality = ImproveQuality.FAST
+
+
+class ImproveBatchResult(BaseModel):
+    channel: str
+    variant_index: Optional[int] = None
+    original_text: str
+    improved_text: str
+
+
+class ImproveBatchResponse(BaseModel):
+    action: str
+    generation_id: Optional[int] = None
+    results: List[ImproveBatchResult]
+
+
 class ScheduledPostCreate(BaseModel):
     generation_id: Optional[int] = None
     channel: str
@@ -198,6 +255,7 @@ class HashtagsRequest(BaseModel):
     text: str = Field(..., min_length=10)
     channel: str
     count: int = Field(5, ge=3, le=15)
+    creative: bool = False
 
 
 class HashtagsResponse(BaseModel):
@@ -205,6 +263,15 @@ class HashtagsResponse(BaseModel):
     selling_hashtags: List[str]
 
 
+class HashtagSuggestion(BaseModel):
+    tag: str
+    count: int
+
+
+class HashtagAutocompleteResponse(BaseModel):
+    suggestions: List[HashtagSuggestion]
+
+
 class SeriesRequest(BaseModel):
     topic: str = Field(..., min_length=10, max_length=500)
     channel: str
@@ -277,3 +344,65 @@ class ImageSettingsResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class LLMTier(str, Enum):
+    MAIN = "main"
+    FAST = "fast"
+
+
+class LLMRoute(BaseModel):
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    tier: LLMTier = LLMTier.MAIN
+    timeout: float = Field(60.0, gt=0, le=300)
+    max_tokens: Optional[int] = Field(None, ge=16, le=32000)
+    temperature: float = Field(0.7, ge=0, le=2)
+    slo_p95: Optional[float] = Field(None, gt=0)
+    hedge: bool = False
+
+
+class LLMRouteUpdate(BaseModel):
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    tier: Optional[LLMTier] = None
+    timeout: Optional[float] = Field(None, gt=0, le=300)
+    max_tokens: Optional[int] = Field(None, ge=16, le=32000)
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    slo_p95: Optional[float] = Field(None, gt=0)
+    hedge: Optional[bool] = None
+
+
+class LLMRouteStatus(LLMRoute):
+    task: str
+    resolved_provider: Optional[str] = None
+    resolved_model: Optional[str] = None
+    count: int = 0
+    errors: float = 0
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    slo_met: Optional[bool] = None
+    candidates: List[str] = []
+
+
+class LLMProviderHealth(BaseModel):
+    provider: str
+    configured: bool
+    healthy: bool
+    latency_ewma: Optional[float] = None
+    error_rate: float = 0
+    circuit: str = "closed"
+    concurrency_limit: int = 0
+    in_flight: int = 0
+
+
+class AdmissionUserStatus(BaseModel):
+    user_id: int
+    weight: float
+    in_flight: int = 0
+    queued: int = 0
+    admitted: int = 0
+    rejected: int = 0
+    avg_wait: Optional[float] = None
+    cap: int = 0
+    share: float = 0
@@ -0,0 +1,294 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+from app.core.config import settings
+from app.core.database import release_connection
+from app.core.metrics import metrics
+from app.core.deadline import clamp_timeout
+from app.schemas.schemas import AdmissionUserStatus
+
+
+INTERACTIVE = "interactive"
+SYNC = "sync"
+BACKGROUND = "background"
+
+PRIORITIES = {INTERACTIVE: 0, SYNC: 1, BACKGROUND: 2}
+WAIT_FACTORS = {INTERACTIVE: 1.0, SYNC: 2.0, BACKGROUND: 6.0}
+
+HOLD_ALPHA = 0.2
+DEFAULT_HOLD_SECONDS = 10.0
+MAX_RETRY_AFTER = 60
+ANONYMOUS = 0
+USER_IDLE_TTL = 300.0
+
+
+def user_weight(user) -> float:
+    role = getattr(user, "role", None)
+    if getattr(role, "value", role) == "admin":
+        return max(0.01, settings.ADMISSION_WEIGHT_ADMIN)
+    return max(0.01, settings.ADMISSION_WEIGHT_USER)
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UserLoad:
+    def __init__(self, user_id: int, weight: float):
+        self.user_id = user_id
+        self.weight = weight
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.waited = 0.0
+        self.finish: Dict[str, float] = {}
+        self.touched = time.monotonic()
+    
+    @property
+    def idle(self) -> bool:
+        return not self.in_flight and not self.queued
+
+
+class Waiter:
+    def __init__(self, priority: str, start: float, seq: int, load: UserLoad):
+        self.priority = priority
+        self.rank = PRIORITIES[priority]
+        self.start = start
+        self.seq = seq
+        self.load = load
+        self.future = asyncio.get_running_loop().create_future()
+    
+    @property
+    def order(self):
+        return self.rank, self.start, self.seq
+    
+    def __lt__(self, other: "Waiter") -> bool:
+        return self.order < other.order
+    
+    @property
+    def granted(self) -> bool:
+        return self.future.done() and not self.future.cancelled() and self.future.exception() is None
+
+
+class Ticket:
+    def __init__(self, controller: "AdmissionController", priority: str, load: UserLoad):
+        self.controller = controller
+        self.priority = priority
+        self.load = load
+        self.admitted_at = time.monotonic()
+        self.released = False
+    
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.controller.release(self)
+
+
+class AdmissionController:
+    def __init__(self, capacity: int, queue_size: int, queue_timeout: float):
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters: List[Waiter] = []
+        self.sequence = itertools.count()
+        self.hold_seconds = DEFAULT_HOLD_SECONDS
+        self.virtual: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self.users: Dict[int, UserLoad] = {}
+    
+    def user_load(self, user) -> UserLoad:
+        user_id = getattr(user, "id", None) or ANONYMOUS
+        load = self.users.get(user_id)
+        if load is None:
+            load = self.users[user_id] = UserLoad(user_id, user_weight(user))
+        load.weight = user_weight(user)
+        load.touched = time.monotonic()
+        return load
+    
+    def start_tag(self, priority: str, load: UserLoad) -> float:
+        return max(self.virtual[priority], load.finish.get(priority, 0.0))
+    
+    def _charge(self, priority: str, load: UserLoad) -> float:
+        start = self.start_tag(priority, load)
+        load.finish[priority] = start + 1.0 / load.weight
+        return start
+    
+    def _publish(self) -> None:
+        metrics.set_gauge("admission_in_flight", self.in_flight)
+        for priority in PRIORITIES:
+            depth = sum(1 for waiter in self.waiters if waiter.priority == priority)
+            metrics.set_gauge("admission_queue_depth", depth, priority=priority)
+        now = time.monotonic()
+        for user_id, load in list(self.users.items()):
+            if not load.idle:
+                metrics.set_gauge("admission_user_in_flight", load.in_flight, user=user_id)
+                metrics.set_gauge("admission_user_queue_depth", load.queued, user=user_id)
+                continue
+            metrics.discard_gauge("admission_user_in_flight", user=user_id)
+            metrics.discard_gauge("admission_user_queue_depth", user=user_id)
+            if now - load.touched > USER_IDLE_TTL:
+                del self.users[user_id]
+        metrics.set_gauge("admission_active_users", sum(1 for load in self.users.values() if not load.idle))
+    
+    def retry_after(self) -> int:
+        estimate = (len(self.waiters) + 1) / max(1, self.capacity) * self.hold_seconds
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+    
+    def _reject(self, priority: str, reason: str, load: UserLoad) -> AdmissionRejectedError:
+        load.rejected += 1
+        metrics.inc("admission_rejected_total", priority=priority, reason=reason)
+        return AdmissionRejectedError(
+            f"LLM capacity exhausted ({reason}), {len(self.waiters)} requests queued",
+            self.retry_after()
+        )
+    
+    def _shed_for(self, priority: str, start: float) -> bool:
+        order = (PRIORITIES[priority], start)
+        victims = [waiter for waiter in self.waiters if (waiter.rank, waiter.start) > order]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda waiter: waiter.order)
+        self._remove(victim)
+        victim.future.set_exception(self._reject(victim.priority, "shed", victim.load))
+        return True
+    
+    def _ticket(self, priority: str, load: UserLoad, waited: float) -> Ticket:
+        load.admitted += 1
+        load.waited += waited
+        metrics.inc("admission_admitted_total", priority=priority)
+        metrics.observe("admission_wait_seconds", waited, priority=priority)
+        self._publish()
+        return Ticket(self, priority, load)
+    
+    def active_weight(self, load: UserLoad) -> float:
+        weight = sum(other.weight for other in self.users.values() if not other.idle)
+        return weight + load.weight if load.idle else weight
+    
+    def cap(self, load: UserLoad) -> int:
+        return max(1, math.ceil(self.capacity * load.weight / self.active_weight(load)))
+    
+    def _under_cap(self, load: UserLoad) -> bool:
+        return load.in_flight < self.cap(load)
+    
+    def _vacant(self, load: UserLoad) -> bool:
+        if self.in_flight >= self.capacity or not self._under_cap(load):
+            return False
+        return not any(self._under_cap(waiter.load) for waiter in self.waiters)
+    
+    def _admit(self, priority: str, start: float, load: UserLoad) -> None:
+        self.virtual[priority] = max(self.virtual[priority], start)
+        self.in_flight += 1
+        load.in_flight += 1
+    
+    async def acquire(self, priority: str = SYNC, user=None) -> Ticket:
+        load = self.user_load(user)
+        if not self._vacant(load):
+            await release_connection()
+        if self._vacant(load):
+            self._admit(priority, self._charge(priority, load), load)
+            return self._ticket(priority, load, 0.0)
+        if not self._under_cap(load):
+            metrics.inc("admission_capped_total", priority=priority)
+        
+        if len(self.waiters) >= self.queue_size and not self._shed_for(priority, self.start_tag(priority, load)):
+            raise self._reject(priority, "full", load)
+        
+        timeout = clamp_timeout(self.queue_timeout * WAIT_FACTORS[priority])
+        
+        started = time.monotonic()
+        waiter = Waiter(priority, self._charge(priority, load), next(self.sequence), load)
+        heapq.heappush(self.waiters, waiter)
+        load.queued += 1
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if waiter.granted:
+                return self._ticket(priority, load, time.monotonic() - started)
+            self._discard(waiter)
+            raise self._reject(priority, "timeout", load)
+        except BaseException:
+            if waiter.granted:
+                self.in_flight -= 1
+                load.in_flight -= 1
+                self._wake()
+            self._discard(waiter)
+            raise
+        return self._ticket(priority, load, time.monotonic() - started)
+    
+    def _remove(self, waiter: Waiter) -> None:
+        self.waiters.remove(waiter)
+        heapq.heapify(self.waiters)
+        waiter.load.queued -= 1
+    
+    def _discard(self, waiter: Waiter) -> None:
+        if not waiter.future.done():
+            waiter.future.cancel()
+        if waiter in self.waiters:
+            self._remove(waiter)
+        self._wake()
+    
+    def _wake(self) -> None:
+        capped: List[Waiter] = []
+        while self.waiters and self.in_flight < self.capacity:
+            waiter = heapq.heappop(self.waiters)
+            if not waiter.future.done() and not self._under_cap(waiter.load):
+                capped.append(waiter)
+                continue
+            waiter.load.queued -= 1
+            if waiter.future.done():
+                continue
+            self._admit(waiter.priority, waiter.start, waiter.load)
+            waiter.future.set_result(None)
+        for waiter in capped:
+            heapq.heappush(self.waiters, waiter)
+        self._publish()
+    
+    def release(self, ticket: Ticket) -> None:
+        held = time.monotonic() - ticket.admitted_at
+        self.hold_seconds += HOLD_ALPHA * (held - self.hold_seconds)
+        metrics.observe("admission_hold_seconds", held, priority=ticket.priority)
+        self.in_flight = max(0, self.in_flight - 1)
+        ticket.load.in_flight = max(0, ticket.load.in_flight - 1)
+        self._wake()
+    
+    def status(self) -> List[AdmissionUserStatus]:
+        loads = sorted(self.users.values(), key=lambda load: (-load.in_flight, -load.queued, load.user_id))
+        return [
+            AdmissionUserStatus(
+                user_id=load.user_id,
+                weight=load.weight,
+                in_flight=load.in_flight,
+                queued=load.queued,
+                admitted=load.admitted,
+                rejected=load.rejected,
+                avg_wait=round(load.waited / load.admitted, 4) if load.admitted else None,
+                cap=self.cap(load),
+                share=round(load.in_flight / max(1, self.capacity), 4)
+            )
+            for load in loads
+        ]
+
+
+admission = AdmissionController(
+    settings.ADMISSION_CONCURRENCY,
+    settings.ADMISSION_QUEUE_SIZE,
+    settings.ADMISSION_QUEUE_TIMEOUT
+)
+
+
+@asynccontextmanager
+async def slot(priority: str, user=None) -> AsyncIterator[Ticket]:
+    ticket = await admission.acquire(priority, user)
+    try:
+        yield ticket
+    finally:
+        ticket.release()
@@ -1,8 +1,9 @@
 import json
-from openai import AsyncOpenAI
-import httpx
 from app.core.config import settings
+from app.core.deadline import DeadlineExceededError
 from app.schemas.schemas import AudienceAnalysisResponse
+from app.services.llm import audience_schema, complete, llm_available, LLMProviderError
+from app.services.prompts import PromptLayout
 
 
 AUDIENCE_ANALYSIS_PROMPT = """Проанализируй целевую аудиторию для продукта.
@@ -31,56 +32,15 @@ AUDIENCE_ANALYSIS_PROMPT = """Проанализируй целевую ауди
 - content_preferences: 3-5 предпочтений по контенту"""
 
 
-async def analyze_audience_openai(product: str, description: str = None) -> AudienceAnalysisResponse:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
-    extra = f"\nОписание: {description}" if description else ""
-    prompt = AUDIENCE_ANALYSIS_PROMPT.format(product=product, description_extra=extra)
-    
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": "Ты — маркетолог-аналитик, специализируешься на анализе целевых аудиторий."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3,
-        max_tokens=1000
-    )
-    
-    content = response.choices[0].message.content or "{}"
-    return parse_audience_response(content)
+AUDIENCE_SYSTEM_PROMPT = "Ты — маркетолог-аналитик, специализируешься на анализе целевых аудиторий."
 
 
-async def analyze_audience_yandex(product: str, description: str = None) -> AudienceAnalysisResponse:
+async def analyze_audience_llm(product: str, description: str = None) -> AudienceAnalysisResponse:
     extra = f"\nОписание: {description}" if description else ""
     prompt = AUDIENCE_ANALYSIS_PROMPT.format(product=product, description_extra=extra)
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.3,
-                    "maxTokens": 1000
-                },
-                "messages": [
-                    {"role": "system", "text": "Ты — маркетолог-аналитик, специализируешься на анализе целевых аудиторий."},
-                    {"role": "user", "text": prompt}
-                ]
-            },
-            timeout=30.0
-        )
-        content = response.json()["result"]["alternatives"][0]["message"]["text"]
-        return parse_audience_response(content)
+    content = await complete("audience", PromptLayout(AUDIENCE_SYSTEM_PROMPT, [], [prompt]), audience_schema())
+    return parse_audience_response(content or "{}")
 
 
 def generate_mock_audience_analysis(product: str) -> AudienceAnalysisResponse:
@@ -121,16 +81,13 @@ def parse_audience_response(content: str) -> AudienceAnalysisResponse:
 
 
 async def analyze_audience(product: str, description: str = None) -> AudienceAnalysisResponse:
-    if settings.MOCK_MODE:
+    if settings.MOCK_MODE or not llm_available():
         return generate_mock_audience_analysis(product)
     
     try:
-        if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-            return await analyze_audience_yandex(product, description)
-        elif settings.OPENAI_API_KEY:
-            return await analyze_audience_openai(product, description)
-        else:
-            return generate_mock_audience_analysis(product)
+        return await analyze_audience_llm(product, description)
+    except (LLMProviderError, DeadlineExceededError):
+        raise
     except Exception as e:
         print(f"Error analyzing audience: {e}")
         return generate_mock_audience_analysis(product)
@@ -1,12 +1,13 @@
 import json
 from typing import List
-from openai import AsyncOpenAI
-import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.core.config import settings
+from app.core.deadline import DeadlineExceededError
 from app.models.models import BrandVoiceExample, BrandVoice
 from app.schemas.schemas import BrandVoiceAnalyzeResponse
+from app.services.llm import complete, llm_available, strip_json_fences, LLMProviderError
+from app.services.prompts import PromptLayout
 
 
 ANALYZE_PROMPT = """Проанализируй следующие примеры текстов и создай детальный гайдлайн по стилю бренда.
@@ -28,80 +29,21 @@ ANALYZE_PROMPT = """Проанализируй следующие примеры
 }}"""
 
 
-async def analyze_with_openai(examples: List[str]) -> dict:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
+ANALYZE_SYSTEM_PROMPT = "Ты — эксперт по бренд-коммуникациям. Анализируешь стиль текстов и создаёшь гайдлайны."
+
+
+async def analyze_with_llm(examples: List[str]) -> dict:
     examples_text = "\n\n---\n\n".join([f"Пример {i+1}:\n{ex}" for i, ex in enumerate(examples)])
     prompt = ANALYZE_PROMPT.format(examples=examples_text)
     
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": "Ты — эксперт по бренд-коммуникациям. Анализируешь стиль текстов и создаёшь гайдлайны."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3,
-        max_tokens=2000
-    )
-    
-    content = response.choices[0].message.content or "{}"
+    content = await complete("brand_analysis", PromptLayout(ANALYZE_SYSTEM_PROMPT, [], [prompt])) or "{}"
     
     try:
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        return json.loads(content.strip())
+        return json.loads(strip_json_fences(content))
     except json.JSONDecodeError:
         return {"summary": content, "tone": "Не удалось определить", "vocabulary": []}
 
 
-async def analyze_with_yandex(examples: List[str]) -> dict:
-    examples_text = "\n\n---\n\n".join([f"Пример {i+1}:\n{ex}" for i, ex in enumerate(examples)])
-    prompt = ANALYZE_PROMPT.format(examples=examples_text)
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.3,
-                    "maxTokens": 2000
-                },
-                "messages": [
-                    {"role": "system", "text": "Ты — эксперт по бренд-коммуникациям. Анализируешь стиль текстов и создаёшь гайдлайны."},
-                    {"role": "user", "text": prompt}
-                ]
-            },
-            timeout=60.0
-        )
-        response.raise_for_status()
-        data = response.json()
-        content = data["result"]["alternatives"][0]["message"]["text"]
-        
-        try:
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-            return json.loads(content.strip())
-        except json.JSONDecodeError:
-            return {"summary": content, "tone": "Не удалось определить", "vocabulary": []}
-
-
 def generate_mock_analysis(examples: List[str]) -> dict:
     total_length = sum(len(ex) for ex in examples)
     avg_length = total_length // len(examples) if examples else 100
@@ -154,16 +96,13 @@ async def analyze_brand_voice(
     
     texts = [ex.original_text for ex in examples]
     
-    if settings.MOCK_MODE:
+    if settings.MOCK_MODE or not llm_available():
         analysis = generate_mock_analysis(texts)
     else:
         try:
-            if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-                analysis = await analyze_with_yandex(texts)
-            elif settings.OPENAI_API_KEY:
-                analysis = await analyze_with_openai(texts)
-            else:
-                analysis = generate_mock_analysis(texts)
+            analysis = await analyze_with_llm(texts)
+        except (LLMProviderError, DeadlineExceededError):
+            raise
         except Exception as e:
             print(f"Error analyzing brand voice: {e}")
             analysis = generate_mock_analysis(texts)
@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.retry import is_retryable, error_status
+
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+DECREASE_FACTOR = 0.7
+DECREASE_COOLDOWN = 1.0
+OVERLOAD_STATUSES = {429, 503}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class ProviderOverloadedError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, half_open_max: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max = half_open_max
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+    
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        print(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        metrics.inc("llm_circuit_transitions_total", provider=self.name, state=state)
+        metrics.set_gauge("llm_circuit_state", STATE_GAUGE[state], provider=self.name)
+    
+    def is_open(self) -> bool:
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.recovery_timeout
+    
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self._transition(HALF_OPEN)
+            self.probes = 0
+        if self.state == HALF_OPEN:
+            if self.probes >= self.half_open_max:
+                return False
+            self.probes += 1
+        return True
+    
+    def record_success(self) -> None:
+        self.failures = 0
+        self._transition(CLOSED)
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(OPEN)
+    
+    def record_ignored(self) -> None:
+        if self.state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.decreased_at = 0.0
+    
+    def _publish(self) -> None:
+        metrics.set_gauge("llm_concurrency_limit", int(self.limit), provider=self.name)
+        metrics.set_gauge("llm_in_flight", self.in_flight, provider=self.name)
+    
+    def _wake(self) -> None:
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+        self._publish()
+    
+    async def acquire(self, timeout: float) -> None:
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            self._publish()
+            return
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        metrics.inc("llm_concurrency_queued_total", provider=self.name)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.inc("llm_concurrency_rejected_total", provider=self.name)
+                raise ProviderOverloadedError(f"{self.name}: concurrency limit {int(self.limit)} reached")
+            raise
+    
+    def release(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        self._wake()
+    
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+    
+    def on_overload(self) -> None:
+        now = time.monotonic()
+        if now - self.decreased_at < DECREASE_COOLDOWN:
+            return
+        self.decreased_at = now
+        self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+        self._publish()
+
+
+def is_overload(exc: Exception) -> bool:
+    return isinstance(exc, asyncio.TimeoutError) or error_status(exc) in OVERLOAD_STATUSES
+
+
+class ProviderGuard:
+    def __init__(self, name: str):
+        self.breaker = CircuitBreaker(name, settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RECOVERY)
+        self.limiter = AdaptiveLimiter(
+            name,
+            settings.LLM_CONCURRENCY_INITIAL,
+            settings.LLM_CONCURRENCY_MIN,
+            settings.LLM_CONCURRENCY_MAX
+        )
+    
+    async def acquire(self, timeout: float) -> None:
+        if not self.breaker.allow():
+            metrics.inc("llm_circuit_rejected_total", provider=self.breaker.name)
+            raise CircuitOpenError(f"{self.breaker.name}: circuit open")
+        try:
+            await self.limiter.acquire(timeout)
+        except BaseException:
+            self.breaker.record_ignored()
+            raise
+    
+    def release(self, error: Optional[BaseException] = None) -> None:
+        self.limiter.release()
+        self.record(error)
+    
+    def record(self, error: Optional[BaseException] = None) -> None:
+        if error is None:
+            self.breaker.record_success()
+            self.limiter.on_success()
+        elif isinstance(error, Exception) and is_retryable(error):
+            self.breaker.record_failure()
+            if is_overload(error):
+                self.limiter.on_overload()
+        else:
+            self.breaker.record_ignored()
+
+
+_guards: Dict[str, ProviderGuard] = {}
+
+
+def provider_guard(name: str) -> ProviderGuard:
+    if name not in _guards:
+        _guards[name] = ProviderGuard(name)
+    return _guards[name]
+
+
+def circuit_open(name: str) -> bool:
+    return name in _guards and _guards[name].breaker.is_open()
+
+
+@asynccontextmanager
+async def guarded(name: str, timeout: float) -> AsyncIterator[None]:
+    guard = provider_guard(name)
+    await guard.acquire(timeout)
+    try:
+        yield
+    except BaseException as e:
+        guard.release(e)
+        raise
+    guard.release()
@@ -0,0 +1,216 @@
+import re
+import math
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.validator import CHANNEL_LIMITS
+
+
+TOKEN_RE = re.compile(r"[а-яё]+|[a-z]+|\d+|[^\w\s]", re.IGNORECASE)
+CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+
+CHARS_PER_TOKEN_CYRILLIC = 3.0
+CHARS_PER_TOKEN_LATIN = 4.0
+CHARS_PER_TOKEN_DIGITS = 3.0
+
+VARIANT_OVERHEAD_CHARS = 350
+IMAGE_PROMPT_CHARS = 300
+DEFAULT_BODY_CHARS = 800
+LONG_FORMAT_BODY_CHARS = {
+    "Telegram": 2500,
+    "Email": 1500,
+    "VK": 2000,
+    "Дзен": 4000
+}
+PLAN_ITEM_CHARS = 900
+SERIES_POST_CHARS = {
+    "short": 1200,
+    "longread": 6000,
+    "case_study": 3000,
+    "story": 3000
+}
+
+OUTPUT_SAFETY = 1.25
+MIN_OUTPUT_TOKENS = 256
+CALIBRATION_ALPHA = 0.1
+CALIBRATION_BOUNDS = (0.5, 2.0)
+
+_calibration: Dict[str, float] = {}
+
+
+def raw_token_estimate(text: str) -> int:
+    tokens = 0
+    for match in TOKEN_RE.finditer(text or ""):
+        piece = match.group(0)
+        if piece.isdigit():
+            tokens += math.ceil(len(piece) / CHARS_PER_TOKEN_DIGITS)
+        elif CYRILLIC_RE.match(piece):
+            tokens += math.ceil(len(piece) / CHARS_PER_TOKEN_CYRILLIC)
+        elif piece.isalpha():
+            tokens += math.ceil(len(piece) / CHARS_PER_TOKEN_LATIN)
+        else:
+            tokens += 1
+    return tokens
+
+
+def calibration(provider: Optional[str] = None) -> float:
+    return _calibration.get(provider or settings.LLM_PROVIDER, 1.0)
+
+
+def estimate_tokens(text: str, provider: Optional[str] = None) -> int:
+    return math.ceil(raw_token_estimate(text) * calibration(provider))
+
+
+def chars_to_tokens(chars: int, provider: Optional[str] = None) -> int:
+    return math.ceil(chars / CHARS_PER_TOKEN_CYRILLIC * calibration(provider) * OUTPUT_SAFETY)
+
+
+def clamp_output(tokens: int) -> int:
+    return max(MIN_OUTPUT_TOKENS, min(settings.LLM_MAX_OUTPUT_TOKENS, tokens))
+
+
+def channel_output_chars(channel: str, short: bool = True) -> int:
+    limits = CHANNEL_LIMITS.get(channel, {})
+    body = limits.get("body", DEFAULT_BODY_CHARS)
+    if not short:
+        body = max(body, LONG_FORMAT_BODY_CHARS.get(channel, DEFAULT_BODY_CHARS))
+    chars = body + limits.get("headline", 0) + VARIANT_OVERHEAD_CHARS
+    if channel == "Дзен":
+        chars += IMAGE_PROMPT_CHARS
+    return chars
+
+
+def generation_max_tokens(
+    channels: List[str],
+    num_variants: int,
+    short: bool = True,
+    provider: Optional[str] = None
+) -> int:
+    chars = sum(channel_output_chars(channel, short) for channel in channels) * num_variants
+    return clamp_output(chars_to_tokens(chars, provider))
+
+
+def content_plan_max_tokens(days: int, provider: Optional[str] = None) -> int:
+    return clamp_output(chars_to_tokens(days * PLAN_ITEM_CHARS, provider))
+
+
+def series_max_tokens(count: int, format_type: str = "short", provider: Optional[str] = None) -> int:
+    chars = SERIES_POST_CHARS.get(format_type, SERIES_POST_CHARS["short"]) + VARIANT_OVERHEAD_CHARS
+    return clamp_output(chars_to_tokens(count * chars, provider))
+
+
+def fit_brand_voice(text: str, max_tokens: Optional[int] = None) -> str:
+    max_tokens = max_tokens or settings.BRAND_VOICE_MAX_TOKENS
+    lines = []
+    seen = set()
+    for line in (text or "").splitlines():
+        line = " ".join(line.split())
+        if line and line.lower() not in seen:
+            seen.add(line.lower())
+            lines.append(line)
+    compact = "\n".join(lines)
+    if estimate_tokens(compact) <= max_tokens:
+        return compact
+    
+    metrics.inc("brand_voice_trimmed_total")
+    kept: List[str] = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            if not kept:
+                ratio = max_tokens / cost
+                cut = line[:int(len(line) * ratio)]
+                kept.append(cut.rsplit(" ", 1)[0] if " " in cut else cut)
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def record_usage(
+    task: str,
+    provider: str,
+    prompt: str,
+    max_tokens: int,
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+    truncated: bool = False,
+    cached: Optional[int] = None,
+    prefix: Optional[str] = None
+) -> None:
+    if prefix:
+        metrics.inc("llm_prompt_prefix_calls_total", task=task, prefix=prefix)
+    if cached is not None and prompt_tokens:
+        metrics.inc("llm_cached_tokens_total", cached, task=task, provider=provider)
+        metrics.observe("llm_cached_token_ratio", cached / prompt_tokens, task=task, provider=provider)
+        if prefix:
+            metrics.inc("llm_prefix_cached_tokens_total", cached, task=task, prefix=prefix)
+    if prompt_tokens:
+        estimate = raw_token_estimate(prompt)
+        metrics.observe("llm_prompt_tokens", prompt_tokens, task=task, provider=provider)
+        if estimate:
+            ratio = prompt_tokens / estimate
+            metrics.observe("llm_prompt_estimate_ratio", ratio, task=task, provider=provider)
+            current = _calibration.get(provider, 1.0)
+            low, high = CALIBRATION_BOUNDS
+            _calibration[provider] = min(high, max(low, current + CALIBRATION_ALPHA * (ratio - current)))
+    if completion_tokens:
+        metrics.observe("llm_completion_tokens", completion_tokens, task=task, provider=provider)
+        metrics.observe("llm_completion_budget_ratio", completion_tokens / max_tokens, task=task, provider=provider)
+    if truncated:
+        metrics.inc("llm_truncated_total", task=task, provider=provider)
+
+
+def cached_tokens(usage) -> Optional[int]:
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return None
+    if isinstance(details, dict):
+        return int(details.get("cached_tokens") or 0)
+    return int(getattr(details, "cached_tokens", 0) or 0)
+
+
+def record_openai_usage(
+    task: str,
+    provider: str,
+    prompt: str,
+    max_tokens: int,
+    response,
+    prefix: Optional[str] = None
+) -> None:
+    usage = getattr(response, "usage", None)
+    choices = getattr(response, "choices", None) or []
+    record_usage(
+        task,
+        provider,
+        prompt,
+        max_tokens,
+        getattr(usage, "prompt_tokens", None),
+        getattr(usage, "completion_tokens", None),
+        bool(choices) and choices[0].finish_reason == "length",
+        cached_tokens(usage),
+        prefix
+    )
+
+
+def record_yandex_usage(
+    task: str,
+    prompt: str,
+    max_tokens: int,
+    data: dict,
+    prefix: Optional[str] = None
+) -> None:
+    result = data.get("result", {})
+    usage = result.get("usage", {})
+    alternatives = result.get("alternatives") or [{}]
+    record_usage(
+        task,
+        "yandex",
+        prompt,
+        max_tokens,
+        int(usage.get("inputTextTokens", 0)) or None,
+        int(usage.get("completionTokens", 0)) or None,
+        alternatives[0].get("status") == "ALTERNATIVE_STATUS_TRUNCATED_FINAL",
+        prefix=prefix
+    )
@@ -1,10 +1,13 @@
 import json
 from datetime import datetime, timedelta
 from typing import List
-from openai import AsyncOpenAI
-import httpx
 from app.core.config import settings
+from app.core.deadline import DeadlineExceededError
 from app.schemas.schemas import ChannelResult, ContentPlanItem, GoalEnum
+from app.services.validator import fix_channel_result
+from app.services.budget import content_plan_max_tokens
+from app.services.llm import complete, content_plan_schema, llm_available, strip_json_fences, LLMProviderError
+from app.services.prompts import PromptLayout
 
 
 CONTENT_PLAN_PROMPT = """Создай контент-план на {days} дней для продукта: {product}
@@ -12,20 +15,22 @@ CONTENT_PLAN_PROMPT = """Создай контент-план на {days} дне
 Каналы: {channels}
 Цель: {goal}
 
-Верни JSON-массив:
-[
-  {{
-    "day": 1,
-    "topic": "Тема поста",
-    "channel": "Telegram",
-    "headline": "Заголовок",
-    "body": "Текст поста...",
-    "cta": "Призыв к действию",
-    "hashtags": ["#хештег"],
-    "score": 8.0
-  }},
-  ...
-]
+Верни JSON-объект:
+{{
+  "plan": [
+    {{
+      "day": 1,
+      "topic": "Тема поста",
+      "channel": "Telegram",
+      "headline": "Заголовок",
+      "body": "Текст поста...",
+      "cta": "Призыв к действию",
+      "hashtags": ["#хештег"],
+      "score": 8.0
+    }},
+    ...
+  ]
+}}
 
 Требования:
 - Каждый день один пост
@@ -36,39 +41,10 @@ CONTENT_PLAN_PROMPT = """Создай контент-план на {days} дне
 - Оценка качества (score) от 1 до 10"""
 
 
-async def generate_content_plan_openai(
-    product: str,
-    days: int,
-    channels: List[str],
-    goal: GoalEnum
-) -> List[ContentPlanItem]:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
-    prompt = CONTENT_PLAN_PROMPT.format(
-        days=days,
-        product=product,
-        channels=", ".join(channels),
-        goal=goal.value if isinstance(goal, GoalEnum) else goal
-    )
-    
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": "Ты — профессиональный SMM-стратег. Создаёшь продающие контент-планы."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7,
-        max_tokens=6000
-    )
-    
-    content = response.choices[0].message.content or "[]"
-    return parse_content_plan_response(content, days, channels)
+CONTENT_PLAN_SYSTEM_PROMPT = "Ты — профессиональный SMM-стратег. Создаёшь продающие контент-планы."
 
 
-async def generate_content_plan_yandex(
+async def generate_content_plan_llm(
     product: str,
     days: int,
     channels: List[str],
@@ -81,29 +57,13 @@ async def generate_content_plan_yandex(
         goal=goal.value if isinstance(goal, GoalEnum) else goal
     )
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.7,
-                    "maxTokens": 6000
-                },
-                "messages": [
-                    {"role": "system", "text": "Ты — профессиональный SMM-стратег. Создаёшь продающие контент-планы."},
-                    {"role": "user", "text": prompt}
-                ]
-            },
-            timeout=90.0
-        )
-        content = response.json()["result"]["alternatives"][0]["message"]["text"]
-        return parse_content_plan_response(content, days, channels)
+    content = await complete(
+        "content_plan",
+        PromptLayout(CONTENT_PLAN_SYSTEM_PROMPT, [], [prompt]),
+        content_plan_schema(days),
+        content_plan_max_tokens(days)
+    )
+    return parse_content_plan_response(content or "", days, channels)
 
 
 def generate_mock_content_plan(
@@ -147,17 +107,9 @@ def generate_mock_content_plan(
 
 def parse_content_plan_response(content: str, days: int, channels: List[str]) -> List[ContentPlanItem]:
     try:
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        
-        raw_items = json.loads(content.strip())
-        
+        raw_items = json.loads(strip_json_fences(content)).get("plan")
         if not isinstance(raw_items, list):
-            raw_items = [raw_items]
+            raise ValueError("content plan response has no plan array")
         
         items = []
         today = datetime.now()
@@ -202,16 +154,17 @@ async def generate_content_plan(
     channels: List[str],
     goal: GoalEnum = GoalEnum.SALES
 ) -> List[ContentPlanItem]:
-    if settings.MOCK_MODE:
+    if settings.MOCK_MODE or not llm_available():
         return generate_mock_content_plan(product, days, channels)
     
     try:
-        if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-            return await generate_content_plan_yandex(product, days, channels, goal)
-        elif settings.OPENAI_API_KEY:
-            return await generate_content_plan_openai(product, days, channels, goal)
-        else:
-            return generate_mock_content_plan(product, days, channels)
+        plan = await generate_content_plan_llm(product, days, channels, goal)
+    except (LLMProviderError, DeadlineExceededError):
+        raise
     except Exception as e:
         print(f"Error generating content plan: {e}")
         return generate_mock_content_plan(product, days, channels)
+    
+    for item in plan:
+        item.draft = await fix_channel_result(item.draft, item.channel, use_llm=False)
+    return plan
@@ -0,0 +1,379 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import metrics
+from app.models.models import StreamEvent, StreamKey
+
+
+TERMINAL_EVENTS = {"done", "error", "cancelled"}
+NOTIFY_CHANNEL = "stream_events"
+NOTIFY_MAX_BYTES = 8000
+CATCH_UP_INTERVAL = 5.0
+CLEANUP_INTERVAL = 60.0
+LISTEN_HEALTH_INTERVAL = 15.0
+LISTEN_HEALTH_TIMEOUT = 5.0
+RECONNECT_MAX_DELAY = 30.0
+
+StreamKeyId = Tuple[int, str]
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class EventBus:
+    def __init__(self):
+        self.logs: Dict[str, List[str]] = {}
+        self.touched: Dict[str, float] = {}
+        self.closed: Set[str] = set()
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+    
+    async def start(self) -> None:
+        pass
+    
+    async def stop(self) -> None:
+        pass
+    
+    def prune(self) -> None:
+        now = time.monotonic()
+        for stream, touched in list(self.touched.items()):
+            if now - touched > settings.STREAM_RESUME_TTL and stream not in self.waiters:
+                self.logs.pop(stream, None)
+                self.closed.discard(stream)
+                del self.touched[stream]
+        metrics.set_gauge("event_bus_streams", len(self.logs))
+    
+    def append(self, stream: str, seq: int, event: str, payload: str) -> None:
+        log = self.logs.setdefault(stream, [])
+        if seq != len(log) + 1:
+            return
+        log.append(payload)
+        self.touched[stream] = time.monotonic()
+        if event in TERMINAL_EVENTS:
+            self.closed.add(stream)
+        for waiter in self.waiters.get(stream, ()):
+            waiter.set()
+    
+    async def publish(self, stream: str, event: str, data: dict) -> int:
+        seq = len(self.logs.get(stream, [])) + 1
+        payload = format_event(event, data, seq)
+        await self.store(stream, seq, event, payload)
+        self.append(stream, seq, event, payload)
+        metrics.inc("event_bus_published_total", event=event)
+        return seq
+    
+    async def close(self, stream: str, event: str, data: dict) -> None:
+        try:
+            await self.publish(stream, event, data)
+        except Exception as e:
+            print(f"Event bus: failed to store {event} for {stream}, closing locally: {e!r}")
+            metrics.inc("event_bus_terminal_fallback_total", event=event)
+            seq = len(self.logs.get(stream, [])) + 1
+            self.append(stream, seq, event, format_event(event, data, seq))
+    
+    async def store(self, stream: str, seq: int, event: str, payload: str) -> None:
+        pass
+    
+    async def catch_up(self, stream: str) -> None:
+        pass
+    
+    async def known(self, stream: str) -> bool:
+        return stream in self.logs
+    
+    async def claim(self, key: StreamKeyId, generation_id: int) -> int:
+        return generation_id
+    
+    async def lookup(self, key: StreamKeyId) -> Optional[int]:
+        return None
+    
+    async def unclaim(self, key: StreamKeyId, generation_id: int) -> None:
+        pass
+    
+    def subscriber_count(self, stream: str) -> int:
+        return len(self.waiters.get(stream, ()))
+    
+    def presence(self, stream: str, delta: int) -> None:
+        pass
+    
+    def is_closed(self, stream: str, after: int) -> bool:
+        return stream in self.closed and after >= len(self.logs.get(stream, []))
+    
+    async def subscribe(
+        self,
+        stream: str,
+        after: int = 0,
+        alive: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> AsyncIterator[str]:
+        self.prune()
+        waiter = asyncio.Event()
+        self.waiters.setdefault(stream, set()).add(waiter)
+        metrics.set_gauge("event_bus_subscribers", sum(len(w) for w in self.waiters.values()))
+        self.presence(stream, 1)
+        try:
+            await self.catch_up(stream)
+            live = False
+            idle_since = time.monotonic()
+            while not self.is_closed(stream, after):
+                log = self.logs.get(stream, [])
+                if len(log) <= after:
+                    live = True
+                    waiter.clear()
+                    try:
+                        await asyncio.wait_for(waiter.wait(), timeout=CATCH_UP_INTERVAL)
+                    except asyncio.TimeoutError:
+                        await self.catch_up(stream)
+                        if len(self.logs.get(stream, [])) > after:
+                            continue
+                        idle = time.monotonic() - idle_since > settings.STREAM_IDLE_TIMEOUT
+                        if idle or (alive is not None and not await alive()):
+                            metrics.inc("event_bus_stalled_streams_total", reason="idle" if idle else "owner")
+                            yield format_event("error", {"detail": "Генерация прервана, попробуйте ещё раз"})
+                            return
+                    continue
+                if live and len(log) - after > settings.STREAM_SUBSCRIBER_BUFFER:
+                    metrics.inc("event_bus_slow_subscriber_total")
+                    print(f"Event bus: dropping subscriber of {stream}, {len(log) - after} events behind")
+                    return
+                for payload in log[after:after + settings.STREAM_SUBSCRIBER_BUFFER]:
+                    after += 1
+                    yield payload
+                idle_since = time.monotonic()
+        finally:
+            self.waiters[stream].discard(waiter)
+            if not self.waiters[stream]:
+                del self.waiters[stream]
+            metrics.set_gauge("event_bus_subscribers", sum(len(w) for w in self.waiters.values()))
+            self.presence(stream, -1)
+
+
+class PostgresEventBus(EventBus):
+    def __init__(self):
+        super().__init__()
+        self.node = uuid.uuid4().hex
+        self.remote: Dict[str, int] = {}
+        self.connection = None
+        self.fetching: Dict[str, asyncio.Task] = {}
+        self.pending: Set[asyncio.Task] = set()
+        self.cleaned_at = 0.0
+        self.lost = asyncio.Event()
+        self.watcher: Optional[asyncio.Task] = None
+    
+    def dsn(self) -> str:
+        return settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+    
+    async def start(self) -> None:
+        await self.listen()
+        self.watcher = asyncio.create_task(self.watch())
+    
+    async def stop(self) -> None:
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            await connection.close()
+    
+    async def listen(self) -> None:
+        import asyncpg
+        
+        connection = await asyncpg.connect(self.dsn())
+        connection.add_termination_listener(self.on_terminated)
+        await connection.add_listener(NOTIFY_CHANNEL, self.on_notify)
+        self.connection = connection
+        print(f"Event bus: listening on {NOTIFY_CHANNEL} as node {self.node[:8]}")
+    
+    def on_terminated(self, connection) -> None:
+        if connection is self.connection:
+            print(f"Event bus: lost LISTEN connection on {NOTIFY_CHANNEL}")
+            self.lost.set()
+    
+    async def healthy(self) -> bool:
+        if self.connection is None or self.connection.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(self.connection.fetchval("SELECT 1"), timeout=LISTEN_HEALTH_TIMEOUT)
+            return True
+        except Exception as e:
+            print(f"Event bus: LISTEN health check failed: {e!r}")
+            return False
+    
+    async def watch(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.lost.wait(), timeout=LISTEN_HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if self.lost.is_set() or not await self.healthy():
+                self.lost.clear()
+                await self.reconnect()
+    
+    async def reconnect(self) -> None:
+        delay = 1.0
+        while True:
+            connection, self.connection = self.connection, None
+            if connection is not None and not connection.is_closed():
+                connection.terminate()
+            try:
+                await self.listen()
+                break
+            except Exception as e:
+                print(f"Event bus: reconnect failed, retrying in {delay:.0f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(RECONNECT_MAX_DELAY, delay * 2)
+        metrics.inc("event_bus_reconnects_total")
+        for stream in list(self.waiters):
+            if stream not in self.fetching:
+                self.fetching[stream] = asyncio.create_task(self.fetch(stream))
+    
+    async def notify(self, session, message: dict) -> None:
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": NOTIFY_CHANNEL, "payload": json.dumps(message, ensure_ascii=False)}
+        )
+    
+    def notify_message(self, stream: str, seq: int, event: str, payload: str) -> dict:
+        message = {"node": self.node, "stream": stream, "seq": seq, "event": event, "payload": payload}
+        if len(json.dumps(message, ensure_ascii=False).encode()) >= NOTIFY_MAX_BYTES:
+            del message["payload"]
+            metrics.inc("event_bus_payload_skipped_total", event=event)
+        return message
+    
+    async def store(self, stream: str, seq: int, event: str, payload: str) -> None:
+        async with AsyncSessionLocal() as session:
+            session.add(StreamEvent(stream=stream, seq=seq, event=event, payload=payload))
+            await session.commit()
+            try:
+                await self.notify(session, self.notify_message(stream, seq, event, payload))
+                await session.commit()
+            except Exception as e:
+                metrics.inc("event_bus_notify_failed_total", event=event)
+                print(f"Event bus notify failed for {stream}#{seq}: {e!r}")
+        await self.cleanup()
+    
+    def cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=settings.STREAM_RESUME_TTL)
+    
+    async def cleanup(self) -> None:
+        now = time.monotonic()
+        if now - self.cleaned_at < CLEANUP_INTERVAL:
+            return
+        self.cleaned_at = now
+        cutoff = self.cutoff()
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(StreamEvent).where(StreamEvent.created_at < cutoff))
+            await session.execute(delete(StreamKey).where(StreamKey.created_at < cutoff))
+            await session.commit()
+    
+    def presence(self, stream: str, delta: int) -> None:
+        task = asyncio.create_task(self.send_presence(stream, delta))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+    
+    async def send_presence(self, stream: str, delta: int) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                await self.notify(session, {"node": self.node, "stream": stream, "presence": delta})
+                await session.commit()
+        except Exception as e:
+            print(f"Event bus presence failed for {stream}: {e!r}")
+    
+    def subscriber_count(self, stream: str) -> int:
+        return super().subscriber_count(stream) + self.remote.get(stream, 0)
+    
+    def on_notify(self, connection, pid, channel, raw: str) -> None:
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        if message.get("node") == self.node:
+            return
+        stream = message.get("stream")
+        if "presence" in message:
+            self.remote[stream] = max(0, self.remote.get(stream, 0) + message["presence"])
+            if not self.remote[stream]:
+                del self.remote[stream]
+            return
+        if stream not in self.waiters:
+            return
+        metrics.inc("event_bus_notifications_total")
+        if "payload" in message:
+            self.append(stream, message["seq"], message["event"], message["payload"])
+        if len(self.logs.get(stream, [])) < message["seq"] and stream not in self.fetching:
+            self.fetching[stream] = asyncio.create_task(self.fetch(stream))
+    
+    async def fetch(self, stream: str) -> None:
+        try:
+            await self.catch_up(stream)
+        except Exception as e:
+            print(f"Event bus fetch failed for {stream}: {e!r}")
+        finally:
+            self.fetching.pop(stream, None)
+    
+    async def catch_up(self, stream: str) -> None:
+        after = len(self.logs.get(stream, []))
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(StreamEvent.seq, StreamEvent.event, StreamEvent.payload)
+                .where(StreamEvent.stream == stream, StreamEvent.seq > after)
+                .order_by(StreamEvent.seq)
+            )).all()
+        for seq, event, payload in rows:
+            self.append(stream, seq, event, payload)
+    
+    async def known(self, stream: str) -> bool:
+        if stream in self.logs:
+            return True
+        async with AsyncSessionLocal() as session:
+            count = await session.scalar(select(func.count()).where(StreamEvent.stream == stream))
+        return bool(count)
+    
+    async def claim(self, key: StreamKeyId, generation_id: int) -> int:
+        user_id, name = key
+        insert = pg_insert(StreamKey).values(user_id=user_id, key=name, generation_id=generation_id)
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert.on_conflict_do_update(
+                index_elements=[StreamKey.user_id, StreamKey.key],
+                set_={"generation_id": generation_id, "created_at": datetime.utcnow()},
+                where=StreamKey.created_at < self.cutoff()
+            ))
+            owner = await session.scalar(
+                select(StreamKey.generation_id).where(StreamKey.user_id == user_id, StreamKey.key == name)
+            )
+            await session.commit()
+        return owner
+    
+    async def lookup(self, key: StreamKeyId) -> Optional[int]:
+        user_id, name = key
+        async with AsyncSessionLocal() as session:
+            return await session.scalar(select(StreamKey.generation_id).where(
+                StreamKey.user_id == user_id,
+                StreamKey.key == name,
+                StreamKey.created_at >= self.cutoff()
+            ))
+    
+    async def unclaim(self, key: StreamKeyId, generation_id: int) -> None:
+        user_id, name = key
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(StreamKey).where(
+                StreamKey.user_id == user_id,
+                StreamKey.key == name,
+                StreamKey.generation_id == generation_id
+            ))
+            await session.commit()
+
+
+def create_event_bus() -> EventBus:
+    if settings.EVENT_BUS == "postgres":
+        return PostgresEventBus()
+    return EventBus()
+
+
+event_bus = create_event_bus()
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.database import AsyncSessionLocal, detached_context
+from app.models.models import Generation
+from app.services.event_bus import event_bus
+
+
+DISCONNECT_POLICIES = {"cancel", "finish"}
+
+TaskKey = Tuple[int, str]
+
+
+def disconnect_policy() -> str:
+    policy = settings.STREAM_DISCONNECT_POLICY.lower()
+    return policy if policy in DISCONNECT_POLICIES else "cancel"
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    try:
+        return max(0, int(value or 0))
+    except ValueError:
+        return 0
+
+
+def task_key(user_id: int, payload: str, idempotency_key: Optional[str] = None) -> TaskKey:
+    if idempotency_key:
+        return user_id, f"key:{hashlib.sha256(idempotency_key.encode()).hexdigest()}"
+    return user_id, f"body:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def shared_key(key: TaskKey) -> bool:
+    return key[1].startswith("key:")
+
+
+def stream_name(generation_id: int) -> str:
+    return f"generation:{generation_id}"
+
+
+class GenerationTask:
+    def __init__(self, generation_id: int, user_id: int, key: TaskKey):
+        self.generation_id = generation_id
+        self.user_id = user_id
+        self.key = key
+        self.stream = stream_name(generation_id)
+        self.task: Optional[asyncio.Task] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_timer: Optional[asyncio.TimerHandle] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+    
+    async def publish(self, event: str, data: dict) -> None:
+        await event_bus.publish(self.stream, event, data)
+    
+    async def close(self, event: str, data: dict) -> None:
+        await event_bus.close(self.stream, event, data)
+    
+    def finish(self, cancelled: bool = False) -> None:
+        self.finished_at = time.monotonic()
+        self.attached()
+        if not cancelled and not event_bus.subscriber_count(self.stream):
+            metrics.inc("stream_detached_completed_total", endpoint="generate")
+    
+    def attached(self) -> None:
+        if self.cancel_timer:
+            self.cancel_timer.cancel()
+            self.cancel_timer = None
+    
+    def schedule_cancel(self) -> None:
+        self.cancel_timer = asyncio.get_running_loop().call_later(settings.STREAM_RESUME_GRACE, self.cancel)
+    
+    def cancel(self) -> None:
+        self.cancel_timer = None
+        if self.finished:
+            return
+        if event_bus.subscriber_count(self.stream):
+            self.schedule_cancel()
+            return
+        self.task.cancel()
+    
+    def abandoned(self) -> None:
+        if self.finished or self.cancel_timer or disconnect_policy() != "cancel":
+            return
+        if not event_bus.subscriber_count(self.stream):
+            self.schedule_cancel()
+
+
+async def owner_alive(generation_id: int) -> bool:
+    task = _tasks.get(generation_id)
+    if task is not None:
+        return not task.finished
+    async with AsyncSessionLocal() as session:
+        return await session.get(Generation, generation_id) is not None
+
+
+async def subscribe(generation_id: int, last_event_id: int = 0) -> AsyncIterator[str]:
+    task = _tasks.get(generation_id)
+    if task:
+        task.attached()
+    events = event_bus.subscribe(stream_name(generation_id), last_event_id, lambda: owner_alive(generation_id))
+    completed = False
+    try:
+        async for payload in events:
+            yield payload
+        completed = True
+    finally:
+        await events.aclose()
+        if not completed:
+            metrics.inc("stream_disconnects_total", endpoint="generate", policy=disconnect_policy())
+            task = _tasks.get(generation_id)
+            if task:
+                task.abandoned()
+
+
+_tasks: Dict[int, GenerationTask] = {}
+_keys: Dict[TaskKey, int] = {}
+
+
+def prune() -> None:
+    now = time.monotonic()
+    for generation_id, task in list(_tasks.items()):
+        if task.finished and now - task.finished_at > settings.STREAM_RESUME_TTL:
+            del _tasks[generation_id]
+            forget_key(task)
+    metrics.set_gauge("generation_tasks_running", sum(1 for task in _tasks.values() if not task.finished))
+
+
+def forget_key(task: GenerationTask) -> None:
+    if _keys.get(task.key) == task.generation_id:
+        del _keys[task.key]
+
+
+async def release_key(task: GenerationTask) -> None:
+    forget_key(task)
+    if not shared_key(task.key):
+        return
+    try:
+        await event_bus.unclaim(task.key, task.generation_id)
+    except Exception as e:
+        print(f"Failed to release stream key for generation {task.generation_id}: {e!r}")
+
+
+def get_task(generation_id: int) -> Optional[GenerationTask]:
+    prune()
+    return _tasks.get(generation_id)
+
+
+def find_task(key: TaskKey) -> Optional[GenerationTask]:
+    prune()
+    task = _tasks.get(_keys.get(key))
+    if task is None or (task.finished and not shared_key(key)):
+        return None
+    return task
+
+
+async def _run(task: GenerationTask, run: Callable[[GenerationTask], Awaitable[None]]) -> None:
+    cancelled = False
+    try:
+        await run(task)
+    except asyncio.CancelledError:
+        cancelled = True
+        await release_key(task)
+        await task.close("cancelled", {"generation_id": task.generation_id})
+        raise
+    except Exception as e:
+        await release_key(task)
+        print(f"Generation {task.generation_id} failed: {e!r}")
+        await task.close("error", {"generation_id": task.generation_id, "detail": str(e)[:200]})
+    finally:
+        task.finish(cancelled)
+
+
+def start_task(
+    generation_id: int,
+    user_id: int,
+    key: TaskKey,
+    run: Callable[[GenerationTask], Awaitable[None]]
+) -> GenerationTask:
+    prune()
+    task = GenerationTask(generation_id, user_id, key)
+    _tasks[generation_id] = task
+    _keys[key] = generation_id
+    task.task = asyncio.create_task(_run(task, run), context=detached_context())
+    metrics.inc("generation_tasks_started_total")
+    return task
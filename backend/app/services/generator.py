@@ -1,14 +1,23 @@
 import json
+import asyncio
 from typing import Dict, List, Optional, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from openai import AsyncOpenAI
-import httpx
+from sqlalchemy import select, update, func, cast, JSON, Text
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, array as pg_array
 from app.core.config import settings
-from app.models.models import BrandVoice
+from app.core.metrics import metrics
+from app.core.deadline import DeadlineExceededError, clamp as clamp_deadline, expired, remaining as remaining_time
+from app.models.models import BrandVoice, Generation
 from app.schemas.schemas import GenerateRequest, GoalEnum, ToneEnum, ChannelResult
+from app.services.validator import enforce_constraints
+from app.services.budget import fit_brand_voice, generation_max_tokens
+from app.services.prompts import PromptLayout
+from app.services.similarity import similarity_matrix, find_duplicates, variant_text, annotate_similarity
+from app.services.llm import channels_schema, complete, llm_available, LLMProviderError
 
 
+IMAGE_MIN_SECONDS = 10.0
+
 SYSTEM_PROMPT = """Ты — профессиональный SMM-специалист и маркетолог с 10-летним опытом. Создаёшь продающие тексты для российских маркетинговых каналов.
 
 ПРИНЦИПЫ:
@@ -56,14 +65,37 @@ TONE_INSTRUCTIONS = {
 }
 
 
-def build_prompt(
-    request: GenerateRequest,
-    brand_voice: str = "Профессиональный, но дружелюбный стиль."
-) -> str:
+CHANNEL_JSON_EXAMPLES = {
+    "Директ": '{"headline": "...", "body": "...", "cta": "...", "score": 8.5, "improvements": ["..."]}',
+    "Telegram": '{"body": "...", "hashtags": ["#..."], "cta": "...", "score": 9.0, "improvements": ["..."]}',
+    "Email": '{"headline": "тема", "body": "...", "cta": "...", "score": 8.0, "improvements": ["..."]}',
+    "VK": '{"body": "...", "hashtags": ["#..."], "cta": "...", "score": 8.5, "improvements": ["..."]}',
+    "Дзен": '{"headline": "интригующий заголовок", "body": "лонгрид текст...", "image_prompt": "описание для картинки", "hashtags": ["#..."], "cta": "...", "score": 8.5, "improvements": ["..."]}'
+}
+
+
+GENERATE_JSON_FORMAT = "ВЕРНИ JSON (только JSON, без markdown):\n{\n" + ",\n".join(
+    f'  "{channel}": [\n    {example}\n  ]' for channel, example in CHANNEL_JSON_EXAMPLES.items()
+) + "\n}"
+
+
+GENERATE_RULES = """Важно:
+- Верни только запрошенные каналы
+- score от 1 до 10
+- improvements — 1-2 рекомендации
+- Варианты должны отличаться!
+- Для Telegram, VK, Дзен обязательно добавь 3-5 продающих хештегов
+- Для Дзен добавь image_prompt — описание для генерации картинки"""
+
+
+CHANNEL_RULES = """Важно:
+- score от 1 до 10
+- Варианты должны отличаться!"""
+
+
+def build_request_context(request: GenerateRequest) -> str:
     from app.schemas.schemas import PostFormatEnum
     
-    variants_hint = f"по {request.num_variants} варианта" if request.num_variants > 1 else "вариант"
-    
     goal_instruction = GOAL_INSTRUCTIONS.get(request.goal, GOAL_INSTRUCTIONS[GoalEnum.SALES])
     tone_instruction = TONE_INSTRUCTIONS.get(request.tone, TONE_INSTRUCTIONS[ToneEnum.FRIENDLY])
     
@@ -74,50 +106,77 @@ def build_prompt(
     if request.format and request.format != PostFormatEnum.SHORT:
         format_instruction = f"\n{FORMAT_INSTRUCTIONS.get(request.format.value if hasattr(request.format, 'value') else request.format, '')}"
     
+    return f"{goal_instruction}\n{tone_instruction}{audience_text}{offer_text}{format_instruction}"
+
+
+def is_short_format(request: GenerateRequest) -> bool:
+    from app.schemas.schemas import PostFormatEnum
+    
+    return request.format in (None, PostFormatEnum.SHORT)
+
+
+def build_prompt(
+    request: GenerateRequest,
+    brand_voice: str = "Профессиональный, но дружелюбный стиль."
+) -> PromptLayout:
+    variants_hint = f"по {request.num_variants} варианта" if request.num_variants > 1 else "вариант"
+    
     channels_list = ", ".join(request.channels)
     
-    prompt = f"""{goal_instruction}
-{tone_instruction}{audience_text}{offer_text}{format_instruction}
-
-Стиль бренда: {brand_voice}
-
-ЗАДАЧА: Сгенерируй {variants_hint} текста для каналов: {channels_list}
-
-Продукт/акция:
-{request.description}
-
-ВЕРНИ JSON (только JSON, без markdown):
-{{
-  "Директ": [
-    {{"headline": "...", "body": "...", "cta": "...", "score": 8.5, "improvements": ["..."]}}
-  ],
-  "Telegram": [
-    {{"body": "...", "hashtags": ["#..."], "cta": "...", "score": 9.0, "improvements": ["..."]}}
-  ],
-  "Email": [
-    {{"headline": "тема", "body": "...", "cta": "...", "score": 8.0, "improvements": ["..."]}}
-  ],
-  "VK": [
-    {{"body": "...", "hashtags": ["#..."], "cta": "...", "score": 8.5, "improvements": ["..."]}}
-  ],
-  "Дзен": [
-    {{"headline": "интригующий заголовок", "body": "лонгрид текст...", "image_prompt": "описание для картинки", "hashtags": ["#..."], "cta": "...", "score": 8.5, "improvements": ["..."]}}
-  ]
-}}
-
-Важно:
-- Верни только запрошенные каналы
-- Для каждого канала ровно {request.num_variants} вариант(а) в массиве
-- score от 1 до 10
-- improvements — 1-2 рекомендации
-- Варианты должны отличаться!
-- Для Telegram, VK, Дзен обязательно добавь 3-5 продающих хештегов
-- Для Дзен добавь image_prompt — описание для генерации картинки"""
+    return PromptLayout(
+        SYSTEM_PROMPT,
+        static=[GENERATE_JSON_FORMAT, GENERATE_RULES, f"Стиль бренда: {brand_voice}"],
+        variable=[
+            build_request_context(request),
+            f"ЗАДАЧА: Сгенерируй {variants_hint} текста для каналов: {channels_list}\n"
+            f"Для каждого канала ровно {request.num_variants} вариант(а) в массиве",
+            f"Продукт/акция:\n{request.description}"
+        ]
+    )
+
+
+def build_channel_prompt(
+    request: GenerateRequest,
+    channel: str,
+    count: int,
+    brand_voice: str = "Профессиональный, но дружелюбный стиль.",
+    avoid: Optional[List[str]] = None
+) -> PromptLayout:
+    example = CHANNEL_JSON_EXAMPLES.get(channel, CHANNEL_JSON_EXAMPLES["Telegram"])
+    
+    avoid_text = ""
+    if avoid:
+        avoided = "\n".join(f"- {text[:300]}" for text in avoid)
+        avoid_text = f"Новые варианты должны заметно отличаться от уже написанных:\n{avoided}"
+    
+    return PromptLayout(
+        SYSTEM_PROMPT,
+        static=[
+            f"ВЕРНИ JSON (только JSON, без markdown):\n{{\"{channel}\": [{example}]}}",
+            CHANNEL_RULES,
+            f"Стиль бренда: {brand_voice}"
+        ],
+        variable=[
+            build_request_context(request),
+            f"ЗАДАЧА: Сгенерируй {count} вариант(а) текста ТОЛЬКО для канала: {channel}\n"
+            f"Ровно {count} вариант(а) в массиве",
+            f"Продукт/акция:\n{request.description}",
+            avoid_text
+        ]
+    )
+
 
-    return prompt
+def _mark_failed(failed: Optional[Dict[str, List[int]]], channel: str, indices) -> None:
+    if failed is not None:
+        failed.setdefault(channel, []).extend(indices)
 
 
-def parse_llm_response(response_text: str, channels: List[str], num_variants: int) -> Dict[str, List[ChannelResult]]:
+def parse_llm_response(
+    response_text: str,
+    channels: List[str],
+    num_variants: int,
+    failed: Optional[Dict[str, List[int]]] = None
+) -> Dict[str, List[ChannelResult]]:
     try:
         response_text = response_text.strip()
         if response_text.startswith("```json"):
@@ -139,6 +198,7 @@ def parse_llm_response(response_text: str, channels: List[str], num_variants: in
                     break
             
             if channel_data is None:
+                _mark_failed(failed, channel, range(num_variants))
                 result[channel] = [ChannelResult(
                     body=f"Не удалось сгенерировать текст для {channel}",
                     score=0,
@@ -164,6 +224,9 @@ def parse_llm_response(response_text: str, channels: List[str], num_variants: in
                         improvements=v.get("improvements")
                     ))
             
+            _mark_failed(failed, channel, [i for i, v in enumerate(parsed_variants) if not v.body.strip()])
+            _mark_failed(failed, channel, range(len(parsed_variants), num_variants))
+            
             while len(parsed_variants) < num_variants:
                 parsed_variants.append(ChannelResult(
                     body=f"Вариант {len(parsed_variants) + 1}",
@@ -174,14 +237,18 @@ def parse_llm_response(response_text: str, channels: List[str], num_variants: in
             result[channel] = parsed_variants
         
         return result
-        
+    
     except json.JSONDecodeError as e:
+        for ch in channels:
+            _mark_failed(failed, ch, range(num_variants))
         return {ch: [ChannelResult(
             body="Ошибка парсинга. Попробуйте ещё раз.",
             score=0,
             improvements=[f"Ошибка: {str(e)[:50]}"]
         ) for _ in range(num_variants)] for ch in channels}
     except Exception as e:
+        for ch in channels:
+            _mark_failed(failed, ch, range(num_variants))
         return {ch: [ChannelResult(
             body="Ошибка генерации. Попробуйте ещё раз.",
             score=0,
@@ -194,62 +261,16 @@ async def get_brand_voice(db: AsyncSession, channel: Optional[str] = None) -> st
         result = await db.execute(select(BrandVoice).where(BrandVoice.channel == channel))
         brand_voice = result.scalar_one_or_none()
         if brand_voice:
-            return brand_voice.content
+            return fit_brand_voice(brand_voice.content)
     
     result = await db.execute(select(BrandVoice).where(BrandVoice.channel == "general"))
     brand_voice = result.scalar_one_or_none()
     if brand_voice:
-        return brand_voice.content
+        return fit_brand_voice(brand_voice.content)
     
     return "Профессиональный, но дружелюбный стиль."
 
 
-async def generate_with_openai(prompt: str) -> str:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.8,
-        max_tokens=4000
-    )
-    
-    return response.choices[0].message.content or ""
-
-
-async def generate_with_yandex(prompt: str) -> str:
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.8,
-                    "maxTokens": 4000
-                },
-                "messages": [
-                    {"role": "system", "text": SYSTEM_PROMPT},
-                    {"role": "user", "text": prompt}
-                ]
-            },
-            timeout=60.0
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data["result"]["alternatives"][0]["message"]["text"]
-
-
 def generate_mock_response(request: GenerateRequest) -> Dict[str, List[ChannelResult]]:
     mock_data: Dict[str, List[ChannelResult]] = {}
     
@@ -303,6 +324,155 @@ def generate_mock_response(request: GenerateRequest) -> Dict[str, List[ChannelRe
     return mock_data
 
 
+async def call_llm(
+    prompt: PromptLayout,
+    schema: Optional[Dict[str, Any]] = None,
+    max_tokens: Optional[int] = None
+) -> Optional[str]:
+    if not llm_available():
+        return None
+    return await complete("generate", prompt, schema, max_tokens)
+
+
+async def retry_channel(
+    request: GenerateRequest,
+    brand_voice: str,
+    channel: str,
+    indices: List[int],
+    deadline: float,
+    avoid: Optional[List[str]] = None
+) -> Dict[int, ChannelResult]:
+    loop = asyncio.get_running_loop()
+    recovered: Dict[int, ChannelResult] = {}
+    pending = list(indices)
+    
+    for attempt in range(settings.GENERATE_RETRY_ATTEMPTS):
+        remaining = deadline - loop.time()
+        if not pending or remaining <= 1:
+            break
+        
+        prompt = build_channel_prompt(request, channel, len(pending), brand_voice, avoid)
+        still_failed: Dict[str, List[int]] = {}
+        try:
+            response_text = await asyncio.wait_for(
+                call_llm(
+                    prompt,
+                    channels_schema([channel], len(pending)),
+                    max_tokens=generation_max_tokens([channel], len(pending), is_short_format(request))
+                ),
+                timeout=remaining
+            )
+            variants = parse_llm_response(response_text or "", [channel], len(pending), still_failed)[channel]
+        except Exception as e:
+            print(f"Retry {attempt + 1} failed for {channel}: {e}")
+            metrics.inc("generate_channel_retry_total", channel=channel, outcome="error")
+            continue
+        
+        bad = set(still_failed.get(channel, []))
+        for j, index in enumerate(pending):
+            if j not in bad:
+                recovered[index] = variants[j].model_copy(update={"retried": True})
+        metrics.inc("generate_channel_retry_total", channel=channel, outcome="ok" if not bad else "partial")
+        pending = [index for j, index in enumerate(pending) if j in bad]
+    
+    return recovered
+
+
+async def retry_failed_channels(
+    request: GenerateRequest,
+    brand_voice: str,
+    results: Dict[str, List[ChannelResult]],
+    failed: Dict[str, List[int]]
+) -> Dict[str, List[int]]:
+    deadline = clamp_deadline(asyncio.get_running_loop().time() + settings.GENERATE_RETRY_BUDGET)
+    channels = [ch for ch, indices in failed.items() if indices]
+    
+    recovered = await asyncio.gather(*[
+        retry_channel(request, brand_voice, ch, sorted(set(failed[ch])), deadline)
+        for ch in channels
+    ])
+    
+    remaining: Dict[str, List[int]] = {}
+    for channel, channel_recovered in zip(channels, recovered):
+        for index, variant in channel_recovered.items():
+            results[channel][index] = variant
+        still_failed = [i for i in sorted(set(failed[channel])) if i not in channel_recovered]
+        if still_failed:
+            remaining[channel] = still_failed
+    
+    return remaining
+
+
+async def regenerate_duplicates(
+    request: GenerateRequest,
+    brand_voice: str,
+    results: Dict[str, List[ChannelResult]]
+) -> Dict[str, List[ChannelResult]]:
+    deadline = clamp_deadline(asyncio.get_running_loop().time() + settings.GENERATE_RETRY_BUDGET)
+    duplicates: Dict[str, List[int]] = {}
+    
+    for channel, variants in results.items():
+        matrix = similarity_matrix([variant_text(v) for v in variants])
+        indices = find_duplicates(matrix, settings.DUPLICATE_THRESHOLD)
+        if indices:
+            duplicates[channel] = indices
+            metrics.inc("generate_duplicate_variants_total", len(indices), channel=channel)
+    
+    if duplicates:
+        channels = list(duplicates.keys())
+        recovered = await asyncio.gather(*[
+            retry_channel(
+                request, brand_voice, ch, duplicates[ch], deadline,
+                avoid=[v.body for i, v in enumerate(results[ch]) if i not in duplicates[ch]]
+            )
+            for ch in channels
+        ])
+        for channel, channel_recovered in zip(channels, recovered):
+            for index, variant in channel_recovered.items():
+                results[channel][index] = variant
+    
+    return {channel: annotate_similarity(variants) for channel, variants in results.items()}
+
+
+def failed_variants(channel: str, count: int, reason: str) -> List[ChannelResult]:
+    return [ChannelResult(
+        body=f"Не удалось сгенерировать текст для {channel}",
+        score=0,
+        improvements=[reason[:50]]
+    ) for _ in range(count)]
+
+
+def _error_results(request: GenerateRequest, error: Exception) -> Dict[str, List[ChannelResult]]:
+    return {ch: failed_variants(ch, request.num_variants, str(error)) for ch in request.channels}
+
+
+def is_provider_error(error: Exception) -> bool:
+    return isinstance(error, (LLMProviderError, DeadlineExceededError))
+
+
+def is_fatal(error: Exception) -> bool:
+    return is_provider_error(error) and expired()
+
+
+def mark_unrecovered(results: Dict[str, List[ChannelResult]], remaining: Dict[str, List[int]]) -> None:
+    for channel, indices in remaining.items():
+        for index in indices:
+            results[channel][index] = results[channel][index].model_copy(update={"retried": False})
+        metrics.inc("generate_channel_unrecovered_total", len(indices), channel=channel)
+
+
+def failed_channels(results: Dict[str, List[Any]]) -> Dict[str, List[int]]:
+    failed: Dict[str, List[int]] = {}
+    for channel, variants in results.items():
+        indices = [
+            i for i, v in enumerate(variants)
+            if (v.get("retried") if isinstance(v, dict) else v.retried) is False
+        ]
+        if indices:
+            failed[channel] = indices
+    return failed
+
+
 async def generate_content(
     request: GenerateRequest,
     db: AsyncSession
@@ -312,37 +482,119 @@ async def generate_content(
     
     brand_voice = await get_brand_voice(db)
     prompt = build_prompt(request, brand_voice)
+    schema = channels_schema(request.channels, request.num_variants)
+    failed: Dict[str, List[int]] = {}
+    error: Optional[Exception] = None
     
     try:
-        if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-            response_text = await generate_with_yandex(prompt)
-        elif settings.OPENAI_API_KEY:
-            response_text = await generate_with_openai(prompt)
-        else:
+        max_tokens = generation_max_tokens(request.channels, request.num_variants, is_short_format(request))
+        response_text = await call_llm(prompt, schema, max_tokens)
+        if response_text is None:
             return generate_mock_response(request)
-        
-        results = parse_llm_response(response_text, request.channels, request.num_variants)
-        
-        for channel, variants in results.items():
-            for i, variant in enumerate(variants):
-                if variant.image_prompt:
-                    try:
-                        from app.services.media import generate_image
-                        image_response = await generate_image(variant.image_prompt, channel, db)
-                        results[channel][i] = ChannelResult(
-                            headline=variant.headline,
-                            body=variant.body,
-                            cta=variant.cta,
-                            hashtags=variant.hashtags,
-                            image_prompt=variant.image_prompt,
-                            image_url=image_response.image_url,
-                            score=variant.score,
-                            improvements=variant.improvements
-                        )
-                    except Exception as e:
-                        print(f"Image generation failed for {channel}: {e}")
-        
-        return results
+        results = parse_llm_response(response_text, request.channels, request.num_variants, failed)
     except Exception as e:
+        if is_fatal(e):
+            raise
         print(f"Error generating content: {e}")
-        return generate_mock_response(request)
+        error = e
+        results = _error_results(request, e)
+        for channel in request.channels:
+            _mark_failed(failed, channel, range(request.num_variants))
+    
+    if failed:
+        unrecovered = await retry_failed_channels(request, brand_voice, results, failed)
+        if error is not None and is_provider_error(error) and unrecovered == failed:
+            raise error
+        mark_unrecovered(results, unrecovered)
+    
+    if request.num_variants > 1:
+        results = await regenerate_duplicates(request, brand_voice, results)
+    
+    results = await enforce_constraints(results, strict=is_short_format(request))
+    return await attach_images(results, db)
+
+
+async def attach_images(
+    results: Dict[str, List[ChannelResult]],
+    db: AsyncSession
+) -> Dict[str, List[ChannelResult]]:
+    for channel, variants in results.items():
+        for i, variant in enumerate(variants):
+            if variant.image_prompt:
+                left = remaining_time()
+                if left is not None and left < IMAGE_MIN_SECONDS:
+                    metrics.inc("generate_images_skipped_total", channel=channel, reason="deadline")
+                    continue
+                try:
+                    from app.services.media import generate_image
+                    image_response = await generate_image(variant.image_prompt, channel, db)
+                    results[channel][i] = variant.model_copy(update={"image_url": image_response.image_url})
+                except Exception as e:
+                    print(f"Image generation failed for {channel}: {e}")
+    
+    return results
+
+
+class GenerationFailedError(Exception):
+    pass
+
+
+async def generate_channel_variants(
+    request: GenerateRequest,
+    channel: str,
+    count: int,
+    db: AsyncSession
+) -> List[ChannelResult]:
+    single_request = request.model_copy(update={"channels": [channel], "num_variants": count})
+    if settings.MOCK_MODE:
+        return generate_mock_response(single_request)[channel]
+    if not llm_available():
+        raise LLMProviderError("no LLM provider configured")
+    
+    brand_voice = await get_brand_voice(db)
+    prompt = build_channel_prompt(request, channel, count, brand_voice)
+    failed: Dict[str, List[int]] = {}
+    error: Optional[Exception] = None
+    
+    try:
+        response_text = await call_llm(
+            prompt,
+            channels_schema([channel], count),
+            max_tokens=generation_max_tokens([channel], count, is_short_format(request))
+        )
+        results = parse_llm_response(response_text or "", [channel], count, failed)
+    except Exception as e:
+        if is_fatal(e):
+            raise
+        print(f"Error regenerating {channel}: {e}")
+        error = e
+        results = {channel: failed_variants(channel, count, str(e))}
+        _mark_failed(failed, channel, range(count))
+    
+    if failed:
+        unrecovered = await retry_failed_channels(single_request, brand_voice, results, failed)
+        if unrecovered:
+            mark_unrecovered(results, unrecovered)
+            if error is not None and is_provider_error(error):
+                raise error
+            raise GenerationFailedError(f"{channel}: {len(unrecovered[channel])} of {count} variants failed after retries")
+    
+    results = await enforce_constraints(results, strict=is_short_format(request))
+    results = await attach_images(results, db)
+    return results[channel]
+
+
+async def patch_generation_variants(
+    db: AsyncSession,
+    generation_id: int,
+    path: List[str],
+    value: Any
+) -> None:
+    await db.execute(
+        update(Generation)
+        .where(Generation.id == generation_id)
+        .values(variants=cast(
+            func.jsonb_set(cast(Generation.variants, JSONB), cast(pg_array(path), ARRAY(Text)), cast(value, JSONB)),
+            JSON
+        ))
+    )
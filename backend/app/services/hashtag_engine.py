@@ -0,0 +1,250 @@
+import re
+import math
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.models.models import Generation, HashtagUsage
+from app.services.hashtag_index import hashtag_index
+from app.services.validator import normalize_hashtag
+
+
+WORD_RE = re.compile(r"[а-яёa-z0-9]+", re.IGNORECASE)
+PHRASE_SPLIT_RE = re.compile(r"[.,!?;:()\[\]«»\"—–\n]+")
+
+STOPWORDS = set("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее ей
+ему если есть еще же за здесь и из или им их к как ко когда кто ли либо между меня мне может мы на над надо
+наш не него нее нет ни них но ну о об однако он она они оно от очень по под при про с со так также такой там
+те тем то того тоже той только том ты у уже хотя чего чей чем что чтобы чье чья эта эти это этот я вы ваш
+ваша ваше ваши свой своя свои себя сейчас можно будет будут нас наши наша нашей который которая которые
+вся всю всё всем всеми всей всему сам сама само сами самый самая самое каждый каждая каждое каждую каждого
+любой любая любое любую мой моя моё мои твой твоя твоё твои наше нашу нашего нашим вашу вашего вашей вашим
+ваших своё свою своего своей своим своих эту этой этом этих этим этими этого этому тот та ту тех тому
+какой какая какое какие какую такая такое такие такую которую которого которых которым ещё её нам вам
+сегодня завтра вчера теперь
+""".split())
+
+SELLING_HASHTAGS = {
+    "#скидки": ("скидк", "дешевл", "выгодн"),
+    "#акция": ("акци",),
+    "#распродажа": ("распродаж", "sale"),
+    "#спецпредложение": ("предложен", "оффер"),
+    "#толькосегодня": ("сегодн", "срочн"),
+    "#успейкупить": ("успе", "огранич", "последн"),
+    "#подарок": ("подарк", "подар", "бонус"),
+    "#новинка": ("новинк", "нов", "коллекц"),
+    "#бесплатнаядоставка": ("бесплатн",),
+    "#доставка": ("доставк",),
+    "#хитпродаж": ("хит", "популярн", "бестселлер"),
+    "#купитьонлайн": ("онлайн", "интернет", "заказ", "куп"),
+    "#лучшаяцена": ("цен", "стоимост"),
+    "#промокод": ("промокод", "код")
+}
+
+PERFECTIVE_GERUND_RE = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+REFLEXIVE_RE = re.compile(r"(с[яь])$")
+ADJECTIVE_RE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+PARTICIPLE_RE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+VERB_RE = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+NOUN_RE = re.compile(r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$")
+RV_RE = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+DERIVATIONAL_RE = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+DER_RE = re.compile(r"ость?$")
+SUPERLATIVE_RE = re.compile(r"(ейше|ейш)$")
+
+
+def stem(word: str) -> str:
+    word = word.lower().replace("ё", "е")
+    match = RV_RE.match(word)
+    if not match:
+        return word
+    
+    prefix, rv = match.groups()
+    temp = PERFECTIVE_GERUND_RE.sub("", rv, 1)
+    if temp == rv:
+        rv = REFLEXIVE_RE.sub("", rv, 1)
+        temp = ADJECTIVE_RE.sub("", rv, 1)
+        if temp != rv:
+            rv = PARTICIPLE_RE.sub("", temp, 1)
+        else:
+            temp = VERB_RE.sub("", rv, 1)
+            rv = NOUN_RE.sub("", rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+    
+    rv = re.sub(r"и$", "", rv, 1)
+    if DERIVATIONAL_RE.match(rv):
+        rv = DER_RE.sub("", rv, 1)
+    temp = re.sub(r"ь$", "", rv, 1)
+    if temp == rv:
+        rv = SUPERLATIVE_RE.sub("", rv, 1)
+        rv = re.sub(r"нн$", "н", rv, 1)
+    else:
+        rv = temp
+    
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    return [w.lower().replace("ё", "е") for w in WORD_RE.findall(text or "")]
+
+
+def content_words(text: str) -> List[str]:
+    return [w for w in tokenize(text) if w not in STOPWORDS and len(w) > 2 and not w.isdigit()]
+
+
+def candidate_phrases(text: str) -> List[List[str]]:
+    phrases = []
+    for chunk in PHRASE_SPLIT_RE.split(text or ""):
+        current: List[str] = []
+        for word in tokenize(chunk):
+            if word in STOPWORDS or len(word) <= 2 or word.isdigit():
+                if current:
+                    phrases.append(current)
+                current = []
+            else:
+                current.append(word)
+        if current:
+            phrases.append(current)
+    return phrases
+
+
+class HashtagEngine:
+    def __init__(self):
+        self.doc_freq: Counter = Counter()
+        self.num_docs = 0
+        self.usage: Counter = Counter()
+    
+    def add_document(self, text: str) -> None:
+        stems = {stem(w) for w in content_words(text)}
+        if stems:
+            self.doc_freq.update(stems)
+            self.num_docs += 1
+    
+    def add_hashtags(self, tags: Iterable[str]) -> None:
+        for tag in tags or []:
+            if isinstance(tag, str) and tag.startswith("#") and len(tag) > 2:
+                self.usage[tag.lower()] += 1
+                hashtag_index.add(tag)
+    
+    def add_generation(self, description: str, variants: Dict[str, List[dict]]) -> None:
+        self.add_document(description)
+        for channel_variants in (variants or {}).values():
+            for variant in channel_variants or []:
+                if isinstance(variant, dict):
+                    self.add_document(variant.get("body") or "")
+                    self.add_hashtags(variant.get("hashtags") or [])
+    
+    def idf(self, word_stem: str) -> float:
+        return math.log((1 + self.num_docs) / (1 + self.doc_freq.get(word_stem, 0))) + 1.0
+    
+    def keywords(self, text: str, limit: int) -> List[str]:
+        words = content_words(text)
+        if not words:
+            return []
+        
+        tf = Counter(stem(w) for w in words)
+        surface: Dict[str, Counter] = {}
+        for word in words:
+            surface.setdefault(stem(word), Counter())[word] += 1
+        
+        word_scores = {s: (count / len(words)) * self.idf(s) for s, count in tf.items()}
+        
+        scored: Dict[str, float] = {}
+        tag_stems: Dict[str, List[str]] = {}
+        for phrase in candidate_phrases(text):
+            for size in (1, 2):
+                for i in range(len(phrase) - size + 1):
+                    part = phrase[i:i + size]
+                    stems = [stem(w) for w in part]
+                    tag = "#" + "".join(surface[s].most_common(1)[0][0] for s in stems)
+                    score = sum(word_scores.get(s, 0.0) for s in stems) / size
+                    score *= 1.0 + math.log1p(self.usage.get(tag, 0))
+                    scored[tag] = max(scored.get(tag, 0.0), score)
+                    tag_stems[tag] = stems
+        
+        ranked = sorted(scored.items(), key=lambda item: item[1], reverse=True)
+        result: List[str] = []
+        seen_stems = set()
+        for tag, _ in ranked:
+            stems = tag_stems[tag]
+            if seen_stems.intersection(stems) or len(tag) > 30:
+                continue
+            seen_stems.update(stems)
+            result.append(tag)
+            if len(result) >= limit:
+                break
+        return result
+    
+    def selling(self, text: str, limit: int) -> List[str]:
+        stems = {stem(w) for w in tokenize(text)}
+        
+        def rank(item):
+            tag, triggers = item
+            matched = any(s.startswith(t) for s in stems for t in triggers)
+            return (not matched, -self.usage.get(tag, 0))
+        
+        return [tag for tag, _ in sorted(SELLING_HASHTAGS.items(), key=rank)[:limit]]
+    
+    def suggest(self, text: str, channel: Optional[str], count: int) -> dict:
+        selling_count = count // 2
+        topical = self.keywords(text, count - selling_count)
+        selling = self.selling(text, count - len(topical))
+        return {
+            "hashtags": topical or ["#контент", "#маркетинг"],
+            "selling_hashtags": selling
+        }
+
+
+hashtag_engine = HashtagEngine()
+
+
+async def load_hashtag_history(db: AsyncSession, batch_size: int = 1000) -> None:
+    last_id = 0
+    while True:
+        rows = (await db.execute(
+            select(Generation.id, Generation.description, Generation.variants)
+            .where(Generation.id > last_id)
+            .order_by(Generation.id)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            break
+        for _, description, variants in rows:
+            hashtag_engine.add_generation(description, variants)
+        last_id = rows[-1][0]
+    
+    last_id = 0
+    while True:
+        rows = (await db.execute(
+            select(HashtagUsage.id, HashtagUsage.tag, HashtagUsage.count)
+            .where(HashtagUsage.id > last_id)
+            .order_by(HashtagUsage.id)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            break
+        for _, tag, count in rows:
+            hashtag_index.add(tag, count)
+        last_id = rows[-1][0]
+
+
+async def record_served_hashtags(db: AsyncSession, tags: Iterable[str]) -> None:
+    served = Counter(tag.lower() for tag in map(normalize_hashtag, tags or []) if tag and len(tag) > 2)
+    if not served:
+        return
+    for tag, count in served.items():
+        hashtag_index.add(tag, count)
+    
+    insert = pg_insert(HashtagUsage).values([{"tag": tag, "count": count} for tag, count in served.items()])
+    await db.execute(insert.on_conflict_do_update(
+        index_elements=[HashtagUsage.tag],
+        set_={"count": HashtagUsage.count + insert.excluded.count, "updated_at": datetime.utcnow()}
+    ))
+    await db.commit()
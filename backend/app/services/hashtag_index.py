@@ -0,0 +1,71 @@
+from typing import Dict, List
+from app.services.validator import normalize_hashtag
+
+
+TOP_K = 10
+
+
+def fold(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+class TrieNode:
+    __slots__ = ("children", "top")
+    
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.top: List[str] = []
+
+
+class HashtagIndex:
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self.root = TrieNode()
+        self.counts: Dict[str, int] = {}
+        self.display: Dict[str, str] = {}
+    
+    def __len__(self) -> int:
+        return len(self.counts)
+    
+    def _promote(self, node: TrieNode, key: str) -> None:
+        top = node.top
+        count = self.counts[key]
+        if key in top:
+            top.remove(key)
+        elif len(top) >= self.top_k and self.counts[top[-1]] >= count:
+            return
+        
+        position = len(top)
+        while position > 0 and self.counts[top[position - 1]] < count:
+            position -= 1
+        top.insert(position, key)
+        del top[self.top_k:]
+    
+    def add(self, tag: str, weight: int = 1) -> None:
+        normalized = normalize_hashtag(tag)
+        if not normalized:
+            return
+        
+        key = fold(normalized[1:])
+        self.counts[key] = self.counts.get(key, 0) + weight
+        self.display.setdefault(key, normalized)
+        
+        node = self.root
+        self._promote(node, key)
+        for char in key:
+            node = node.children.setdefault(char, TrieNode())
+            self._promote(node, key)
+    
+    def complete(self, prefix: str, limit: int = TOP_K) -> List[dict]:
+        node = self.root
+        for char in fold(prefix.strip().lstrip("#")):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return [
+            {"tag": self.display[key], "count": self.counts[key]}
+            for key in node.top[:limit]
+        ]
+
+
+hashtag_index = HashtagIndex()
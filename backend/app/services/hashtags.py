@@ -1,8 +1,9 @@
 import json
 from typing import List
-from openai import AsyncOpenAI
-import httpx
 from app.core.config import settings
+from app.services.hashtag_engine import hashtag_engine
+from app.services.llm import complete, llm_available
+from app.services.prompts import PromptLayout
 
 
 HASHTAG_PROMPT = """Сгенерируй продающие хештеги для следующего текста.
@@ -26,67 +27,13 @@ HASHTAG_PROMPT = """Сгенерируй продающие хештеги дл
 - Без пробелов внутри хештега"""
 
 
-async def generate_hashtags_openai(text: str, channel: str, count: int) -> dict:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
-    prompt = HASHTAG_PROMPT.format(text=text, channel=channel, count=count)
-    
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": "Ты — SMM-специалист, эксперт по хештегам для российских соцсетей."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7,
-        max_tokens=500
-    )
-    
-    content = response.choices[0].message.content or "{}"
-    return parse_hashtags_response(content)
+HASHTAG_SYSTEM_PROMPT = "Ты — SMM-специалист, эксперт по хештегам для российских соцсетей."
 
 
-async def generate_hashtags_yandex(text: str, channel: str, count: int) -> dict:
+async def generate_hashtags_llm(text: str, channel: str, count: int) -> dict:
     prompt = HASHTAG_PROMPT.format(text=text, channel=channel, count=count)
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.7,
-                    "maxTokens": 500
-                },
-                "messages": [
-                    {"role": "system", "text": "Ты — SMM-специалист, эксперт по хештегам для российских соцсетей."},
-                    {"role": "user", "text": prompt}
-                ]
-            },
-            timeout=30.0
-        )
-        content = response.json()["result"]["alternatives"][0]["message"]["text"]
-        return parse_hashtags_response(content)
-
-
-def generate_mock_hashtags(text: str, channel: str, count: int) -> dict:
-    words = text.lower().split()
-    keywords = [w for w in words if len(w) > 4][:count//2]
-    
-    hashtags = [f"#{w}" for w in keywords]
-    selling = ["#купитьсейчас", "#акция", "#скидки", "#хитпродаж", "#успей"]
-    
-    return {
-        "hashtags": hashtags[:count//2] or ["#контент", "#маркетинг"],
-        "selling_hashtags": selling[:count//2]
-    }
+    content = await complete("hashtags", PromptLayout(HASHTAG_SYSTEM_PROMPT, [], [prompt]))
+    return parse_hashtags_response(content or "{}")
 
 
 def parse_hashtags_response(content: str) -> dict:
@@ -107,17 +54,19 @@ def parse_hashtags_response(content: str) -> dict:
         return {"hashtags": [], "selling_hashtags": []}
 
 
-async def generate_hashtags(text: str, channel: str, count: int = 5) -> dict:
-    if settings.MOCK_MODE:
-        return generate_mock_hashtags(text, channel, count)
+async def generate_hashtags(text: str, channel: str, count: int = 5, creative: bool = False) -> dict:
+    if not creative or settings.MOCK_MODE:
+        return hashtag_engine.suggest(text, channel, count)
+    
+    if not llm_available():
+        return hashtag_engine.suggest(text, channel, count)
     
     try:
-        if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-            return await generate_hashtags_yandex(text, channel, count)
-        elif settings.OPENAI_API_KEY:
-            return await generate_hashtags_openai(text, channel, count)
-        else:
-            return generate_mock_hashtags(text, channel, count)
+        result = await generate_hashtags_llm(text, channel, count)
     except Exception as e:
         print(f"Error generating hashtags: {e}")
-        return generate_mock_hashtags(text, channel, count)
+        return hashtag_engine.suggest(text, channel, count)
+    
+    if not result["hashtags"] and not result["selling_hashtags"]:
+        return hashtag_engine.suggest(text, channel, count)
+    return result
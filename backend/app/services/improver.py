@@ -1,7 +1,13 @@
-import httpx
-from openai import AsyncOpenAI
+import json
+import asyncio
+from typing import AsyncIterator, List, Optional, Tuple
 from app.core.config import settings
-from app.schemas.schemas import ImproveAction
+from app.core.metrics import metrics
+from app.core.deadline import DeadlineExceededError
+from app.services.llm import complete, llm_available, stream_complete, strip_json_fences, LLMProviderError
+from app.services.prompts import PromptLayout
+from app.schemas.schemas import ImproveAction, ImproveQuality, GoalEnum
+from app.services.local_improve import add_emoji, shorten, improve_cta
 
 
 ACTION_PROMPTS = {
@@ -33,68 +39,39 @@ CHANNEL_CONSTRAINTS = {
 }
 
 
-async def improve_with_openai(prompt: str, text: str, channel: str) -> str:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
-    channel_constraint = CHANNEL_CONSTRAINTS.get(channel, "")
-    
-    full_prompt = f"""{prompt}
+BATCH_PROMPT = """{prompt}
 
-Ограничения канала: {channel_constraint}
+Ниже тексты ({count} шт.). Обработай каждый отдельно, соблюдая ограничения его канала.
+Верни JSON {{"texts": ["..."]}} — массив улучшенных текстов в том же порядке, длина массива: {count}.
 
-Исходный текст:
-{text}"""
-    
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": "Ты — профессиональный копирайтер. Улучшаешь маркетинговые тексты для российских каналов."},
-            {"role": "user", "content": full_prompt}
-        ],
-        temperature=0.7,
-        max_tokens=1000
-    )
-    
-    return response.choices[0].message.content or text
+{items}"""
 
+SYSTEM_PROMPT = "Ты — профессиональный копирайтер. Улучшаешь маркетинговые тексты для российских каналов."
 
-async def improve_with_yandex(prompt: str, text: str, channel: str) -> str:
+def build_improve_prompt(prompt: str, text: str, channel: str) -> str:
     channel_constraint = CHANNEL_CONSTRAINTS.get(channel, "")
     
-    full_prompt = f"""{prompt}
+    return f"""{prompt}
 
 Ограничения канала: {channel_constraint}
 
 Исходный текст:
 {text}"""
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.7,
-                    "maxTokens": 1000
-                },
-                "messages": [
-                    {"role": "system", "text": "Ты — профессиональный копирайтер. Улучшаешь маркетинговые тексты для российских каналов."},
-                    {"role": "user", "text": full_prompt}
-                ]
-            },
-            timeout=30.0
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data["result"]["alternatives"][0]["message"]["text"]
+
+
+def improve_layout(prompt: str, text: str, channel: str) -> PromptLayout:
+    return PromptLayout(SYSTEM_PROMPT, [], [build_improve_prompt(prompt, text, channel)])
+
+
+LOCAL_ACTIONS = {ImproveAction.SHORTEN, ImproveAction.EMOJI, ImproveAction.CTA}
+
+
+def local_improve(text: str, action: ImproveAction, channel: str, goal: GoalEnum = None) -> str:
+    if action == ImproveAction.SHORTEN:
+        return shorten(text, channel)
+    if action == ImproveAction.EMOJI:
+        return add_emoji(text, channel)
+    return improve_cta(text, channel, goal)
 
 
 def mock_improve(text: str, action: ImproveAction, target_tone: str = None) -> str:
@@ -125,27 +102,177 @@ def mock_improve(text: str, action: ImproveAction, target_tone: str = None) -> s
     return text
 
 
+def action_prompt(action: ImproveAction, target_tone: str = None) -> str:
+    prompt = ACTION_PROMPTS.get(action, ACTION_PROMPTS[ImproveAction.SHORTEN])
+    if action == ImproveAction.TONE:
+        prompt = prompt.format(target_tone=target_tone or "экспертный")
+    return prompt
+
+
+def use_local(action: ImproveAction, quality: ImproveQuality) -> bool:
+    return action in LOCAL_ACTIONS and (quality != ImproveQuality.LLM or settings.MOCK_MODE)
+
+
 async def improve_text(
     text: str,
     action: ImproveAction,
     channel: str,
-    target_tone: str = None
+    target_tone: str = None,
+    goal: GoalEnum = None,
+    quality: ImproveQuality = ImproveQuality.FAST
 ) -> str:
+    if use_local(action, quality):
+        metrics.inc("improve_total", action=action.value, path="local")
+        return local_improve(text, action, channel, goal)
+    
     if settings.MOCK_MODE:
         return mock_improve(text, action, target_tone)
     
-    prompt = ACTION_PROMPTS.get(action, ACTION_PROMPTS[ImproveAction.SHORTEN])
+    prompt = action_prompt(action, target_tone)
     
-    if action == ImproveAction.TONE and target_tone:
-        prompt = prompt.format(target_tone=target_tone)
+    if not llm_available():
+        return mock_improve(text, action, target_tone)
     
+    metrics.inc("improve_total", action=action.value, path="llm")
     try:
-        if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-            return await improve_with_yandex(prompt, text, channel)
-        elif settings.OPENAI_API_KEY:
-            return await improve_with_openai(prompt, text, channel)
-        else:
-            return mock_improve(text, action, target_tone)
+        return await complete(f"improve_{action.value}", improve_layout(prompt, text, channel)) or text
     except Exception as e:
         print(f"Error improving text: {e}")
-        return mock_improve(text, action, target_tone)
+        if action not in LOCAL_ACTIONS:
+            raise
+        metrics.inc("improve_total", action=action.value, path="local_fallback")
+        return local_improve(text, action, channel, goal)
+
+
+async def stream_improve(
+    text: str,
+    action: ImproveAction,
+    channel: str,
+    target_tone: str = None,
+    goal: GoalEnum = None,
+    quality: ImproveQuality = ImproveQuality.FAST
+) -> AsyncIterator[str]:
+    if use_local(action, quality) or settings.MOCK_MODE:
+        yield await improve_text(text, action, channel, target_tone, goal, quality)
+        return
+    
+    if not llm_available():
+        yield mock_improve(text, action, target_tone)
+        return
+    
+    prompt = action_prompt(action, target_tone)
+    
+    metrics.inc("improve_total", action=action.value, path="llm_stream")
+    async for delta in stream_complete(f"improve_{action.value}", improve_layout(prompt, text, channel)):
+        yield delta
+
+
+def batch_schema(count: int) -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "texts": {"type": "array", "items": {"type": "string"}, "minItems": count, "maxItems": count}
+        },
+        "required": ["texts"]
+    }
+
+
+def build_batch_prompt(prompt: str, items: List[Tuple[str, str]]) -> str:
+    blocks = [
+        f"### Текст {i + 1} (канал {channel}. {CHANNEL_CONSTRAINTS.get(channel, '')})\n{text}"
+        for i, (text, channel) in enumerate(items)
+    ]
+    return BATCH_PROMPT.format(prompt=prompt, count=len(items), items="\n\n".join(blocks))
+
+
+def pack_items(items: List[Tuple[str, str]]) -> List[List[int]]:
+    packs = []
+    current: List[int] = []
+    size = 0
+    for index, (text, _) in enumerate(items):
+        full = size + len(text) > settings.IMPROVE_BATCH_MAX_CHARS
+        if current and (full or len(current) >= settings.IMPROVE_BATCH_MAX_ITEMS):
+            packs.append(current)
+            current = []
+            size = 0
+        current.append(index)
+        size += len(text)
+    if current:
+        packs.append(current)
+    return packs
+
+
+def parse_batch_response(content: str, count: int) -> Optional[List[str]]:
+    try:
+        data = json.loads(strip_json_fences(content))
+    except (json.JSONDecodeError, TypeError):
+        return None
+    
+    texts = data.get("texts") if isinstance(data, dict) else data
+    if not isinstance(texts, list) or len(texts) != count:
+        return None
+    if not all(isinstance(text, str) and text.strip() for text in texts):
+        return None
+    return [text.strip() for text in texts]
+
+
+async def improve_pack(
+    items: List[Tuple[str, str]],
+    action: ImproveAction,
+    target_tone: str = None,
+    goal: GoalEnum = None
+) -> List[str]:
+    full_prompt = build_batch_prompt(action_prompt(action, target_tone), items)
+    schema = batch_schema(len(items))
+    max_tokens = min(4000, sum(len(text) for text, _ in items) // 2 + 200 * len(items))
+    
+    try:
+        content = await complete("improve_batch", PromptLayout(SYSTEM_PROMPT, [], [full_prompt]), schema, max_tokens)
+        texts = parse_batch_response(content, len(items))
+    except (LLMProviderError, DeadlineExceededError):
+        if action not in LOCAL_ACTIONS:
+            raise
+        metrics.inc("improve_total", value=len(items), action=action.value, path="local_fallback")
+        return [local_improve(text, action, channel, goal) for text, channel in items]
+    except Exception as e:
+        print(f"Error improving batch: {e}")
+        texts = None
+    
+    if texts is not None:
+        return texts
+    
+    metrics.inc("improve_batch_fallback_total", action=action.value)
+    return list(await asyncio.gather(*[
+        improve_text(text, action, channel, target_tone, goal, ImproveQuality.LLM)
+        for text, channel in items
+    ]))
+
+
+async def improve_batch(
+    items: List[Tuple[str, str]],
+    action: ImproveAction,
+    target_tone: str = None,
+    goal: GoalEnum = None,
+    quality: ImproveQuality = ImproveQuality.FAST
+) -> List[str]:
+    if use_local(action, quality):
+        metrics.inc("improve_total", value=len(items), action=action.value, path="local")
+        return [local_improve(text, action, channel, goal) for text, channel in items]
+    
+    if settings.MOCK_MODE or not llm_available():
+        return [mock_improve(text, action, target_tone) for text, _ in items]
+    
+    packs = pack_items(items)
+    semaphore = asyncio.Semaphore(settings.IMPROVE_BATCH_CONCURRENCY)
+    metrics.inc("improve_total", value=len(items), action=action.value, path="llm")
+    metrics.inc("improve_batch_calls_total", value=len(packs), action=action.value)
+    
+    async def run(pack: List[int]) -> List[str]:
+        async with semaphore:
+            return await improve_pack([items[i] for i in pack], action, target_tone, goal)
+    
+    results: List[Optional[str]] = [None] * len(items)
+    for pack, texts in zip(packs, await asyncio.gather(*[run(pack) for pack in packs])):
+        for index, text in zip(pack, texts):
+            results[index] = text
+    return results
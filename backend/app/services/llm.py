@@ -0,0 +1,591 @@
+import json
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from openai import AsyncOpenAI, BadRequestError
+import httpx
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.schemas.schemas import ChannelResult, AudienceAnalysisResponse
+from app.services.prompts import PromptLayout
+from app.services.retry import retrying
+from app.core.deadline import check as check_deadline, clamp as clamp_deadline
+from app.core.database import release_connection
+from app.services.breaker import ProviderGuard, guarded, provider_guard
+from app.services.routing import routes, default_provider, observe_route, hedge_budget, hedge_delay
+
+
+STRUCTURED_MODES = {"json_schema", "tools"}
+
+SERVER_FIELDS = ["image_url", "retried", "issues", "similarity"]
+
+
+def structured_output_enabled() -> bool:
+    return settings.STRUCTURED_OUTPUT in STRUCTURED_MODES
+
+
+def openai_provider_name() -> str:
+    return settings.LLM_PROVIDER if settings.LLM_PROVIDER != "yandex" else "openai"
+
+
+def strip_json_fences(content: str) -> str:
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+
+def _inline_refs(schema: Any, defs: Dict[str, Any]) -> Any:
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return _inline_refs(defs[schema["$ref"].split("/")[-1]], defs)
+        return {k: _inline_refs(v, defs) for k, v in schema.items() if k not in ("$defs", "title", "default")}
+    if isinstance(schema, list):
+        return [_inline_refs(item, defs) for item in schema]
+    return schema
+
+
+def model_schema(model, exclude: Optional[List[str]] = None) -> Dict[str, Any]:
+    raw = model.model_json_schema()
+    schema = _inline_refs(raw, raw.get("$defs", {}))
+    for field in exclude or []:
+        schema.get("properties", {}).pop(field, None)
+    return schema
+
+
+def _channel_result_schema() -> Dict[str, Any]:
+    return model_schema(ChannelResult, exclude=SERVER_FIELDS)
+
+
+def channels_schema(channels: List[str], num_variants: int) -> Dict[str, Any]:
+    variants = {
+        "type": "array",
+        "items": _channel_result_schema(),
+        "minItems": num_variants,
+        "maxItems": num_variants
+    }
+    return {
+        "type": "object",
+        "properties": {channel: variants for channel in channels},
+        "required": list(channels)
+    }
+
+
+def content_plan_schema(days: int) -> Dict[str, Any]:
+    item = _channel_result_schema()
+    item["properties"] = {
+        "day": {"type": "integer"},
+        "topic": {"type": "string"},
+        "channel": {"type": "string"},
+        **item["properties"]
+    }
+    item["required"] = ["day", "topic", "channel", *item.get("required", [])]
+    return {
+        "type": "object",
+        "properties": {
+            "plan": {"type": "array", "items": item, "minItems": days, "maxItems": days}
+        },
+        "required": ["plan"]
+    }
+
+
+def audience_schema() -> Dict[str, Any]:
+    return model_schema(AudienceAnalysisResponse)
+
+
+def openai_structured_kwargs(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    if settings.STRUCTURED_OUTPUT == "json_schema":
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": name, "schema": schema}
+        }}
+    if settings.STRUCTURED_OUTPUT == "tools":
+        return {
+            "tools": [{
+                "type": "function",
+                "function": {"name": name, "description": "Вернуть результат", "parameters": schema}
+            }],
+            "tool_choice": {"type": "function", "function": {"name": name}}
+        }
+    return {}
+
+
+def yandex_structured_fields(schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if schema and structured_output_enabled():
+        return {"jsonSchema": {"schema": schema}}
+    return {}
+
+
+def openai_message_text(response) -> str:
+    message = response.choices[0].message
+    if message.tool_calls:
+        return message.tool_calls[0].function.arguments or ""
+    return message.content or ""
+
+
+async def create_openai_completion(
+    client: AsyncOpenAI,
+    task: str,
+    schema: Optional[Dict[str, Any]],
+    **kwargs
+):
+    extra = openai_structured_kwargs(task, schema) if schema else {}
+    if extra:
+        try:
+            return await client.chat.completions.create(**kwargs, **extra)
+        except BadRequestError as e:
+            print(f"Structured output rejected for {task}, falling back: {e}")
+            metrics.inc("llm_structured_fallback_total", provider=openai_provider_name(), task=task)
+    return await client.chat.completions.create(**kwargs)
+
+
+YANDEX_COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+
+_openai_client: Optional[AsyncOpenAI] = None
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+class LLMUnavailableError(Exception):
+    pass
+
+
+class LLMProviderError(Exception):
+    pass
+
+
+def openai_client() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=getattr(settings, 'LLM_BASE_URL', None),
+            max_retries=0
+        )
+    return _openai_client
+
+
+def http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient()
+    return _http_client
+
+
+def llm_available() -> bool:
+    return default_provider() is not None
+
+
+def provider_label(provider: str) -> str:
+    return "yandex" if provider == "yandex" else openai_provider_name()
+
+
+def yandex_headers() -> Dict[str, str]:
+    return {
+        "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+def yandex_text(data: Dict[str, Any]) -> str:
+    try:
+        return data["result"]["alternatives"][0]["message"]["text"]
+    except (KeyError, IndexError, TypeError):
+        raise ValueError(f"Unexpected Yandex response: {str(data)[:200]}")
+
+
+def yandex_request(
+    model: str,
+    prompt: PromptLayout,
+    temperature: float,
+    max_tokens: int,
+    schema: Optional[Dict[str, Any]] = None,
+    stream: bool = False
+) -> Dict[str, Any]:
+    return {
+        "modelUri": f"gpt://{settings.YANDEX_API_KEY}/{model}",
+        "completionOptions": {
+            "stream": stream,
+            "temperature": temperature,
+            "maxTokens": max_tokens
+        },
+        "messages": prompt.yandex_messages(),
+        **yandex_structured_fields(schema)
+    }
+
+
+async def complete_openai(
+    task: str,
+    model: str,
+    prompt: PromptLayout,
+    schema: Optional[Dict[str, Any]],
+    max_tokens: int,
+    temperature: float,
+    timeout: float
+) -> str:
+    from app.services.budget import record_openai_usage
+    
+    response = await create_openai_completion(
+        openai_client(),
+        task,
+        schema,
+        model=model,
+        messages=prompt.openai_messages(),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=timeout
+    )
+    record_openai_usage(task, openai_provider_name(), prompt.text, max_tokens, response, prompt.prefix_hash)
+    return openai_message_text(response)
+
+
+async def complete_yandex(
+    task: str,
+    model: str,
+    prompt: PromptLayout,
+    schema: Optional[Dict[str, Any]],
+    max_tokens: int,
+    temperature: float,
+    timeout: float
+) -> str:
+    from app.services.budget import record_yandex_usage
+    
+    response = await http_client().post(
+        YANDEX_COMPLETION_URL,
+        headers=yandex_headers(),
+        json=yandex_request(model, prompt, temperature, max_tokens, schema),
+        timeout=timeout
+    )
+    response.raise_for_status()
+    data = response.json()
+    record_yandex_usage(task, prompt.text, max_tokens, data, prompt.prefix_hash)
+    return yandex_text(data)
+
+
+def _route_max_tokens(route, max_tokens: Optional[int]) -> int:
+    return max_tokens or route.max_tokens or settings.LLM_MAX_OUTPUT_TOKENS
+
+
+def attempt_timeout(remaining: float, last: bool) -> float:
+    return remaining if last else remaining * settings.LLM_FAILOVER_SHARE
+
+
+async def hedge(
+    task: str,
+    route,
+    primary: Tuple[str, str],
+    backup: Optional[Tuple[str, str]],
+    run: Callable[[str, str, float], Awaitable[Any]],
+    timeout: float,
+    discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    delay_metric: str = "llm_route_latency_seconds"
+) -> Any:
+    delay = hedge_delay(task, *primary, delay_metric) if route.hedge and backup else None
+    racers = {asyncio.ensure_future(run(*primary, timeout)): "primary"}
+    try:
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(racers, timeout=delay)
+            if not done and hedge_budget.try_spend():
+                metrics.inc("llm_hedge_total", task=task, provider=backup[0])
+                racers[asyncio.ensure_future(run(*backup, timeout - delay))] = "hedge"
+        
+        pending = set(racers)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if winners:
+                if len(racers) > 1:
+                    metrics.inc("llm_hedge_wins_total", task=task, winner=racers[winners[0]])
+                for extra in winners[1:]:
+                    if discard:
+                        await discard(extra.result())
+                return winners[0].result()
+            error = next(iter(done)).exception()
+        raise error
+    finally:
+        for future in racers:
+            future.cancel()
+
+
+async def attempt(
+    task: str,
+    provider: str,
+    model: str,
+    prompt: PromptLayout,
+    schema: Optional[Dict[str, Any]],
+    max_tokens: int,
+    temperature: float,
+    timeout: float
+) -> str:
+    call = complete_yandex if provider == "yandex" else complete_openai
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    
+    async def once(remaining: float) -> str:
+        nonlocal started
+        deadline = loop.time() + remaining
+        async with guarded(provider, remaining):
+            started = loop.time()
+            left = deadline - started
+            return await asyncio.wait_for(
+                call(task, model, prompt, schema, max_tokens, temperature, left),
+                timeout=left
+            )
+    
+    def failed(e: Exception) -> None:
+        observe_route(task, provider, model, loop.time() - started, error=e)
+        print(f"LLM {provider} failed for {task}: {e!r}")
+    
+    content = await retrying(f"{task}:{provider}", once, started + timeout, on_error=failed)
+    observe_route(task, provider, model, loop.time() - started)
+    
+    if schema is not None:
+        record_parse(provider_label(provider), task, content)
+    return content or ""
+
+
+def next_candidate(
+    candidates: List[Tuple[str, str]],
+    index: int,
+    tried: set
+) -> Optional[Tuple[str, str]]:
+    for candidate in candidates[index + 1:]:
+        if candidate not in tried:
+            return candidate
+    return candidates[index]
+
+
+async def complete(
+    task: str,
+    prompt: PromptLayout,
+    schema: Optional[Dict[str, Any]] = None,
+    max_tokens: Optional[int] = None
+) -> str:
+    route, candidates = routes.candidates(task)
+    if not candidates:
+        raise LLMUnavailableError(f"No LLM provider configured for {task}")
+    
+    max_tokens = _route_max_tokens(route, max_tokens)
+    check_deadline(task)
+    await release_connection()
+    hedge_budget.deposit()
+    loop = asyncio.get_running_loop()
+    deadline = clamp_deadline(loop.time() + route.timeout)
+    tried = set()
+    errors = []
+    
+    async def run(provider: str, model: str, timeout: float) -> str:
+        tried.add((provider, model))
+        return await attempt(task, provider, model, prompt, schema, max_tokens, route.temperature, timeout)
+    
+    for index, candidate in enumerate(candidates):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        if candidate in tried:
+            continue
+        if index:
+            metrics.inc("llm_failover_total", task=task, provider=candidate[0])
+        
+        timeout = attempt_timeout(remaining, index == len(candidates) - 1)
+        try:
+            return await hedge(task, route, candidate, next_candidate(candidates, index, tried), run, timeout)
+        except Exception as e:
+            errors.append(f"{candidate[0]}: {e!r}")
+    
+    check_deadline(task)
+    raise LLMProviderError(f"All LLM providers failed for {task}: {'; '.join(errors) or 'deadline exceeded'}")
+
+
+async def stream_openai(
+    model: str,
+    prompt: PromptLayout,
+    max_tokens: int,
+    temperature: float,
+    timeout: float
+) -> AsyncIterator[str]:
+    stream = await openai_client().chat.completions.create(
+        model=model,
+        messages=prompt.openai_messages(),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def stream_yandex(
+    model: str,
+    prompt: PromptLayout,
+    max_tokens: int,
+    temperature: float,
+    timeout: float
+) -> AsyncIterator[str]:
+    async with http_client().stream(
+        "POST",
+        YANDEX_COMPLETION_URL,
+        headers=yandex_headers(),
+        json=yandex_request(model, prompt, temperature, max_tokens, stream=True),
+        timeout=timeout
+    ) as response:
+        response.raise_for_status()
+        sent = 0
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            current = yandex_text(json.loads(line))
+            if len(current) > sent:
+                yield current[sent:]
+                sent = len(current)
+
+
+async def guarded_stream(
+    guard: ProviderGuard,
+    timeout: float,
+    open_iterator: Callable[[float], AsyncIterator[str]]
+) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    await guard.acquire(timeout)
+    iterator = open_iterator(deadline - loop.time())
+    error = None
+    try:
+        async for delta in iterator:
+            yield delta
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        await iterator.aclose()
+        guard.release(error)
+
+
+async def open_stream(
+    task: str,
+    provider: str,
+    model: str,
+    prompt: PromptLayout,
+    max_tokens: int,
+    temperature: float,
+    timeout: float
+) -> Tuple[str, str, float, AsyncIterator[str], str]:
+    stream = stream_yandex if provider == "yandex" else stream_openai
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    
+    async def once(remaining: float) -> Tuple[AsyncIterator[str], str]:
+        nonlocal started
+        started = loop.time()
+        guard = provider_guard(provider)
+        iterator = guarded_stream(
+            guard,
+            remaining,
+            lambda left: stream(model, prompt, max_tokens, temperature, left)
+        )
+        try:
+            return iterator, await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+        except StopAsyncIteration:
+            return iterator, ""
+        except BaseException as e:
+            await iterator.aclose()
+            if isinstance(e, asyncio.TimeoutError):
+                guard.record(e)
+            raise
+    
+    def failed(e: Exception) -> None:
+        observe_route(task, provider, model, loop.time() - started, error=e)
+        print(f"LLM {provider} failed for {task}: {e!r}")
+    
+    iterator, first = await retrying(f"{task}:{provider}", once, started + timeout, on_error=failed)
+    metrics.observe("llm_route_first_token_seconds", loop.time() - started, task=task, provider=provider, model=model)
+    return provider, model, started, iterator, first
+
+
+async def close_stream(opened: Tuple[str, str, float, AsyncIterator[str], str]) -> None:
+    await opened[3].aclose()
+
+
+async def stream_complete(
+    task: str,
+    prompt: PromptLayout,
+    max_tokens: Optional[int] = None
+) -> AsyncIterator[str]:
+    route, candidates = routes.candidates(task)
+    if not candidates:
+        raise LLMUnavailableError(f"No LLM provider configured for {task}")
+    
+    max_tokens = _route_max_tokens(route, max_tokens)
+    check_deadline(task)
+    await release_connection()
+    hedge_budget.deposit()
+    loop = asyncio.get_running_loop()
+    deadline = clamp_deadline(loop.time() + route.timeout)
+    tried = set()
+    errors = []
+    
+    async def run(provider: str, model: str, timeout: float):
+        tried.add((provider, model))
+        return await open_stream(task, provider, model, prompt, max_tokens, route.temperature, timeout)
+    
+    for index, candidate in enumerate(candidates):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        if candidate in tried:
+            continue
+        if index:
+            metrics.inc("llm_failover_total", task=task, provider=candidate[0])
+        
+        timeout = attempt_timeout(remaining, index == len(candidates) - 1)
+        try:
+            provider, model, started, iterator, first = await hedge(
+                task, route, candidate, next_candidate(candidates, index, tried), run, timeout,
+                close_stream, "llm_route_first_token_seconds"
+            )
+        except Exception as e:
+            errors.append(f"{candidate[0]}: {e!r}")
+            continue
+        
+        try:
+            if first:
+                yield first
+            async for delta in iterator:
+                yield delta
+        except Exception as e:
+            observe_route(task, provider, model, loop.time() - started, error=e)
+            raise LLMProviderError(f"LLM {provider} failed mid-stream for {task}: {e!r}") from e
+        finally:
+            await iterator.aclose()
+        observe_route(task, provider, model, loop.time() - started)
+        return
+    
+    check_deadline(task)
+    raise LLMProviderError(f"All LLM providers failed for {task}: {'; '.join(errors) or 'deadline exceeded'}")
+
+
+def record_parse(provider: str, task: str, content: str) -> bool:
+    mode = settings.STRUCTURED_OUTPUT if structured_output_enabled() else "off"
+    metrics.inc("llm_parse_total", provider=provider, task=task, mode=mode)
+    try:
+        json.loads(strip_json_fences(content))
+        return True
+    except (json.JSONDecodeError, TypeError):
+        metrics.inc("llm_parse_failures_total", provider=provider, task=task, mode=mode)
+        return False
+
+
+def parse_failure_rates() -> Dict[str, float]:
+    rates = {}
+    for (name, labels), total in list(metrics.counters.items()):
+        if name != "llm_parse_total" or not total:
+            continue
+        failures = metrics.counter("llm_parse_failures_total", **dict(labels))
+        label_text = ",".join(f"{k}={v}" for k, v in labels)
+        rates[label_text] = round(failures / total, 4)
+    return rates
@@ -0,0 +1,197 @@
+import re
+from collections import Counter
+from typing import List, Optional
+from app.schemas.schemas import GoalEnum
+from app.services.validator import CHANNEL_LIMITS, EMOJI_LIMITS, count_emoji, hard_truncate
+from app.services.hashtag_engine import content_words, stem, tokenize
+
+
+SENTENCE_RE = re.compile(r"[^.!?…\n]+(?:[.!?…]+|\n|$)")
+TRAILING_PUNCT_RE = re.compile(r"([.!?…]*)\s*$")
+
+DEFAULT_EMOJI_BUDGET = 3
+SHORTEN_RATIO = 0.6
+MIN_LEAD_CHARS = 30
+
+EMOJI_KEYWORDS = [
+    (("скидк", "распродаж", "акци", "выгод", "дешевл", "sale"), "🔥"),
+    (("подар", "бонус", "бесплатн"), "🎁"),
+    (("нов", "запуск", "старт", "премьер"), "🚀"),
+    (("доставк", "курьер", "привез"), "🚚"),
+    (("врем", "успе", "сегодн", "срок", "огранич", "последн"), "⏰"),
+    (("цен", "руб", "стоимост", "оплат", "деньг"), "💰"),
+    (("качеств", "лучш", "гарант", "надежн", "проверен"), "✅"),
+    (("иде", "совет", "лайфхак", "узна", "секрет"), "💡"),
+    (("праздник", "поздравл", "юбил", "рожден"), "🎉"),
+    (("кофе", "завтрак", "еда", "вкус", "кухн"), "☕"),
+    (("спорт", "трениров", "бег", "фитнес"), "💪"),
+    (("любим", "забот", "сердц"), "❤️"),
+    (("звон", "телефон", "позвон"), "📞"),
+    (("ссылк", "сайт", "переход", "жми"), "👉"),
+    (("пишит", "сообщен", "чат", "директ"), "💬")
+]
+DEFAULT_EMOJI = "✨"
+
+CTA_STEMS = (
+    "купи", "закаж", "заказ", "оформ", "переход", "жми", "нажм", "подпис", "узна", "регистр",
+    "запиш", "звон", "пиши", "успе", "получ", "попроб", "присоедин", "скача", "приход"
+)
+
+CTA_TEMPLATES = {
+    GoalEnum.SALES: [
+        "Закажите сейчас — предложение ограничено!",
+        "Оформите заказ сегодня и получите выгоду.",
+        "Успейте купить по специальной цене!"
+    ],
+    GoalEnum.AWARENESS: [
+        "Узнайте больше на нашем сайте.",
+        "Подпишитесь, чтобы быть в курсе.",
+        "Расскажите друзьям — им тоже будет интересно."
+    ],
+    GoalEnum.ENGAGEMENT: [
+        "Напишите в комментариях, что думаете!",
+        "Поделитесь своим опытом в комментариях.",
+        "Поставьте лайк, если было полезно!"
+    ],
+    GoalEnum.ANNOUNCEMENT: [
+        "Сохраните дату и приходите!",
+        "Регистрируйтесь заранее — мест немного.",
+        "Следите за новостями, чтобы ничего не пропустить."
+    ]
+}
+
+CHANNEL_CTA_TEMPLATES = {
+    "Директ": ["Закажите сейчас!", "Узнайте цены!", "Успейте купить!"],
+    "Email": [
+        "Перейдите по ссылке, чтобы оформить заказ.",
+        "Ответьте на это письмо — поможем с выбором.",
+        "Нажмите на кнопку ниже и получите предложение."
+    ]
+}
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_RE.findall(text or "") if s.strip()]
+
+
+def body_limit(channel: str) -> Optional[int]:
+    return CHANNEL_LIMITS.get(channel, {}).get("body")
+
+
+def is_cta(sentence: str) -> bool:
+    return any(word.startswith(CTA_STEMS) for word in tokenize(sentence))
+
+
+def pick_emoji(sentence: str, used: set) -> Optional[str]:
+    words = content_words(sentence)
+    for triggers, emoji in EMOJI_KEYWORDS:
+        if emoji not in used and any(word.startswith(triggers) for word in words):
+            return emoji
+    return None
+
+
+def add_emoji(text: str, channel: str) -> str:
+    limit = EMOJI_LIMITS.get(channel, DEFAULT_EMOJI_BUDGET)
+    budget = min(limit, DEFAULT_EMOJI_BUDGET) - count_emoji(text)
+    if budget <= 0:
+        return text
+    
+    sentences = split_sentences(text)
+    used = set()
+    placed = {}
+    for index, sentence in enumerate(sentences):
+        emoji = pick_emoji(sentence, used)
+        if emoji:
+            used.add(emoji)
+            placed[index] = emoji
+            if len(placed) >= budget:
+                break
+    if not placed and sentences:
+        placed[0] = DEFAULT_EMOJI
+    
+    result = text
+    offset = 0
+    for index, sentence in enumerate(sentences):
+        start = result.find(sentence, offset)
+        if start < 0:
+            continue
+        end = start + len(sentence)
+        if index in placed:
+            emoji = placed[index]
+            if index == 0 and len(sentences) > 1:
+                result = f"{result[:start]}{emoji} {result[start:]}"
+                end += len(emoji) + 1
+            else:
+                punct = TRAILING_PUNCT_RE.search(sentence).group(1)
+                core_end = end - len(punct)
+                result = f"{result[:core_end]} {emoji}{result[core_end:]}"
+                end += len(emoji) + 1
+        offset = end
+    return result
+
+
+def shorten(text: str, channel: str) -> str:
+    sentences = split_sentences(text)
+    limit = body_limit(channel)
+    if not limit or len(text) <= limit:
+        limit = max(1, int(len(text) * SHORTEN_RATIO))
+    if len(sentences) <= 1:
+        return hard_truncate(text, limit)
+    
+    frequencies = Counter(stem(word) for word in content_words(text))
+    
+    def score(index: int) -> float:
+        stems = [stem(word) for word in content_words(sentences[index])]
+        if not stems:
+            return 0.0
+        value = sum(frequencies[s] for s in stems) / len(stems)
+        if index == 0:
+            value *= 1.5
+        return value
+    
+    keep = {0}
+    cta_index = next((i for i in range(len(sentences) - 1, 0, -1) if is_cta(sentences[i])), None)
+    if cta_index is not None:
+        keep.add(cta_index)
+    
+    def length(indices) -> int:
+        return sum(len(sentences[i]) for i in indices) + len(indices) - 1
+    
+    if cta_index is not None and length(keep) > limit:
+        room = limit - len(sentences[cta_index]) - 1
+        if room >= MIN_LEAD_CHARS:
+            return f"{hard_truncate(sentences[0], room)} {sentences[cta_index]}"
+        keep.discard(cta_index)
+    
+    for index in sorted(range(len(sentences)), key=score, reverse=True):
+        if index not in keep and length(keep | {index}) <= limit:
+            keep.add(index)
+    
+    result = " ".join(sentences[i] for i in sorted(keep))
+    return hard_truncate(result, limit)
+
+
+def cta_templates(channel: str, goal: Optional[GoalEnum]) -> List[str]:
+    if channel in CHANNEL_CTA_TEMPLATES:
+        return CHANNEL_CTA_TEMPLATES[channel]
+    return CTA_TEMPLATES.get(goal or GoalEnum.SALES, CTA_TEMPLATES[GoalEnum.SALES])
+
+
+def improve_cta(text: str, channel: str, goal: Optional[GoalEnum] = None) -> str:
+    templates = cta_templates(channel, goal)
+    sentences = split_sentences(text)
+    
+    current = sentences[-1] if sentences and is_cta(sentences[-1]) else None
+    body = sentences[:-1] if current else sentences
+    
+    template = templates[0]
+    if current in templates:
+        template = templates[(templates.index(current) + 1) % len(templates)]
+    
+    result = " ".join(body + [template])
+    limit = body_limit(channel)
+    if limit and len(result) > limit:
+        prefix = shorten(" ".join(body), channel) if body else ""
+        room = limit - len(template) - 1
+        result = f"{hard_truncate(prefix, room)} {template}" if room > 10 and prefix else template
+    return result
@@ -1,9 +1,17 @@
+import asyncio
 import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.core.config import settings
 from app.models.models import ImageSettings
 from app.schemas.schemas import ImageGenerateResponse
+from app.services.retry import retrying
+from app.core.deadline import DeadlineExceededError, check, clamp
+from app.core.database import release_connection
+from app.services.breaker import guarded
+
+
+IMAGE_TIMEOUT = 120.0
 
 
 async def get_image_settings(db: AsyncSession) -> ImageSettings:
@@ -27,29 +35,37 @@ async def generate_image_gemini(prompt: str, channel: str, api_key: str, model:
     enhanced_prompt = f"Generate a professional marketing image: {prompt}. Style: modern, high quality, for {channel} social media."
     
     async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": model,
-                "modalities": ["image", "text"],
-                "messages": [
-                    {"role": "user", "content": enhanced_prompt}
-                ]
-            },
-            timeout=120.0
-        )
+        async def post(remaining: float) -> httpx.Response:
+            async with guarded("image", remaining):
+                return await post_once(remaining)
         
-        if response.status_code == 402:
-            raise Exception("Insufficient credits. Add credits to your OpenRouter account.")
-        
-        if response.status_code != 200:
-            print(f"Image generation error: {response.status_code} - {response.text[:500]}")
-            raise Exception(f"Image generation failed: {response.status_code}")
+        async def post_once(remaining: float) -> httpx.Response:
+            response = await client.post(
+                "https://openrouter.ai/api/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json",
+                },
+                json={
+                    "model": model,
+                    "modalities": ["image", "text"],
+                    "messages": [
+                        {"role": "user", "content": enhanced_prompt}
+                    ]
+                },
+                timeout=remaining
+            )
+            
+            if response.status_code == 402:
+                raise Exception("Insufficient credits. Add credits to your OpenRouter account.")
+            
+            if response.status_code != 200:
+                print(f"Image generation error: {response.status_code} - {response.text[:500]}")
+            response.raise_for_status()
+            return response
         
+        deadline = clamp(asyncio.get_running_loop().time() + IMAGE_TIMEOUT)
+        response = await retrying("image", post, deadline)
         data = response.json()
         image_url = None
         
@@ -118,8 +134,13 @@ async def generate_image(prompt: str, channel: str, db: AsyncSession = None) ->
     if not api_key or not enabled:
         return generate_mock_image(prompt, channel)
     
+    check("image")
+    await release_connection()
     try:
         return await generate_image_gemini(prompt, channel, api_key, model)
+    except DeadlineExceededError:
+        raise
     except Exception as e:
         print(f"Image generation error: {e}")
+        check("image")
         return generate_mock_image(prompt, channel)
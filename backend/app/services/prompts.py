@@ -0,0 +1,38 @@
+import hashlib
+from typing import Dict, List
+
+
+class PromptLayout:
+    def __init__(self, system: str, static: List[str], variable: List[str]):
+        self.system = system
+        self.static = [block for block in static if block]
+        self.variable = [block for block in variable if block]
+    
+    @property
+    def system_text(self) -> str:
+        return "\n\n".join([self.system] + self.static)
+    
+    @property
+    def user_text(self) -> str:
+        return "\n\n".join(self.variable)
+    
+    @property
+    def text(self) -> str:
+        return f"{self.system_text}\n{self.user_text}"
+    
+    @property
+    def prefix_hash(self) -> str:
+        return hashlib.sha256(self.system_text.encode()).hexdigest()[:16]
+    
+    def openai_messages(self) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system_text},
+            {"role": "user", "content": self.user_text}
+        ]
+    
+    def yandex_messages(self) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "text": self.system_text},
+            {"role": "user", "text": self.user_text}
+        ]
+
@@ -0,0 +1,115 @@
+import asyncio
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional, TypeVar
+import httpx
+import openai
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.deadline import DeadlineExceededError
+
+
+T = TypeVar("T")
+
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524}
+
+
+def error_status(exc: Exception) -> Optional[int]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code
+    return None
+
+
+def error_reason(exc: Exception) -> str:
+    status = error_status(exc)
+    if status is not None:
+        return str(status)
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException, openai.APITimeoutError)):
+        return "timeout"
+    if isinstance(exc, (httpx.TransportError, openai.APIConnectionError)):
+        return "connection"
+    return type(exc).__name__
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return isinstance(exc, (
+        asyncio.TimeoutError,
+        httpx.TimeoutException,
+        httpx.TransportError,
+        openai.APITimeoutError,
+        openai.APIConnectionError
+    ))
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, exc: Exception) -> float:
+    cap = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** attempt)
+    delay = random.uniform(0, cap)
+    server_delay = retry_after(exc)
+    if server_delay is not None:
+        delay = max(delay, server_delay)
+    return delay
+
+
+async def retrying(
+    operation: str,
+    call: Callable[[float], Awaitable[T]],
+    deadline: float,
+    attempts: Optional[int] = None,
+    on_error: Optional[Callable[[Exception], None]] = None
+) -> T:
+    loop = asyncio.get_running_loop()
+    attempts = attempts or settings.LLM_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise DeadlineExceededError(f"{operation}: deadline exceeded")
+        try:
+            return await call(remaining)
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            reason = error_reason(e)
+            if not is_retryable(e) or attempt == attempts - 1:
+                raise
+            
+            delay = backoff_delay(attempt, e)
+            if loop.time() + delay >= deadline:
+                metrics.inc("llm_retry_gave_up_total", operation=operation, reason=reason)
+                raise
+            
+            metrics.inc("llm_retries_total", operation=operation, reason=reason)
+            print(f"Retrying {operation} in {delay:.2f}s after {reason}")
+            await asyncio.sleep(delay)
+    raise DeadlineExceededError(f"{operation}: no attempts left")
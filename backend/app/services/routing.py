@@ -0,0 +1,228 @@
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.breaker import circuit_open, provider_guard
+from app.schemas.schemas import LLMRoute, LLMRouteUpdate, LLMRouteStatus, LLMTier, LLMProviderHealth
+
+
+PROVIDERS = {"openai", "yandex"}
+
+YANDEX_MODELS = {
+    LLMTier.MAIN: "yandexgpt/latest",
+    LLMTier.FAST: "yandexgpt-lite/latest"
+}
+
+DEFAULT_ROUTES = {
+    "generate": LLMRoute(timeout=60, temperature=0.8, slo_p95=30, hedge=True),
+    "improve_shorten": LLMRoute(tier=LLMTier.FAST, timeout=45, max_tokens=1000, temperature=0.7, slo_p95=5),
+    "improve_emoji": LLMRoute(tier=LLMTier.FAST, timeout=45, max_tokens=1000, temperature=0.7, slo_p95=5),
+    "improve_cta": LLMRoute(tier=LLMTier.FAST, timeout=45, max_tokens=1000, temperature=0.7, slo_p95=5),
+    "improve_tone": LLMRoute(timeout=45, max_tokens=1000, temperature=0.7, slo_p95=10),
+    "improve_batch": LLMRoute(timeout=60, temperature=0.7, slo_p95=30),
+    "hashtags": LLMRoute(tier=LLMTier.FAST, timeout=15, max_tokens=500, temperature=0.7, slo_p95=3),
+    "constraint_fix": LLMRoute(tier=LLMTier.FAST, timeout=20, max_tokens=800, temperature=0.3, slo_p95=5),
+    "series": LLMRoute(timeout=90, temperature=0.8, slo_p95=40),
+    "content_plan": LLMRoute(timeout=90, temperature=0.7, slo_p95=60),
+    "audience": LLMRoute(tier=LLMTier.FAST, timeout=30, max_tokens=1000, temperature=0.3, slo_p95=10),
+    "brand_analysis": LLMRoute(timeout=60, max_tokens=2000, temperature=0.3, slo_p95=30)
+}
+
+
+LATENCY_ALPHA = 0.2
+ERROR_ALPHA = 0.3
+ERROR_HALF_LIFE = 60.0
+ERROR_PENALTY = 4.0
+UNHEALTHY_ERROR_RATE = 0.5
+PREFERRED_WEIGHT = 0.8
+HEDGE_BURST = 10.0
+
+
+def provider_available(provider: Optional[str]) -> bool:
+    if provider == "yandex":
+        return bool(settings.YANDEX_API_KEY)
+    if provider == "openai":
+        return bool(settings.OPENAI_API_KEY)
+    return False
+
+
+def default_provider() -> Optional[str]:
+    if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
+        return "yandex"
+    if settings.OPENAI_API_KEY:
+        return "openai"
+    return None
+
+
+def default_model(provider: str, tier: LLMTier) -> str:
+    if provider == "yandex":
+        return YANDEX_MODELS[tier]
+    if tier == LLMTier.FAST and settings.LLM_FAST_MODEL:
+        return settings.LLM_FAST_MODEL
+    return settings.LLM_MODEL
+
+
+def failover_providers() -> List[str]:
+    configured = [p.strip() for p in settings.LLM_FAILOVER_PROVIDERS.split(",") if p.strip()]
+    return [p for p in configured or sorted(PROVIDERS) if p in PROVIDERS and provider_available(p)]
+
+
+class ProviderHealth:
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], float] = {}
+        self.errors: Dict[str, Tuple[float, float]] = {}
+    
+    def error_rate(self, provider: str) -> float:
+        rate, updated = self.errors.get(provider, (0.0, 0.0))
+        return rate * 0.5 ** ((time.monotonic() - updated) / ERROR_HALF_LIFE)
+    
+    def healthy(self, provider: str) -> bool:
+        return self.error_rate(provider) < UNHEALTHY_ERROR_RATE
+    
+    def record(self, task: str, provider: str, elapsed: float, ok: bool) -> None:
+        rate = self.error_rate(provider)
+        rate += ERROR_ALPHA * ((0.0 if ok else 1.0) - rate)
+        self.errors[provider] = (rate, time.monotonic())
+        metrics.set_gauge("llm_provider_error_rate", rate, provider=provider)
+        if ok:
+            key = (task, provider)
+            current = self.latency.get(key)
+            self.latency[key] = elapsed if current is None else current + LATENCY_ALPHA * (elapsed - current)
+            metrics.set_gauge("llm_provider_latency_ewma", self.latency[key], task=task, provider=provider)
+    
+    def score(self, task: str, provider: str, route: LLMRoute, preferred: Optional[str]) -> float:
+        latency = self.latency.get((task, provider), route.slo_p95 or route.timeout)
+        score = latency * (1 + ERROR_PENALTY * self.error_rate(provider))
+        return score * PREFERRED_WEIGHT if provider == preferred else score
+    
+    def rank(self, task: str, route: LLMRoute, providers: List[str], preferred: Optional[str]) -> List[str]:
+        return sorted(providers, key=lambda p: (
+            circuit_open(p),
+            not self.healthy(p),
+            self.score(task, p, route, preferred)
+        ))
+    
+    def snapshot(self) -> List[LLMProviderHealth]:
+        result = []
+        for provider in sorted(PROVIDERS):
+            latencies = [value for (_, p), value in self.latency.items() if p == provider]
+            guard = provider_guard(provider)
+            result.append(LLMProviderHealth(
+                provider=provider,
+                configured=provider_available(provider),
+                healthy=self.healthy(provider) and not circuit_open(provider),
+                latency_ewma=sum(latencies) / len(latencies) if latencies else None,
+                error_rate=round(self.error_rate(provider), 4),
+                circuit=guard.breaker.state,
+                concurrency_limit=int(guard.limiter.limit),
+                in_flight=guard.limiter.in_flight
+            ))
+        return result
+
+
+class HedgeBudget:
+    def __init__(self, ratio: float, burst: float = HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+    
+    def deposit(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+    
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def hedge_delay(task: str, provider: str, model: str, metric: str = "llm_route_latency_seconds") -> Optional[float]:
+    labels = {"task": task, "provider": provider, "model": model}
+    if metrics.count(metric, **labels) < settings.LLM_HEDGE_MIN_SAMPLES:
+        return None
+    return metrics.percentile(metric, 0.95, **labels)
+
+
+class RouteTable:
+    def __init__(self, defaults: Dict[str, LLMRoute]):
+        self.routes: Dict[str, LLMRoute] = {task: route.model_copy() for task, route in defaults.items()}
+    
+    def get(self, task: str) -> LLMRoute:
+        return self.routes.get(task) or LLMRoute()
+    
+    def known(self, task: str) -> bool:
+        return task in DEFAULT_ROUTES
+    
+    def update(self, task: str, data: LLMRouteUpdate) -> LLMRoute:
+        if not self.known(task):
+            raise KeyError(task)
+        route = self.get(task).model_copy(update=data.model_dump(exclude_unset=True))
+        self.routes[task] = route
+        return route
+    
+    def load_overrides(self, raw: str) -> None:
+        if not raw:
+            return
+        try:
+            for task, values in json.loads(raw).items():
+                if not self.known(task):
+                    print(f"Unknown task in LLM_ROUTES, skipped: {task}")
+                    continue
+                self.update(task, LLMRouteUpdate(**values))
+        except Exception as e:
+            print(f"Invalid LLM_ROUTES, using defaults: {e}")
+    
+    def model_for(self, route: LLMRoute, provider: str) -> str:
+        if route.model and route.provider == provider:
+            return route.model
+        return default_model(provider, route.tier)
+    
+    def candidates(self, task: str) -> Tuple[LLMRoute, List[Tuple[str, str]]]:
+        route = self.get(task)
+        preferred = route.provider if provider_available(route.provider) else default_provider()
+        providers = failover_providers()
+        if preferred and preferred not in providers:
+            providers.append(preferred)
+        ranked = provider_health.rank(task, route, providers, preferred)
+        return route, [(provider, self.model_for(route, provider)) for provider in ranked]
+    
+    def status(self) -> List[LLMRouteStatus]:
+        result = []
+        for task in sorted(self.routes):
+            route, candidates = self.candidates(task)
+            provider, model = candidates[0] if candidates else (None, None)
+            labels = {"task": task, "provider": provider, "model": model}
+            count = metrics.count("llm_route_latency_seconds", **labels)
+            p95 = metrics.percentile("llm_route_latency_seconds", 0.95, **labels) if count else None
+            result.append(LLMRouteStatus(
+                task=task,
+                resolved_provider=provider,
+                resolved_model=model,
+                count=count,
+                errors=metrics.counter("llm_route_errors_total", **labels),
+                p50=metrics.percentile("llm_route_latency_seconds", 0.5, **labels) if count else None,
+                p95=p95,
+                slo_met=(p95 <= route.slo_p95) if p95 is not None and route.slo_p95 else None,
+                candidates=[candidate for candidate, _ in candidates],
+                **route.model_dump()
+            ))
+        return result
+
+
+def observe_route(task: str, provider: str, model: str, elapsed: float, error: Optional[Exception] = None) -> None:
+    labels = {"task": task, "provider": provider, "model": model}
+    provider_health.record(task, provider, elapsed, error is None)
+    if error is not None:
+        metrics.inc("llm_route_errors_total", **labels)
+        return
+    metrics.observe("llm_route_latency_seconds", elapsed, **labels)
+    slo = routes.get(task).slo_p95
+    if slo and elapsed > slo:
+        metrics.inc("llm_route_slo_exceeded_total", task=task)
+
+
+provider_health = ProviderHealth()
+hedge_budget = HedgeBudget(settings.LLM_HEDGE_BUDGET)
+routes = RouteTable(DEFAULT_ROUTES)
+routes.load_overrides(settings.LLM_ROUTES)
@@ -0,0 +1,206 @@
+import time
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models.models import Generation
+from app.schemas.schemas import GenerateRequest
+from app.services.similarity import normalize_text
+
+
+EMBEDDING_DIM = 256
+LSH_TABLES = 4
+LSH_BITS = 12
+INITIAL_ROWS = 1024
+NGRAM_SIZE = 3
+WARM_BATCH_SIZE = 1000
+BRIEF_FIELDS = {"description", "channels", "num_variants", "goal", "tone", "audience", "offer", "format"}
+
+BucketKey = Tuple[str, int, int]
+
+
+def embed(text: str) -> np.ndarray:
+    normalized = normalize_text(text)
+    features = normalized.split()
+    padded = f" {normalized} "
+    features += [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+    
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+    vector = np.bincount(hashes % EMBEDDING_DIM, weights=signs, minlength=EMBEDDING_DIM).astype(np.float32)
+    
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def brief_text(request: GenerateRequest) -> str:
+    return " ".join(part for part in (request.description, request.audience, request.offer) if part)
+
+
+def partition_key(request: GenerateRequest, user_id: int) -> str:
+    format_value = request.format.value if request.format else ""
+    tone_value = request.tone.value if request.tone else ""
+    channels = ",".join(sorted(request.channels))
+    return f"{user_id}|{channels}|{request.num_variants}|{request.goal.value}|{tone_value}|{format_value}"
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        capacity: int,
+        dim: int = EMBEDDING_DIM,
+        tables: int = LSH_TABLES,
+        bits: int = LSH_BITS
+    ):
+        self.capacity = capacity
+        self.dim = dim
+        self.tables = tables
+        self.bits = bits
+        self.planes = np.random.default_rng(42).standard_normal((tables * bits, dim)).astype(np.float32)
+        self.powers = 1 << np.arange(bits)
+        self.matrix = np.zeros((min(INITIAL_ROWS, capacity), dim), dtype=np.float16)
+        self.row_keys: List[List[BucketKey]] = []
+        self.payloads: List[Optional[int]] = []
+        self.rows_by_payload: Dict[int, int] = {}
+        self.buckets: Dict[BucketKey, List[int]] = defaultdict(list)
+        self.next_row = 0
+    
+    def __len__(self) -> int:
+        return len(self.rows_by_payload)
+    
+    def _codes(self, vector: np.ndarray) -> List[int]:
+        bits = ((self.planes @ vector) > 0).reshape(self.tables, self.bits)
+        return [int(code) for code in bits @ self.powers]
+    
+    def _grow(self) -> None:
+        rows = min(self.capacity, self.matrix.shape[0] * 2)
+        grown = np.zeros((rows, self.dim), dtype=np.float16)
+        grown[:self.matrix.shape[0]] = self.matrix
+        self.matrix = grown
+    
+    def _evict(self, row: int) -> None:
+        for key in self.row_keys[row]:
+            self.buckets[key].remove(row)
+            if not self.buckets[key]:
+                del self.buckets[key]
+        payload = self.payloads[row]
+        if payload is not None and self.rows_by_payload.get(payload) == row:
+            del self.rows_by_payload[payload]
+        self.row_keys[row] = []
+        self.payloads[row] = None
+    
+    def add(self, partition: str, text: str, payload: int) -> None:
+        vector = embed(text)
+        if payload in self.rows_by_payload:
+            self._evict(self.rows_by_payload[payload])
+        
+        row = self.next_row % self.capacity
+        if row >= self.matrix.shape[0]:
+            self._grow()
+        if row < len(self.row_keys):
+            self._evict(row)
+        else:
+            self.row_keys.append([])
+            self.payloads.append(None)
+        
+        keys = [(partition, table, code) for table, code in enumerate(self._codes(vector))]
+        self.matrix[row] = vector
+        self.row_keys[row] = keys
+        self.payloads[row] = payload
+        self.rows_by_payload[payload] = row
+        for key in keys:
+            self.buckets[key].append(row)
+        self.next_row += 1
+    
+    def discard(self, payload: int) -> None:
+        row = self.rows_by_payload.get(payload)
+        if row is not None:
+            self._evict(row)
+    
+    def lookup(self, partition: str, text: str, threshold: float) -> Optional[Tuple[int, float]]:
+        vector = embed(text)
+        
+        candidates = set()
+        for table, code in enumerate(self._codes(vector)):
+            for probe in [code] + [code ^ (1 << i) for i in range(self.bits)]:
+                candidates.update(self.buckets.get((partition, table, probe), ()))
+        if not candidates:
+            return None
+        
+        rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        scores = self.matrix[rows].astype(np.float32) @ vector
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < threshold:
+            return None
+        return self.payloads[rows[best]], score
+
+
+semantic_cache = SemanticCache(capacity=settings.SEMANTIC_CACHE_MAX_ENTRIES)
+
+
+def lookup_generation(request: GenerateRequest, user_id: int) -> Optional[Tuple[int, float]]:
+    if not settings.SEMANTIC_CACHE_ENABLED or not request.use_cache:
+        return None
+    
+    started = time.perf_counter()
+    hit = semantic_cache.lookup(
+        partition_key(request, user_id),
+        brief_text(request),
+        settings.SEMANTIC_CACHE_THRESHOLD
+    )
+    metrics.observe("semantic_cache_lookup_seconds", time.perf_counter() - started)
+    metrics.inc("semantic_cache_lookups_total", result="hit" if hit else "miss")
+    return hit
+
+
+def cacheable(request: GenerateRequest, results: Dict[str, List[Any]]) -> bool:
+    from app.services.llm import llm_available
+    
+    if not settings.SEMANTIC_CACHE_ENABLED or settings.MOCK_MODE or not llm_available():
+        return False
+    for channel in request.channels:
+        variants = results.get(channel)
+        if not variants:
+            return False
+        for variant in variants:
+            data = variant if isinstance(variant, dict) else variant.model_dump()
+            if not data.get("score") or data.get("retried") is False or data.get("issues"):
+                return False
+    return True
+
+
+def cache_brief(request: GenerateRequest) -> Dict[str, Any]:
+    return request.model_dump(mode="json", include=BRIEF_FIELDS)
+
+
+def remember_generation(request: GenerateRequest, user_id: int, generation_id: int) -> None:
+    semantic_cache.add(partition_key(request, user_id), brief_text(request), generation_id)
+    metrics.set_gauge("semantic_cache_entries", len(semantic_cache))
+
+
+async def load_semantic_cache(db: AsyncSession) -> None:
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return
+    last_id = 0
+    while True:
+        rows = (await db.execute(
+            select(Generation.id, Generation.user_id, Generation.brief)
+            .where(Generation.cacheable.is_(True), Generation.brief.isnot(None), Generation.id > last_id)
+            .order_by(Generation.id)
+            .limit(WARM_BATCH_SIZE)
+        )).all()
+        if not rows:
+            break
+        for generation_id, user_id, brief in rows:
+            try:
+                remember_generation(GenerateRequest(**brief), user_id, generation_id)
+            except (TypeError, ValidationError):
+                continue
+        last_id = rows[-1][0]
+    print(f"Semantic cache: {len(semantic_cache)} briefs loaded")
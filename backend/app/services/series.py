@@ -1,9 +1,12 @@
 import json
 from typing import List
-from openai import AsyncOpenAI
-import httpx
 from app.core.config import settings
+from app.core.deadline import DeadlineExceededError
 from app.schemas.schemas import ChannelResult, GoalEnum, ToneEnum
+from app.services.validator import enforce_constraints
+from app.services.budget import series_max_tokens
+from app.services.llm import complete, llm_available, LLMProviderError
+from app.services.prompts import PromptLayout
 
 
 SERIES_PROMPT = """Создай серию из {count} постов на тему: {topic}
@@ -41,46 +44,10 @@ FORMAT_INSTRUCTIONS = {
 }
 
 
-async def generate_series_openai(
-    topic: str,
-    channel: str,
-    count: int,
-    goal: GoalEnum,
-    tone: ToneEnum,
-    format_type: str = "short"
-) -> List[ChannelResult]:
-    client = AsyncOpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=getattr(settings, 'LLM_BASE_URL', None)
-    )
-    
-    format_instruction = FORMAT_INSTRUCTIONS.get(format_type, FORMAT_INSTRUCTIONS["short"])
-    
-    prompt = SERIES_PROMPT.format(
-        count=count,
-        topic=topic,
-        channel=channel,
-        goal=goal.value if isinstance(goal, GoalEnum) else goal,
-        tone=tone.value if isinstance(tone, ToneEnum) else tone
-    )
-    
-    prompt += f"\n\nФормат поста: {format_instruction}"
-    
-    response = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=[
-            {"role": "system", "content": "Ты — профессиональный контент-маркетолог. Создаёшь серии вовлекающих постов."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.8,
-        max_tokens=4000
-    )
-    
-    content = response.choices[0].message.content or "[]"
-    return parse_series_response(content, count)
+SERIES_SYSTEM_PROMPT = "Ты — профессиональный контент-маркетолог. Создаёшь серии вовлекающих постов."
 
 
-async def generate_series_yandex(
+async def generate_series_llm(
     topic: str,
     channel: str,
     count: int,
@@ -100,29 +67,12 @@ async def generate_series_yandex(
     
     prompt += f"\n\nФормат поста: {format_instruction}"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers={
-                "Authorization": f"Api-Key {settings.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "modelUri": f"gpt://{settings.YANDEX_API_KEY}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.8,
-                    "maxTokens": 4000
-                },
-                "messages": [
-                    {"role": "system", "text": "Ты — профессиональный контент-маркетолог. Создаёшь серии вовлекающих постов."},
-                    {"role": "user", "text": prompt}
-                ]
-            },
-            timeout=60.0
-        )
-        content = response.json()["result"]["alternatives"][0]["message"]["text"]
-        return parse_series_response(content, count)
+    content = await complete(
+        "series",
+        PromptLayout(SERIES_SYSTEM_PROMPT, [], [prompt]),
+        max_tokens=series_max_tokens(count, format_type)
+    )
+    return parse_series_response(content or "[]", count)
 
 
 def generate_mock_series(topic: str, channel: str, count: int) -> List[ChannelResult]:
@@ -187,16 +137,16 @@ async def generate_series(
     tone: ToneEnum = ToneEnum.FRIENDLY,
     format_type: str = "short"
 ) -> List[ChannelResult]:
-    if settings.MOCK_MODE:
+    if settings.MOCK_MODE or not llm_available():
         return generate_mock_series(topic, channel, count)
     
     try:
-        if settings.LLM_PROVIDER == "yandex" and settings.YANDEX_API_KEY:
-            return await generate_series_yandex(topic, channel, count, goal, tone, format_type)
-        elif settings.OPENAI_API_KEY:
-            return await generate_series_openai(topic, channel, count, goal, tone, format_type)
-        else:
-            return generate_mock_series(topic, channel, count)
+        posts = await generate_series_llm(topic, channel, count, goal, tone, format_type)
+    except (LLMProviderError, DeadlineExceededError):
+        raise
     except Exception as e:
         print(f"Error generating series: {e}")
         return generate_mock_series(topic, channel, count)
+    
+    fixed = await enforce_constraints({channel: posts}, use_llm=False, strict=format_type == "short")
+    return fixed[channel]
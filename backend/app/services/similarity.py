@@ -0,0 +1,93 @@
+import re
+import hashlib
+from typing import List, Optional, Set
+from app.schemas.schemas import ChannelResult
+
+
+NUM_PERM = 64
+SHINGLE_SIZE = 5
+MERSENNE_PRIME = (1 << 61) - 1
+
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % MERSENNE_PRIME | 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % MERSENNE_PRIME
+    )
+    for i in range(NUM_PERM)
+]
+
+HASHTAG_RE = re.compile(r"#\w+")
+NON_WORD_RE = re.compile(r"[^\w\s]+")
+SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = (text or "").lower().replace("ё", "е")
+    text = HASHTAG_RE.sub(" ", text)
+    text = NON_WORD_RE.sub(" ", text)
+    return SPACES_RE.sub(" ", text).strip()
+
+
+def variant_text(variant: ChannelResult) -> str:
+    return normalize_text(f"{variant.headline or ''} {variant.body}")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash(items: Set[str]) -> List[int]:
+    if not items:
+        return [MERSENNE_PRIME] * NUM_PERM
+    
+    hashes = [
+        int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        for item in items
+    ]
+    return [
+        min((a * h + b) % MERSENNE_PRIME for h in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def signature_similarity(first: List[int], second: List[int]) -> float:
+    return sum(1 for x, y in zip(first, second) if x == y) / NUM_PERM
+
+
+def similarity_matrix(texts: List[str]) -> List[List[float]]:
+    signatures = [minhash(shingles(text)) for text in texts]
+    size = len(texts)
+    matrix = [[1.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(i + 1, size):
+            score = round(signature_similarity(signatures[i], signatures[j]), 3)
+            matrix[i][j] = matrix[j][i] = score
+    return matrix
+
+
+def max_similarities(matrix: List[List[float]]) -> List[Optional[float]]:
+    return [
+        max((score for j, score in enumerate(row) if j != i), default=None)
+        for i, row in enumerate(matrix)
+    ]
+
+
+def find_duplicates(matrix: List[List[float]], threshold: float) -> List[int]:
+    duplicates = []
+    for j in range(len(matrix)):
+        if any(matrix[i][j] >= threshold for i in range(j) if i not in duplicates):
+            duplicates.append(j)
+    return duplicates
+
+
+def annotate_similarity(variants: List[ChannelResult]) -> List[ChannelResult]:
+    if len(variants) < 2:
+        return variants
+    
+    matrix = similarity_matrix([variant_text(v) for v in variants])
+    return [
+        variant.model_copy(update={"similarity": score})
+        for variant, score in zip(variants, max_similarities(matrix))
+    ]
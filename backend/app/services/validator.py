@@ -0,0 +1,266 @@
+import re
+import json
+import asyncio
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.schemas.schemas import ChannelResult
+from app.services.llm import complete, llm_available, strip_json_fences
+from app.services.prompts import PromptLayout
+
+
+CHANNEL_LIMITS = {
+    "Директ": {"headline": 35, "body": 81},
+    "Telegram": {"body": 800},
+    "Email": {"headline": 50, "body": 500},
+    "VK": {"body": 500},
+    "Дзен": {"headline": 80, "body": 1500}
+}
+
+HASHTAG_CHANNELS = {"Telegram", "VK", "Дзен"}
+MIN_HASHTAGS = 3
+MAX_HASHTAGS = 5
+
+EMOJI_LIMITS = {
+    "Директ": 0,
+    "Telegram": 4,
+    "Email": 3,
+    "VK": 5
+}
+
+MIN_KEEP_RATIO = 0.6
+
+EMOJI_RE = re.compile(
+    "[\U0001F300-\U0001FAFF\U0001F1E6-\U0001F1FF\u2600-\u27BF\u2B50\u2B55\u203C\u2049]\uFE0F?"
+)
+SENTENCE_END_RE = re.compile(r"[.!?…](?=\s|$)|\n")
+
+FIX_PROMPT = """Исправь поля маркетингового текста для канала {channel}. Остальные поля не меняй.
+
+{fields}
+
+Верни JSON только с исправленными полями, например {{"body": "..."}}. Сохрани смысл и призыв к действию."""
+
+FIX_SYSTEM_PROMPT = "Ты — редактор рекламных текстов. Точно соблюдаешь ограничения площадок."
+
+
+def channel_limits(channel: str, strict: bool = True) -> Dict[str, int]:
+    limits = CHANNEL_LIMITS.get(channel, {})
+    if strict or channel == "Директ":
+        return limits
+    return {field: limit for field, limit in limits.items() if field != "body"}
+
+
+def count_emoji(text: str) -> int:
+    return len(EMOJI_RE.findall(text or ""))
+
+
+def strip_extra_emoji(text: str, limit: int) -> str:
+    seen = 0
+    
+    def replace(match):
+        nonlocal seen
+        seen += 1
+        return match.group(0) if seen <= limit else ""
+    
+    return re.sub(r" {2,}", " ", EMOJI_RE.sub(replace, text))
+
+
+def normalize_hashtag(tag: str) -> Optional[str]:
+    word = re.sub(r"[^\w]", "", str(tag).strip().lstrip("#"))
+    return f"#{word}" if word else None
+
+
+def normalize_hashtags(tags: Optional[List[str]]) -> Optional[List[str]]:
+    if not tags:
+        return tags
+    
+    result = []
+    seen = set()
+    for tag in tags:
+        normalized = normalize_hashtag(tag)
+        if normalized and normalized.lower() not in seen:
+            seen.add(normalized.lower())
+            result.append(normalized)
+    return result[:MAX_HASHTAGS]
+
+
+def smart_truncate(text: str, limit: int) -> Optional[str]:
+    if len(text) <= limit:
+        return text
+    
+    cut = text[:limit]
+    ends = [m.end() for m in SENTENCE_END_RE.finditer(cut)]
+    if ends and ends[-1] >= limit * MIN_KEEP_RATIO:
+        return cut[:ends[-1]].rstrip()
+    return None
+
+
+def hard_truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    
+    cut = text[:limit - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(" ,;:—-") + "…"
+
+
+def validate_result(result: ChannelResult, channel: str, strict: bool = True) -> List[dict]:
+    violations = []
+    
+    for field, limit in channel_limits(channel, strict).items():
+        value = getattr(result, field) or ""
+        if len(value) > limit:
+            violations.append({
+                "field": field,
+                "code": "too_long",
+                "limit": limit,
+                "message": f"{field}: {len(value)} символов при лимите {limit}"
+            })
+    
+    if not (result.cta or "").strip():
+        violations.append({"field": "cta", "code": "missing", "message": "cta: нет призыва к действию"})
+    
+    if channel in HASHTAG_CHANNELS:
+        tags = result.hashtags or []
+        if len(tags) < MIN_HASHTAGS:
+            violations.append({
+                "field": "hashtags",
+                "code": "too_few",
+                "message": f"hashtags: {len(tags)} при минимуме {MIN_HASHTAGS}"
+            })
+        if any(normalize_hashtag(tag) != tag for tag in tags):
+            violations.append({"field": "hashtags", "code": "format", "message": "hashtags: неверный формат"})
+    
+    emoji_limit = EMOJI_LIMITS.get(channel)
+    if emoji_limit is not None and count_emoji(result.body) > emoji_limit:
+        violations.append({
+            "field": "body",
+            "code": "emoji",
+            "message": f"body: {count_emoji(result.body)} эмодзи при лимите {emoji_limit}"
+        })
+    
+    return violations
+
+
+def apply_local_fixes(result: ChannelResult, channel: str, strict: bool = True) -> ChannelResult:
+    update = {}
+    
+    if result.hashtags:
+        update["hashtags"] = normalize_hashtags(result.hashtags)
+    
+    body = result.body
+    emoji_limit = EMOJI_LIMITS.get(channel)
+    if emoji_limit is not None and count_emoji(body) > emoji_limit:
+        body = strip_extra_emoji(body, emoji_limit).strip()
+    
+    for field, limit in channel_limits(channel, strict).items():
+        value = body if field == "body" else getattr(result, field)
+        if value and len(value) > limit:
+            truncated = smart_truncate(value, limit)
+            if truncated:
+                if field == "body":
+                    body = truncated
+                else:
+                    update[field] = truncated
+    
+    if body != result.body:
+        update["body"] = body
+    
+    return result.model_copy(update=update) if update else result
+
+
+def apply_hard_fixes(result: ChannelResult, channel: str, strict: bool = True) -> ChannelResult:
+    update = {}
+    for field, limit in channel_limits(channel, strict).items():
+        value = getattr(result, field)
+        if value and len(value) > limit:
+            update[field] = hard_truncate(value, limit)
+    return result.model_copy(update=update) if update else result
+
+
+def build_fix_prompt(result: ChannelResult, channel: str, violations: List[dict]) -> str:
+    lines = []
+    for field in dict.fromkeys(v["field"] for v in violations):
+        problems = "; ".join(v["message"] for v in violations if v["field"] == field)
+        current = getattr(result, field)
+        if field == "hashtags":
+            lines.append(f"- hashtags ({problems}): верни {MIN_HASHTAGS}-{MAX_HASHTAGS} продающих хештегов, сейчас: {current or []}")
+        elif field == "cta":
+            lines.append(f"- cta ({problems}): придумай короткий призыв к действию для текста: \"{result.body[:300]}\"")
+        else:
+            lines.append(f"- {field} ({problems}):\n\"{current}\"")
+    
+    return FIX_PROMPT.format(channel=channel, fields="\n".join(lines))
+
+
+async def request_llm_fix(result: ChannelResult, channel: str, violations: List[dict]) -> dict:
+    prompt = build_fix_prompt(result, channel, violations)
+    
+    if not llm_available():
+        return {}
+    
+    content = await complete("constraint_fix", PromptLayout(FIX_SYSTEM_PROMPT, [], [prompt]))
+    data = json.loads(strip_json_fences(content or "{}"))
+    fields = {v["field"] for v in violations}
+    fixed = {}
+    for field in fields:
+        value = data.get(field) if isinstance(data, dict) else None
+        if field == "hashtags" and isinstance(value, list):
+            fixed[field] = [str(tag) for tag in value]
+        elif isinstance(value, str) and value.strip():
+            fixed[field] = value.strip()
+    return fixed
+
+
+def llm_fix_available() -> bool:
+    return (
+        settings.CONSTRAINT_LLM_FIX
+        and not settings.MOCK_MODE
+        and llm_available()
+    )
+
+
+async def fix_channel_result(
+    result: ChannelResult,
+    channel: str,
+    use_llm: bool = True,
+    strict: bool = True
+) -> ChannelResult:
+    if result.score == 0:
+        return result
+    
+    violations = validate_result(result, channel, strict)
+    for violation in violations:
+        metrics.inc("constraint_violations_total", channel=channel, field=violation["field"], code=violation["code"])
+    
+    result = apply_local_fixes(result, channel, strict)
+    violations = validate_result(result, channel, strict)
+    
+    if violations and use_llm and llm_fix_available():
+        try:
+            fixed = await request_llm_fix(result, channel, violations)
+            if fixed:
+                result = apply_local_fixes(result.model_copy(update=fixed), channel, strict)
+                metrics.inc("constraint_llm_fixes_total", channel=channel)
+        except Exception as e:
+            print(f"Constraint fix failed for {channel}: {e}")
+    
+    result = apply_hard_fixes(result, channel, strict)
+    remaining = validate_result(result, channel, strict)
+    
+    return result.model_copy(update={"issues": [v["message"] for v in remaining] or None})
+
+
+async def enforce_constraints(
+    results: Dict[str, List[ChannelResult]],
+    use_llm: bool = True,
+    strict: bool = True
+) -> Dict[str, List[ChannelResult]]:
+    channels = list(results.keys())
+    fixed = await asyncio.gather(*[
+        asyncio.gather(*[fix_channel_result(v, channel, use_llm, strict) for v in results[channel]])
+        for channel in channels
+    ])
+    return {channel: list(variants) for channel, variants in zip(channels, fixed)}
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import time
+import httpx
+
+
+CHANNELS = ["Telegram", "VK", "Email"]
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> str:
+    response = await client.post("/api/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_stream(client: httpx.AsyncClient, token: str, index: int, stats: dict) -> None:
+    started = time.monotonic()
+    first_event = None
+    payload = {
+        "description": f"Нагрузочный тест потоковой генерации, запрос номер {index}",
+        "channels": CHANNELS,
+        "num_variants": 1
+    }
+    try:
+        async with client.stream(
+            "POST",
+            "/api/generate/stream",
+            json=payload,
+            headers={"Authorization": f"Bearer {token}", "Idempotency-Key": f"load-{started}-{index}"}
+        ) as response:
+            if response.status_code == 503:
+                stats["rejected"] += 1
+                stats["retry_after"].append(float(response.headers.get("retry-after", 0)))
+                return
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_event is None and line.startswith("event: "):
+                    first_event = time.monotonic() - started
+                if line == "event: done":
+                    stats["completed"] += 1
+                    stats["first_event"].append(first_event)
+                    stats["duration"].append(time.monotonic() - started)
+                    return
+        stats["incomplete"] += 1
+    except Exception as e:
+        stats["failed"] += 1
+        stats["errors"][type(e).__name__] = stats["errors"].get(type(e).__name__, 0) + 1
+
+
+async def probe_history(client: httpx.AsyncClient, token: str, stop: asyncio.Event, stats: dict, interval: float) -> None:
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            response = await client.get("/api/history", params={"limit": 5}, headers={"Authorization": f"Bearer {token}"})
+            response.raise_for_status()
+            stats["history"].append(time.monotonic() - started)
+        except Exception:
+            stats["history_failed"] += 1
+        await asyncio.sleep(interval)
+
+
+async def fetch_metrics(client: httpx.AsyncClient, token: str) -> dict:
+    response = await client.get("/api/metrics", headers={"Authorization": f"Bearer {token}"})
+    if response.status_code != 200:
+        return {}
+    data = response.json()
+    found = {}
+    for section in data.values():
+        if isinstance(section, dict):
+            found.update({k: v for k, v in section.items() if k.startswith(("db_", "admission_"))})
+    return found
+
+
+async def main(args) -> None:
+    limits = httpx.Limits(max_connections=args.streams + 10, max_keepalive_connections=args.streams + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        token = await login(client, args.email, args.password)
+        stats = {
+            "completed": 0, "incomplete": 0, "failed": 0, "rejected": 0, "retry_after": [], "errors": {},
+            "first_event": [], "duration": [], "history": [], "history_failed": 0
+        }
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_history(client, token, stop, stats, args.probe_interval))
+        
+        started = time.monotonic()
+        await asyncio.gather(*[run_stream(client, token, i, stats) for i in range(args.streams)])
+        elapsed = time.monotonic() - started
+        stop.set()
+        await probe
+        
+        print(f"Streams: {args.streams} in {elapsed:.1f}s — completed {stats['completed']}, "
+              f"incomplete {stats['incomplete']}, rejected {stats['rejected']} (503), "
+              f"failed {stats['failed']} {stats['errors'] or ''}")
+        if stats["retry_after"]:
+            print(f"Retry-After: min {min(stats['retry_after']):.0f}s, max {max(stats['retry_after']):.0f}s")
+        print(f"First event: p50 {percentile(stats['first_event'], 0.5):.2f}s, p95 {percentile(stats['first_event'], 0.95):.2f}s")
+        print(f"Stream duration: p50 {percentile(stats['duration'], 0.5):.2f}s, p95 {percentile(stats['duration'], 0.95):.2f}s")
+        print(f"/api/history during load: {len(stats['history'])} ok, {stats['history_failed']} failed, "
+              f"p50 {percentile(stats['history'], 0.5) * 1000:.0f}ms, p95 {percentile(stats['history'], 0.95) * 1000:.0f}ms, "
+              f"max {max(stats['history'] or [0]) * 1000:.0f}ms")
+        
+        found = await fetch_metrics(client, token)
+        if found:
+            print("Pool and admission metrics:", json.dumps(found, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent /api/generate/stream load test")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--streams", type=int, default=300)
+    parser.add_argument("--probe-interval", type=float, default=0.25)
+    parser.add_argument("--timeout", type=float, default=300)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,28 @@
+from app.services.local_improve import shorten
+from app.services.validator import CHANNEL_LIMITS
+
+
+CTA = "Успейте купить по специальной цене!"
+
+
+def test_shorten_keeps_cta_whole_when_lead_and_cta_overflow():
+    lead = "Новая коллекция зимней обуви уже в магазине " + "и радует тёплыми моделями " * 40 + "на любой вкус."
+    text = f"{lead} Доставка по всей России. {CTA}"
+    limit = CHANNEL_LIMITS["Telegram"]["body"]
+    assert len(lead) + len(CTA) + 1 > limit
+    
+    result = shorten(text, "Telegram")
+    
+    assert len(result) <= limit
+    assert result.endswith(CTA)
+    assert result.startswith("Новая коллекция")
+
+
+def test_shorten_drops_cta_when_no_room_for_lead():
+    text = "Зимние ботинки из натуральной кожи со скидкой тридцать процентов. Успейте купить зимние ботинки по самой выгодной цене сезона!"
+    limit = CHANNEL_LIMITS["Директ"]["body"]
+    
+    result = shorten(text, "Директ")
+    
+    assert len(result) <= limit
+    assert "Успейте" not in result
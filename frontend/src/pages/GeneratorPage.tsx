@@ -29,6 +29,7 @@ export function GeneratorPage() {
   const [offer, setOffer] = useState('')
   const [loading, setLoading] = useState(false)
   const [results, setResults] = useState<Record<string, ChannelResult[]> | null>(null)
+  const [cacheSimilarity, setCacheSimilarity] = useState<number | null>(null)
   const [copied, setCopied] = useState<string | null>(null)
   const [error, setError] = useState<string | null>(null)
 
@@ -75,9 +76,10 @@ export function GeneratorPage() {
     await generateNormal()
   }
 
-  const generateNormal = async () => {
+  const generateNormal = async (useCache = true) => {
     setLoading(true)
     setResults(null)
+    setCacheSimilarity(null)
     try {
       const request: GenerateRequest = {
         description,
@@ -88,9 +90,11 @@ export function GeneratorPage() {
         audience: audience || undefined,
         offer: offer || undefined,
         format,
+        use_cache: useCache,
       }
       const resp = await generateApi.generate(request)
       setResults(resp.results)
+      setCacheSimilarity(resp.cached ? resp.cache_similarity ?? 1 : null)
     } catch {
       setError('Ошибка генерации')
     } finally {
@@ -300,6 +304,19 @@ export function GeneratorPage() {
 
           {results && (
             <div className="max-w-4xl mx-auto space-y-6">
+              {cacheSimilarity !== null && (
+                <div className="flex items-center justify-between gap-3 p-3 bg-amber-50 dark:bg-amber-900/20 border border-amber-100 dark:border-amber-800 text-amber-700 dark:text-amber-300 rounded-lg text-sm">
+                  <span>Показан результат похожего прошлого запроса (сходство {Math.round(cacheSimilarity * 100)}%)</span>
+                  <button
+                    type="button"
+                    onClick={() => generateNormal(false)}
+                    disabled={loading}
+                    className="shrink-0 px-3 py-1 rounded-lg bg-white dark:bg-gray-800 border border-amber-200 dark:border-amber-700 text-xs font-medium hover:bg-amber-100 dark:hover:bg-amber-900/40 disabled:opacity-50"
+                  >
+                    Сгенерировать заново
+                  </button>
+                </div>
+              )}
               {channels.map((channel) => 
                 results[channel] ? (
                   <div key={channel} className="space-y-4">
@@ -168,51 +168,86 @@ export const calendarApi = {
   },
 };
 
+const STREAM_RECONNECT_ATTEMPTS = 5
+const STREAM_RECONNECT_DELAY_MS = 1000
+
 export const streamApi = {
   generateStream: async function* (
     data: GenerateRequest,
     token: string
   ): AsyncGenerator<{ channel: string; variants: ChannelResult[] }> {
-    const response = await fetch(`${API_BASE}/generate/stream`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        'Authorization': `Bearer ${token}`,
-      },
-      body: JSON.stringify(data),
-    })
-
-    if (!response.ok) {
-      throw new Error('Failed to start stream')
-    }
-
-    const reader = response.body?.getReader()
-    if (!reader) throw new Error('No reader')
-
-    const decoder = new TextDecoder()
-    let buffer = ''
+    const idempotencyKey = crypto.randomUUID()
+    let generationId: string | null = null
+    let lastEventId = ''
+    let attempts = 0
 
     while (true) {
-      const { done, value } = await reader.read()
-      if (done) break
-
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        if (line.startsWith('data: ')) {
-          const dataStr = line.slice(6)
-          try {
-            const parsed = JSON.parse(dataStr)
-            if (parsed.channel && parsed.variants) {
-              yield parsed
+      let response: Response
+      try {
+        const headers: Record<string, string> = {
+          'Authorization': `Bearer ${token}`,
+          'Idempotency-Key': idempotencyKey,
+        }
+        if (lastEventId) headers['Last-Event-ID'] = lastEventId
+        response = generationId
+          ? await fetch(`${API_BASE}/generate/stream/${generationId}`, { headers })
+          : await fetch(`${API_BASE}/generate/stream`, {
+              method: 'POST',
+              headers: { ...headers, 'Content-Type': 'application/json' },
+              body: JSON.stringify(data),
+            })
+      } catch (error) {
+        if (++attempts > STREAM_RECONNECT_ATTEMPTS) throw error
+        await new Promise((resolve) => setTimeout(resolve, STREAM_RECONNECT_DELAY_MS * attempts))
+        continue
+      }
+
+      if (!response.ok) {
+        throw new Error('Failed to start stream')
+      }
+      generationId = response.headers.get('X-Generation-Id') || generationId
+
+      const reader = response.body?.getReader()
+      if (!reader) throw new Error('No reader')
+
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let finished = false
+
+      try {
+        while (true) {
+          const { done, value } = await reader.read()
+          if (done) break
+          attempts = 0
+
+          buffer += decoder.decode(value, { stream: true })
+          const lines = buffer.split('\n')
+          buffer = lines.pop() || ''
+
+          for (const line of lines) {
+            if (line.startsWith('id: ')) {
+              lastEventId = line.slice(4)
+            } else if (line.startsWith('event: ')) {
+              finished = finished || ['done', 'error', 'cancelled'].includes(line.slice(7))
+            } else if (line.startsWith('data: ')) {
+              const dataStr = line.slice(6)
+              try {
+                const parsed = JSON.parse(dataStr)
+                if (parsed.channel && parsed.variants) {
+                  yield parsed
+                }
+              } catch {
+                // ignore parse errors
+              }
             }
-          } catch {
-            // ignore parse errors
           }
         }
+      } catch (error) {
+        if (!generationId || ++attempts > STREAM_RECONNECT_ATTEMPTS) throw error
       }
+
+      if (finished || !generationId || ++attempts > STREAM_RECONNECT_ATTEMPTS) return
+      await new Promise((resolve) => setTimeout(resolve, STREAM_RECONNECT_DELAY_MS))
     }
   },
 };
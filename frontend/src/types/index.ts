@@ -23,6 +23,7 @@ export interface GenerateRequest {
   audience?: string;
   offer?: string;
   format?: PostFormat;
+  use_cache?: boolean;
 }
 
 export interface ChannelResult {
@@ -34,11 +35,15 @@ export interface ChannelResult {
   image_url?: string;
   score: number;
   improvements?: string[];
+  retried?: boolean | null;
 }
 
 export interface GenerateResponse {
   results: Record<string, ChannelResult[]>;
   generation_id: number | null;
+  cached?: boolean;
+  cache_similarity?: number | null;
+  failed_channels?: Record<string, number[]>;
 }
 
 export interface Generation {